@@ -1,13 +1,29 @@
 from flask_api import FlaskAPI
-from flask_sqlalchemy import SQLAlchemy
-from flask import request, jsonify, abort, make_response, url_for
+from flask import request, abort, make_response, url_for, Response, stream_with_context, g
+from flask import json as flask_json
+import csv
 import datetime
-from sqlalchemy.sql import operators, extract, func
+import io
+import json
+import tempfile
+from sqlalchemy.sql import operators, extract, func, and_
+from werkzeug.formparser import parse_form_data
 from instance.config import app_config, Config
+from .encoders import jsonify, jsonify_stream, init_json
+from .pagination import encode_cursor, decode_cursor
+from .pool import PooledSQLAlchemy, pool_stats
+from .validation import parse_amount, parse_expense, parse_expense_changes, parse_fields
 import os
 
 # initialize sql-alchemy
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
+
+
+def upload_stream_factory(total_content_length, filename, content_type, content_length=None):
+    """Spools the uploads to a temporary file. werkzeug's default SpooledTemporaryFile has no
+    readable() before Python 3.11, so it cannot be wrapped in an io.TextIOWrapper.
+    """
+    return tempfile.TemporaryFile('w+b')
 
 
 def create_app(config_name):
@@ -21,7 +37,70 @@ def create_app(config_name):
 
     db.init_app(app)
 
-    from .models import ExpenseTracker, User
+    from .models import ExpenseTracker, User, DailyTotal
+    from .search import search_terms, search_values, filter_values, batch_selection, FILTERS
+    from . import archive, reads, export
+    from .cache import init_report_cache
+    from .auth.hashing import init_password_hasher
+    from .metrics import init_metrics, render_metrics, scrape_allowed
+    from .slow_query import init_slow_query_log
+    from .etags import init_etags, not_modified, mark_changed
+    from .compression import init_compression
+    from .replicas import init_replicas
+    from .partitioning import init_partitions
+
+    # the after request functions run last registered first, compressing must come after the others
+    init_compression(app)
+    init_report_cache(app)
+    init_password_hasher(app)
+    init_json(app)
+    init_metrics(app)
+    init_slow_query_log(app)
+    init_etags(app)
+    init_replicas(app)
+    init_partitions(app)
+
+    def authenticate():
+        """Gets the user id from the access token in the Authorization header.
+        Returns a (user_id, None) tuple, or (None, response) with the error response to send back.
+        """
+        auth_header = request.headers.get('Authorization')
+        if auth_header is None:
+            message = 'Authorization header missing'
+        elif auth_header == '':
+            message = 'Please insert Bearer token'
+        elif len(auth_header.split(" ")) < 2:
+            message = 'Authorization token should start with keyword Bearer'
+        elif not auth_header.split(" ")[1]:
+            message = 'Please enter an access token'
+        else:
+            user_id = User.decode_token(auth_header.split(" ")[1])
+            if not isinstance(user_id, str):
+                return user_id, None
+            # user is not legit, so the payload is an error message
+            message = user_id
+        response = jsonify({
+            'message': message,
+            'status': 'error'
+        })
+        response.status_code = 401
+        return None, response
+
+    def expense_filters():
+        """Reads the values of the filters of the name, start_date and end_date query parameters.
+        Returns a (filters, None) tuple, or (None, response) with the error response to send back.
+        """
+        try:
+            filters = filter_values(request.args)
+        except ValueError as e:
+            response = jsonify({
+                'message': str(e),
+                'status': 'error'
+            })
+            response.status_code = 400
+            return None, response
+
+        return filters, None
 
     @app.route('/expenses/', methods=['POST', 'GET'])
     def expense():
@@ -58,40 +137,19 @@ def create_app(config_name):
                 # Go ahead and handle the request, the user is authenticated
 
                 if request.method == "POST":
-                    name = str(request.data.get('name', ''))
-                    amount = str(request.data.get('amount', '')).strip()
                     try:
-                        amount_num = float(amount)
-                    except ValueError:
+                        values = parse_expense(request.data)
+                    except ValueError as e:
                         response = jsonify({
-                            'message': f'the amount entered is not a valid number',
-                            'status': 'error'
-                        })
-                        response.status_code = 400
-                        return response
-                    date_of_expense = str(request.data.get('date_of_expense', '')).strip()
-                    try:
-                        date = datetime.datetime.strptime(date_of_expense, '%d-%m-%Y')
-                    except ValueError:
-                        response = jsonify({
-                            'message': f'The date {date_of_expense} does not match the format DD-MM-YYYY',
+                            'message': str(e),
                             'status': 'error'
                         })
                         response.status_code = 400
 
                         return response
 
-                    if not name:
-                        response = jsonify({
-                            'message': 'PLease enter a valid name',
-                            'status': 'error'
-                        })
-                        response.status_code = 400
-
-                        return response
-
-                    expense = ExpenseTracker(name=name, amount=amount_num, date_of_expense=date,
-                                             belongs_to=user_id)
+                    expense = ExpenseTracker(name=values['name'], amount=values['amount_spent'],
+                                             date_of_expense=values['date_of_expense'], belongs_to=user_id)
                     expense.save()
                     response = jsonify({
                         'id': expense.id,
@@ -108,8 +166,9 @@ def create_app(config_name):
 
                 else:
                     # GET
-
-                    results = []
+                    response = not_modified(user_id)
+                    if response:
+                        return response
 
                     # get the query string for limit if it exists and for pagination
                     # if the query parameter for limit doesn't exist, 20 is used by default
@@ -137,42 +196,80 @@ def create_app(config_name):
                     if limit < 1 or page < 1:
                         return abort(404, 'Page or Limit must be greater than 1')
 
-                    queries = []
-                    search_str = request.args.get('name')
-
-                    if search_str:
-                        queries.append(ExpenseTracker.name.ilike(f'%{search_str}%'))
-
-                    start_date_str = request.args.get('start_date')
+                    filters, response = expense_filters()
+                    if response:
+                        return response
 
-                    if start_date_str:
+                    # only select the columns of the fields asked for
+                    fields = reads.ALL_FIELDS
+                    if 'fields' in request.args:
                         try:
-                            start_date = datetime.datetime.strptime(start_date_str, '%d-%m-%Y')
-                        except ValueError:
+                            fields = parse_fields(request.args.get('fields'), ExpenseTracker.ITEM_COLUMNS)
+                        except ValueError as e:
                             response = jsonify({
-                                'message': f'The date {start_date_str} does not match the format DD-MM-YYYY',
+                                'message': str(e),
                                 'status': 'error'
                             })
                             response.status_code = 400
 
                             return response
-                        queries.append(ExpenseTracker.date_of_expense >= start_date)
 
-                    end_date_str = request.args.get('end_date')
-                    if end_date_str:
-                        try:
-                            end_date = datetime.datetime.strptime(end_date_str, '%d-%m-%Y')
-                        except ValueError:
+                    search = None
+                    if 'q' in request.args:
+                        # relevance ranked search, best matches first
+                        terms = search_terms(request.args.get('q'))
+                        if not terms:
                             response = jsonify({
-                                'message': f'The date {end_date_str} does not match the format DD-MM-YYYY',
+                                'message': 'Please enter a valid search term',
                                 'status': 'error'
                             })
                             response.status_code = 400
 
                             return response
-                        queries.append(ExpenseTracker.date_of_expense <= end_date)
+                        if 'cursor' in request.args:
+                            response = jsonify({
+                                'message': 'A search with q cannot be paged with a cursor',
+                                'status': 'error'
+                            })
+                            response.status_code = 400
 
-                    expenses = ExpenseTracker.query.filter_by(belongs_to=user_id).filter(*queries).paginate(page, limit)
+                            return response
+                        search = search_values(terms, db.engine.dialect.name)
+
+                    if 'cursor' in request.args:
+                        # keyset pagination: seek past the last (date_of_expense, id) seen
+                        # instead of using OFFSET, and skip the COUNT(*) entirely
+                        cursor = request.args.get('cursor')
+                        position = None
+                        if cursor:
+                            try:
+                                position = decode_cursor(cursor)
+                            except ValueError as e:
+                                response = jsonify({
+                                    'message': str(e),
+                                    'status': 'error'
+                                })
+                                response.status_code = 400
+
+                                return response
+
+                        # fetch one extra row to find out whether there is a next page
+                        rows = reads.expenses_after(user_id, position, limit + 1, fields, filters)
+
+                        next_cursor = None
+                        if len(rows) > limit:
+                            rows = rows[:limit]
+                            next_cursor = encode_cursor(rows[-1].date_of_expense, rows[-1].id)
+
+                        return make_response(jsonify_stream({
+                            'items': reads.items(rows, fields),
+                            'next_cursor': next_cursor,
+                        })), 200
+
+                    expenses = reads.expense_page(user_id, page, limit, fields, filters, search)
+                    if expenses is None:
+                        # past the last page, like paginate
+                        abort(404)
 
                     if page == 1:
                         prev_page = None
@@ -184,20 +281,8 @@ def create_app(config_name):
                     else:
                         next_page = None
 
-                    for expense in expenses.items:
-                        obj = {
-                            'id': expense.id,
-                            'name': expense.name,
-                            'amount': expense.amount_spent,
-                            'date_of_expense': expense.date_of_expense.strftime('%d-%m-%Y'),
-                            'date_created': expense.date_created,
-                            'date_modified': expense.date_modified,
-                            'belongs_to': expense.belongs_to
-                        }
-                        results.append(obj)
-
-                    return make_response(jsonify({
-                        'items': results,
+                    return make_response(jsonify_stream({
+                        'items': reads.items(expenses.items, fields),
                         'total_items': expenses.total,
                         'total_pages': expenses.pages,
                         'prev_page': prev_page,
@@ -220,6 +305,232 @@ def create_app(config_name):
 
             return response
 
+    @app.route('/expenses/bulk', methods=['POST'])
+    def expense_bulk():
+        user_id, response = authenticate()
+        if response:
+            return response
+
+        # the expenses are sent either as a JSON list or as NDJSON, one JSON object per line
+        if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            items = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    # kept in place so that the indexes of the errors match the lines sent,
+                    # validation rejects it
+                    items.append(line)
+        else:
+            items = request.data
+            if isinstance(items, dict) and 'expenses' in items:
+                items = items['expenses']
+
+        if not isinstance(items, list):
+            response = jsonify({
+                'message': 'Please send a list of expenses',
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        if len(items) > app.config['MAXIMUM_BULK_ITEMS']:
+            response = jsonify({
+                'message': f'A bulk request can contain at most {app.config["MAXIMUM_BULK_ITEMS"]} expenses',
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        # validate everything first, then insert the valid rows in one transaction
+        rows = []
+        errors = []
+        for index, item in enumerate(items):
+            try:
+                values = parse_expense(item)
+            except ValueError as e:
+                errors.append({'index': index, 'message': str(e)})
+                continue
+            values['belongs_to'] = user_id
+            rows.append(values)
+
+        ids = ExpenseTracker.bulk_insert(rows, app.config['BULK_INSERT_CHUNK_SIZE'])
+        db.session.commit()
+
+        response = jsonify({
+            'created': len(ids),
+            'ids': ids,
+            'errors': errors
+        })
+        response.status_code = 201 if ids or not errors else 400
+        return response
+
+    @app.route('/expenses/', methods=['PATCH', 'DELETE'])
+    def expense_batch():
+        user_id, response = authenticate()
+        if response:
+            return response
+
+        # the expenses are selected either by their ids or by the name, start_date and end_date filters
+        data = request.data if isinstance(request.data, dict) else {}
+        values = None
+        try:
+            ids, errors, filters = batch_selection(data, app.config['MAXIMUM_BULK_ITEMS'])
+            if request.method == 'PATCH':
+                values = parse_expense_changes(data.get('values'))
+        except ValueError as e:
+            response = jsonify({
+                'message': str(e),
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        if filters is None:
+            where = ExpenseTracker.id.in_(ids)
+            reaches_archive = bool(ids)
+        else:
+            where = and_(*[FILTERS[key](value) for key, value in filters.items()])
+            reaches_archive = reads.reaches_archive(user_id, filters)
+
+        # one transaction: the archived expenses are moved back, then one UPDATE or DELETE
+        # changes all the expenses, with their daily totals
+        if reaches_archive:
+            archive.move(archive.archive, archive.expenses,
+                         archive.on_archive(and_(ExpenseTracker.belongs_to == user_id, where)))
+        if request.method == 'PATCH':
+            changed = ExpenseTracker.batch_update(user_id, where, values)
+        else:
+            changed = ExpenseTracker.batch_delete(user_id, where)
+        if changed:
+            mark_changed(db.session, user_id)
+        db.session.commit()
+
+        found = set(changed)
+        errors += [{'id': id, 'message': f'The Expense with this ID: {id} does not exist'}
+                   for id in ids if id not in found]
+        response = jsonify({
+            'updated' if request.method == 'PATCH' else 'deleted': len(changed),
+            'ids': changed,
+            'errors': errors
+        })
+        response.status_code = 200 if changed or not errors else 404
+        return response
+
+    @app.route('/expenses/import', methods=['POST'])
+    def expense_import():
+        user_id, response = authenticate()
+        if response:
+            return response
+
+        # FlaskAPI's multipart parser reads the whole body into one buffer, werkzeug's
+        # spools the upload to a temporary file instead
+        _, _, files = parse_form_data(request.environ, stream_factory=upload_stream_factory)
+        upload = files.get('file')
+        if upload is None:
+            response = jsonify({
+                'message': 'Please upload a CSV file in the file field',
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        reader = csv.DictReader(io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline=''))
+        if not reader.fieldnames or not {'name', 'amount', 'date_of_expense'} <= set(reader.fieldnames):
+            response = jsonify({
+                'message': 'The CSV file should have a header with name, amount and date_of_expense columns',
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        chunk_size = app.config['IMPORT_CHUNK_SIZE']
+        imported = 0
+        chunks = 0
+        rejected = []
+        rejected_count = 0
+        rows = []
+
+        def commit_chunk():
+            ExpenseTracker.bulk_insert(rows, app.config['BULK_INSERT_CHUNK_SIZE'])
+            db.session.commit()
+            app.logger.info(f'Imported {imported + len(rows)} expenses for user {user_id}')
+            return len(rows)
+
+        try:
+            for row in reader:
+                try:
+                    values = parse_expense(row)
+                except ValueError as e:
+                    rejected_count += 1
+                    if len(rejected) < app.config['IMPORT_MAXIMUM_REJECTED_LINES']:
+                        rejected.append({'line': reader.line_num, 'message': str(e)})
+                    continue
+                values['belongs_to'] = user_id
+                rows.append(values)
+                if len(rows) == chunk_size:
+                    imported += commit_chunk()
+                    chunks += 1
+                    rows = []
+        except csv.Error as e:
+            # a malformed file stops the import, the chunks committed so far are kept
+            rejected_count += 1
+            rejected.append({'line': reader.line_num, 'message': f'The CSV file could not be read: {e}'})
+        if rows:
+            imported += commit_chunk()
+            chunks += 1
+
+        response = jsonify({
+            'imported': imported,
+            'chunks_committed': chunks,
+            'rejected_count': rejected_count,
+            'rejected': rejected
+        })
+        response.status_code = 201
+        return response
+
+    @app.route('/expenses/export', methods=['GET'])
+    def expense_export():
+        user_id, response = authenticate()
+        if response:
+            return response
+
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            response = jsonify({
+                'message': f'The format {export_format} is not supported, use csv or ndjson',
+                'status': 'error'
+            })
+            response.status_code = 400
+            return response
+
+        filters, response = expense_filters()
+        if response:
+            return response
+
+        # reads the archived_until date of the export along with the data version
+        response = not_modified(user_id)
+        if response:
+            return response
+
+        # a server-side cursor fetched from in batches, so only one batch of rows is ever held in memory
+        batch_size = app.config['EXPORT_BATCH_SIZE']
+        rows = reads.export_rows(user_id, filters, batch_size)
+
+        def generate():
+            header = True
+            for batch in export.batches(rows, batch_size):
+                yield export.text(export_format, batch, user_id, flask_json.dumps, header)
+                header = False
+            if header:
+                yield export.text(export_format, [], user_id, flask_json.dumps, header)
+
+        response = Response(stream_with_context(generate()), mimetype=export.MIMETYPES[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename=expenses.{export_format}'
+        return response
+
     @app.route('/expenses/<int:id>', methods=['GET', 'PUT', 'DELETE'])
     def expense_manipulation(id, **kwargs):
         auth_header = request.headers.get('Authorization')
@@ -255,7 +566,21 @@ def create_app(config_name):
             if not isinstance(user_id, str):
                 # If the id is not a string(error), we have a user id
                 # Get the bucketlist with the id specified from the URL (<int:id>)
-                expense = ExpenseTracker.query.filter_by(id=id, belongs_to=user_id).first()
+                if request.method == 'GET':
+                    response = not_modified(user_id)
+                    if response:
+                        return response
+                    # a row read without the session's objects, only the writes need them
+                    expense = reads.get_expense(id, user_id)
+                else:
+                    # locked, so that concurrent writes move the daily totals one after the other
+                    # from the values the previous one left
+                    expense = ExpenseTracker.query.filter_by(id=id, belongs_to=user_id) \
+                        .with_for_update().populate_existing().first()
+                    # an archived expense is written to in Expense_Tracker again
+                    if not expense and archive.restore(id, user_id):
+                        expense = ExpenseTracker.query.filter_by(id=id, belongs_to=user_id) \
+                            .with_for_update().populate_existing().first()
 
                 if not expense:
                     response = jsonify({
@@ -275,7 +600,7 @@ def create_app(config_name):
                     amount = str(request.data.get('amount', '')).strip()
                     if amount:
                         try:
-                            amount_num = float(amount)
+                            amount_num = parse_amount(amount)
                         except ValueError:
                             response = jsonify({
                                 'message': f'the amount entered is not a valid number',
@@ -378,9 +703,6 @@ def create_app(config_name):
 
             if not isinstance(user_id, str):
                 # If the id is not a string(error), we have a user id
-                # Get the bucketlist with the id specified from the URL (<int:id>)
-                expenses = ExpenseTracker.query.filter_by(belongs_to=user_id).first()
-
                 month = request.args.get('month')
                 if month:
                     try:
@@ -403,16 +725,31 @@ def create_app(config_name):
                     return response
 
 
-                expenses = ExpenseTracker.query.with_entities(
-                    func.sum(ExpenseTracker.amount_spent), ExpenseTracker.date_of_expense) \
+                response = not_modified(user_id)
+                if response:
+                    return response
+
+                period = date.strftime('%Y-%m')
+                cache = app.extensions['report_cache']
+                # keyed by the data version the ETag was made of, so a hit runs no other query
+                version = g.get('data_version')
+                report = None
+                if cache is not None and version is not None:
+                    report = cache.get(user_id, period, version)
+                if report:
+                    return make_response(jsonify(report)), 200
+
+                start_date = datetime.date(date.year, date.month, 1)
+                end_date = datetime.date(date.year + date.month // 12, date.month % 12 + 1, 1)
+
+                # read the per day totals from the rollup table instead of aggregating the expenses
+                expenses = DailyTotal.query.with_entities(DailyTotal.total, DailyTotal.day) \
                     .filter_by(belongs_to=user_id) \
-                    .filter(extract('year', ExpenseTracker.date_of_expense) == date.year) \
-                    .filter(extract('month', ExpenseTracker.date_of_expense) == date.month) \
-                    .group_by(ExpenseTracker.date_of_expense)\
-                    .order_by(ExpenseTracker.date_of_expense.desc())\
+                    .filter(DailyTotal.day >= start_date) \
+                    .filter(DailyTotal.day < end_date) \
+                    .order_by(DailyTotal.day.desc())\
                     .all()
 
-
                 #
                 # results = dict()
                 # for expense in expenses:
@@ -434,10 +771,13 @@ def create_app(config_name):
                     }
                     results.append(obj)
 
-                return make_response(jsonify({
+                report = {
                     'items': results,
                     'consolidated_total': consolidated_total
-                })), 200
+                }
+                if cache is not None and version is not None:
+                    cache.set(user_id, period, version, report)
+                return make_response(jsonify(report)), 200
         else:
             response = jsonify({
                 'message': f'Please enter an access token',
@@ -481,9 +821,6 @@ def create_app(config_name):
 
             if not isinstance(user_id, str):
                 # If the id is not a string(error), we have a user id
-                # Get the bucketlist with the id specified from the URL (<int:id>)
-                expenses = ExpenseTracker.query.filter_by(belongs_to=user_id).first()
-
                 year = request.args.get('year')
                 if year:
                     try:
@@ -505,11 +842,28 @@ def create_app(config_name):
 
                     return response
 
-                expenses = ExpenseTracker.query.with_entities(
-                    func.sum(ExpenseTracker.amount_spent).label("total_amount"), extract('month', ExpenseTracker.date_of_expense), extract('year', ExpenseTracker.date_of_expense)) \
+                response = not_modified(user_id)
+                if response:
+                    return response
+
+                period = date.strftime('%Y')
+                cache = app.extensions['report_cache']
+                # keyed by the data version the ETag was made of, so a hit runs no other query
+                version = g.get('data_version')
+                report = None
+                if cache is not None and version is not None:
+                    report = cache.get(user_id, period, version)
+                if report:
+                    return make_response(jsonify(report)), 200
+
+                # sum the per day totals of the rollup table into months
+                expenses = DailyTotal.query.with_entities(
+                    func.sum(DailyTotal.total).label("total_amount"), extract('month', DailyTotal.day), extract('year', DailyTotal.day)) \
                     .filter_by(belongs_to=user_id) \
-                    .filter(extract('year', ExpenseTracker.date_of_expense) == date.year) \
-                    .group_by(extract('year', ExpenseTracker.date_of_expense), extract('month', ExpenseTracker.date_of_expense)) \
+                    .filter(DailyTotal.day >= datetime.date(date.year, 1, 1)) \
+                    .filter(DailyTotal.day < datetime.date(date.year + 1, 1, 1)) \
+                    .group_by(extract('year', DailyTotal.day), extract('month', DailyTotal.day)) \
+                    .order_by(extract('month', DailyTotal.day)) \
                     .all()
 
 
@@ -523,10 +877,13 @@ def create_app(config_name):
                     }
                     results.append(obj)
 
-                return make_response(jsonify({
+                report = {
                     'months': results,
                     'consolidated_total': consolidated_total
-                })), 200
+                }
+                if cache is not None and version is not None:
+                    cache.set(user_id, period, version, report)
+                return make_response(jsonify(report)), 200
         else:
             response = jsonify({
                 'message': f'Please enter an access token',
@@ -536,6 +893,20 @@ def create_app(config_name):
 
             return response
 
+    @app.route('/pool_stats', methods=['GET'])
+    def database_pool_stats():
+        if not scrape_allowed(app.config, request.headers.get('Authorization')):
+            abort(404)
+        # the statistics of the pool of the worker process that answers
+        return make_response(jsonify(pool_stats(db.engine.pool))), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not scrape_allowed(app.config, request.headers.get('Authorization')):
+            abort(404)
+        # the metrics of the worker process that answers, in the Prometheus text format
+        return render_metrics(db.engine, User.token_cache_stats())
+
     from .auth import auth_blueprint
     app.register_blueprint(auth_blueprint)
 
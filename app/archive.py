@@ -0,0 +1,124 @@
+"""The archive of the old expenses.
+
+``python manage.py archive --older-than DAYS`` moves the expenses dated more than DAYS days ago
+from Expense_Tracker to Expense_Tracker_archive, which has only the index of the per-user date
+ranges, so the table, and the indexes, the recent expenses are read from stay small.
+
+The reads still see the archived expenses: the expense lists and the export read the UNION ALL
+of both tables when the user has archived expenses on or after the start_date they ask for, which
+the archived_until date of the user tells, and only Expense_Tracker otherwise. It is read along with
+the data version of the ETag, see app.etags, so the reads do not run another query for it.
+An archived expense is read by id from the archive when it is not in Expense_Tracker, and moved
+back to it before it is updated or deleted. The reports read the daily totals, which archiving
+does not change.
+"""
+from sqlalchemy import and_, bindparam, func, select, union_all
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.util import ClauseAdapter
+from app import db
+from .models import User, ExpenseTracker, ArchivedExpense
+
+expenses = ExpenseTracker.__table__
+archive = ArchivedExpense.__table__
+users = User.__table__
+
+COLUMNS = [column.name for column in expenses.c]
+
+
+def on_archive(element):
+    """A copy of a statement or a clause on Expense_Tracker reading Expense_Tracker_archive instead."""
+    def replace(element):
+        # the table itself too, as in select([expenses]), which would be left in the FROM otherwise
+        if element is expenses:
+            return archive
+        if getattr(element, 'table', None) is expenses:
+            return archive.c[element.name]
+        return None
+    return visitors.replacement_traverse(element, {}, replace)
+
+
+def select_including_archive(columns, where):
+    """A select of the columns of the rows of Expense_Tracker and of its archive matching where, each
+    table filtered so it uses its indexes, and a function adapting clauses on Expense_Tracker, like
+    the ORDER BY ones, to the union. The name, date and id of the rows are in it to order them by.
+    """
+    names = [column.key for column in columns]
+    ordering = [expenses.c[name] for name in ('name', 'date_of_expense', 'id') if name not in names]
+    statement = select(list(columns) + ordering).where(where)
+    rows = union_all(statement, on_archive(statement)).alias('expenses')
+    return select([rows.c[name] for name in names]), ClauseAdapter(rows).traverse
+
+
+def archived_until_statement():
+    return select([users.c.archived_until]).where(users.c.id == bindparam('belongs_to'))
+
+
+def archived_until(belongs_to):
+    """The newest date archived for a user, or None if nothing was. The expenses moved back from the
+    archive leave it as is, so it may send a read to the archive for nothing, but never skips one.
+    """
+    return db.session.execute(archived_until_statement(), {'belongs_to': belongs_to}).scalar()
+
+
+def watermark_statement(user_ids):
+    """The UPDATE setting the archived_until date of the users to the newest date of their archive."""
+    newest = select([func.max(archive.c.date_of_expense)]).where(archive.c.belongs_to == users.c.id).as_scalar()
+    return users.update().where(users.c.id.in_(sorted(user_ids))).values(archived_until=newest)
+
+
+def reaches_archive(newest_archived, filters):
+    """Whether the expenses of the filter values may include archived expenses, the newest of the
+    user being dated newest_archived.
+    """
+    if newest_archived is None:
+        return False
+    return 'start_date' not in filters or filters['start_date'] <= newest_archived
+
+
+def move_statement(source, target, where):
+    """The statement moving the rows of source matching where to target, on PostgreSQL."""
+    moved = source.delete().where(where).returning(*source.c).cte('moved')
+    return target.insert().from_select(COLUMNS, select([moved.c[name] for name in COLUMNS]))
+
+
+def move(source, target, where):
+    """Moves the rows of source matching where to target, in the transaction of the session."""
+    if db.session.bind.dialect.name == 'postgresql':
+        return db.session.execute(move_statement(source, target, where)).rowcount
+    # databases without DELETE ... RETURNING copy then delete
+    rows = db.session.execute(source.select().where(where)).fetchall()
+    if rows:
+        db.session.execute(target.insert(), [dict(row) for row in rows])
+        db.session.execute(source.delete().where(source.c.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+def archive_expenses(before, batch_size=10000, progress=None):
+    """Moves the expenses dated before the date to the archive, batch_size of them per committed
+    transaction so that the writes to the expenses are not blocked for long. Returns the number moved.
+    """
+    total = 0
+    while True:
+        batch = select([expenses.c.id, expenses.c.belongs_to]).where(expenses.c.date_of_expense < before) \
+            .order_by(expenses.c.id).limit(batch_size)
+        if db.session.bind.dialect.name == 'postgresql':
+            # the expenses being written to are left for the next run
+            batch = batch.with_for_update(skip_locked=True)
+        rows = db.session.execute(batch).fetchall()
+        count = move(expenses, archive, expenses.c.id.in_([row.id for row in rows])) if rows else 0
+        if count:
+            # in the same transaction, so no read misses the expenses it moved
+            db.session.execute(watermark_statement({row.belongs_to for row in rows}))
+        db.session.commit()
+        if not count:
+            return total
+        total += count
+        if progress:
+            progress(total)
+
+
+def restore(expense_id, belongs_to):
+    """Moves an archived expense of a user back to Expense_Tracker, without committing.
+    Returns whether the user had such an archived expense.
+    """
+    return move(archive, expenses, and_(archive.c.id == expense_id, archive.c.belongs_to == belongs_to)) > 0
@@ -0,0 +1,933 @@
+"""The API served on asyncio, for ASGI servers such as uvicorn.
+
+It serves the same /expenses/, /monthly_report, /yearly_report, /auth/* and /metrics contract as
+the FlaskAPI app in create_app, but reads and writes PostgreSQL through an asyncpg connection pool:
+a request waiting on the database holds a coroutine instead of a whole worker, so one process
+keeps thousands of mostly idle clients connected on a few database connections.
+
+The queries are the same SQLAlchemy expressions as the FlaskAPI app's, compiled for asyncpg.
+"""
+import contextlib
+import contextvars
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import re
+import time
+from collections import defaultdict
+from decimal import Decimal
+from urllib.parse import parse_qsl
+import asyncpg
+from flask import json as flask_json
+from sqlalchemy import select, func, extract, tuple_, and_
+from sqlalchemy.dialects import postgresql
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, StreamingResponse
+from werkzeug.exceptions import NotFound
+from werkzeug.http import parse_etags, quote_etag
+from instance.config import app_config
+from .auth.hashing import HasherBusy, init_password_hasher
+from .cache import init_report_cache
+from .encoders import init_json
+from .metrics import scrape_allowed, metrics_text, observe_request, requests_in_flight, query_duration, CONTENT_TYPE
+from .archive import on_archive, select_including_archive, archived_until_statement, reaches_archive, \
+    move_statement
+from .etags import bump_statement, version_statement, make_etag
+from .models import ExpenseTracker, ArchivedExpense, User, DailyTotal, report_periods, to_decimal
+from .pagination import encode_cursor, decode_cursor
+from .reads import export_statement
+from . import export
+from .search import search_terms, search_clauses, filter_values, batch_selection, FILTERS
+from .validation import parse_amount, parse_date, parse_expense, parse_expense_changes, parse_fields
+
+# asyncpg takes $1, $2... parameters, which is the numeric paramstyle with another prefix
+dialect = postgresql.dialect(paramstyle='numeric')
+
+expenses_table = ExpenseTracker.__table__
+users_table = User.__table__
+daily_totals_table = DailyTotal.__table__
+archive_table = ArchivedExpense.__table__
+
+
+# the {'route', 'db_seconds'} metrics of the request being answered, the time of its queries adds up in it
+request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+def compile_statement(stmt):
+    """Compiles a SQLAlchemy statement into the SQL and the positional parameters asyncpg takes."""
+    compiled = stmt.compile(dialect=dialect)
+    sql = re.sub(r'(?<![:\w]):(\d+)', r'$\1', compiled.string)
+    return sql, [compiled.params[name] for name in compiled.positiontup]
+
+
+@contextlib.contextmanager
+def timed_query():
+    """Times a query for the metrics of the request it runs for, like the engine events of app.metrics."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics = request_metrics.get()
+        if metrics is None:
+            query_duration.observe('none', value=elapsed)
+        else:
+            metrics['db_seconds'] += elapsed
+            query_duration.observe(metrics['route'], value=elapsed)
+
+
+async def fetch(conn, stmt):
+    sql, params = compile_statement(stmt)
+    with timed_query():
+        return await conn.fetch(sql, *params)
+
+
+async def fetchrow(conn, stmt):
+    sql, params = compile_statement(stmt)
+    with timed_query():
+        return await conn.fetchrow(sql, *params)
+
+
+async def fetchval(conn, stmt):
+    sql, params = compile_statement(stmt)
+    with timed_query():
+        return await conn.fetchval(sql, *params)
+
+
+async def execute(conn, stmt):
+    sql, params = compile_statement(stmt)
+    with timed_query():
+        return await conn.execute(sql, *params)
+
+
+def instrumented(route, endpoint):
+    """Wraps an endpoint to record the metrics of its requests under route, the endpoint name of
+    the same view in the FlaskAPI app, like the request hooks of app.metrics.
+    """
+    async def wrapper(request):
+        metrics = {'route': route, 'db_seconds': 0.0}
+        token = request_metrics.set(metrics)
+        requests_in_flight.inc(route)
+        started = time.perf_counter()
+        # a request failing with an exception is answered with a 500
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        except HTTPException as e:
+            status = e.status_code
+            raise
+        finally:
+            request_metrics.reset(token)
+            observe_request(route, request.method, status, time.perf_counter() - started, metrics['db_seconds'])
+    return wrapper
+
+
+def asyncpg_dsn(database_uri):
+    """asyncpg takes the SQLAlchemy database URI without the driver name."""
+    return re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', database_uri)
+
+
+def daily_total_changes(before, after):
+    """Returns the {day: (amount, count)} changes to the daily totals of an expense going from
+    before to after, two (date_of_expense, amount_spent) tuples, None when it is created or deleted.
+    """
+    changes = defaultdict(lambda: (Decimal(0), 0))
+    if before is not None:
+        day, amount_spent = before
+        amount, count = changes[day]
+        changes[day] = (amount - to_decimal(amount_spent), count - 1)
+    if after is not None:
+        day, amount_spent = after
+        amount, count = changes[day]
+        changes[day] = (amount + to_decimal(amount_spent), count + 1)
+    return {day: change for day, change in changes.items() if change != (0, 0)}
+
+
+def expense_item(expense, date_format='%d-%m-%Y'):
+    return {
+        'id': expense['id'],
+        'name': expense['name'],
+        'amount': expense['amount_spent'],
+        'date_of_expense': expense['date_of_expense'].strftime(date_format) if date_format
+        else expense['date_of_expense'],
+        'date_created': expense['date_created'],
+        'date_modified': expense['date_modified'],
+        'belongs_to': expense['belongs_to']
+    }
+
+
+def list_items(rows, fields=None):
+    if fields:
+        return [ExpenseTracker.projected_item(row, fields) for row in rows]
+    return [expense_item(row) for row in rows]
+
+
+async def insert_expenses(conn, rows, chunk_size):
+    """Inserts many expenses with multi-row INSERT statements in the transaction of conn, like
+    ExpenseTracker.bulk_insert. Returns the ids of the new expenses, in the order of rows.
+    """
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        # PostgreSQL returns the rows of a multi-row VALUES insert in the order they were given
+        result = await fetch(conn, expenses_table.insert().values(rows[start:start + chunk_size])
+                             .returning(expenses_table.c.id))
+        ids.extend(row['id'] for row in result)
+    return ids
+
+
+def create_asgi_app(config_name):
+    config = app_config[config_name]
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        options = {}
+        if app.state.config['DATABASE_TRANSACTION_POOLER']:
+            # a transaction pooler hands every transaction to any server connection,
+            # where the statements prepared on another one do not exist
+            options['statement_cache_size'] = 0
+        app.state.pool = await asyncpg.create_pool(
+            asyncpg_dsn(app.state.config['SQLALCHEMY_DATABASE_URI']),
+            min_size=app.state.config['ASYNC_POOL_MIN_SIZE'],
+            max_size=app.state.config['ASYNC_POOL_MAX_SIZE'],
+            max_inactive_connection_lifetime=app.state.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pool_recycle', 300),
+            **options)
+        try:
+            yield
+        finally:
+            await app.state.pool.close()
+
+    app = Starlette(debug=config.DEBUG, lifespan=lifespan)
+    # the same settings and extensions as the FlaskAPI app, so the same setup functions apply
+    app.state.config = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    app.state.extensions = {}
+    init_report_cache(app.state)
+    init_password_hasher(app.state)
+    init_json(app.state)
+
+    def jsonify(data, status_code=200, headers=None):
+        """Renders data as JSON the way Flask's jsonify does, pretty printed in debug mode."""
+        pretty = app.state.config.get('JSONIFY_PRETTYPRINT_REGULAR') or app.state.config['DEBUG']
+        body = app.state.extensions['json_encoder'].dumps(data, pretty)
+        return Response(body, status_code, headers, media_type='application/json')
+
+    def error(message, status_code):
+        return jsonify({
+            'message': message,
+            'status': 'error'
+        }, status_code)
+
+    def not_found_page(description=None):
+        """The 404 page abort(404, description) answers with in the FlaskAPI app."""
+        page = NotFound(description)
+        return Response(page.get_body(), 404, dict(page.get_headers()))
+
+    def busy_response(e):
+        return jsonify({'message': str(e)}, 503, {'Retry-After': '1'})
+
+    async def request_data(request):
+        """Returns the JSON object or the form sent in the body, like FlaskAPI's request.data.
+        Raises ValueError if the JSON cannot be parsed.
+        """
+        body = await request.body()
+        if request.headers.get('content-type', '').startswith('application/json'):
+            if not body:
+                return {}
+            try:
+                return json.loads(body)
+            except ValueError as e:
+                raise ValueError(f'JSON parse error - {e}') from None
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            form = await request.form()
+            return {key: form[key] for key in form}
+        # the first value of every field, like MultiDict.get
+        data = {}
+        for key, value in parse_qsl(body.decode(), keep_blank_values=True):
+            data.setdefault(key, value)
+        return data
+
+    def authenticate(request):
+        """Gets the user id from the access token in the Authorization header.
+        Returns a (user_id, None) tuple, or (None, response) with the error response to send back.
+        """
+        auth_header = request.headers.get('Authorization')
+        if auth_header is None:
+            message = 'Authorization header missing'
+        elif auth_header == '':
+            message = 'Please insert Bearer token'
+        elif len(auth_header.split(" ")) < 2:
+            message = 'Authorization token should start with keyword Bearer'
+        elif not auth_header.split(" ")[1]:
+            message = 'Please enter an access token'
+        else:
+            user_id = User.decode_token(auth_header.split(" ")[1])
+            if not isinstance(user_id, str):
+                return user_id, None
+            # user is not legit, so the payload is an error message
+            message = user_id
+        return None, error(message, 401)
+
+    async def apply_daily_totals(conn, belongs_to, changes):
+        """Updates the daily totals in the transaction of conn, like DailyTotal.apply."""
+        if changes:
+            for stmt in DailyTotal.upsert_statements(belongs_to, changes):
+                await execute(conn, stmt)
+
+    async def bump_versions(conn, belongs_to, changes):
+        """Bumps the data version of a user in the transaction of conn, like app.etags.bump_data_versions.
+        Returns the (user id, new version, periods of the changed days) to carry_forward once it commits.
+        """
+        version = await fetchval(conn, bump_statement([belongs_to]).returning(users_table.c.data_version))
+        return belongs_to, version, report_periods(changes)
+
+    def carry_forward(*bumped_versions):
+        """Carries the cached reports of the users a committed transaction bumped over to their new
+        versions, like app.etags.carry_forward_reports.
+        """
+        cache = app.state.extensions['report_cache']
+        if cache is None:
+            return
+        for user_id, version, periods in bumped_versions:
+            cache.carry_forward(user_id, version, periods)
+
+    async def insert_rows(rows):
+        """Inserts the expenses of the rows in one transaction, with their daily totals. Returns their ids."""
+        if not rows:
+            return []
+        bumped_versions = []
+        async with app.state.pool.acquire() as conn:
+            async with conn.transaction():
+                ids = await insert_expenses(conn, rows, app.state.config['BULK_INSERT_CHUNK_SIZE'])
+                for belongs_to, changes in ExpenseTracker.bulk_insert_changes(rows).items():
+                    await apply_daily_totals(conn, belongs_to, changes)
+                    bumped_versions.append(await bump_versions(conn, belongs_to, changes))
+        carry_forward(*bumped_versions)
+        return ids
+
+    async def not_modified(request, user_id):
+        """Returns (a 304 response, None) if the If-None-Match header of the request matches the
+        ETag of the current data of the user, or (None, the headers of that ETag) after keeping the
+        version it was made of and the archived_until date of the user in request.state, like
+        app.etags.not_modified.
+        """
+        row = await fetchrow(app.state.pool, version_statement(user_id))
+        if row is None:
+            return None, None
+        version, archived_until = row
+        etag = make_etag(user_id, version, request.url.path, request.query_params.multi_items())
+        headers = {'ETag': quote_etag(etag, weak=True)}
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return Response(status_code=304, headers=headers), None
+        # the version of the report cache, and the date the reads of the view reach the archive until
+        request.state.data_version = version
+        request.state.archived_until = archived_until
+        return None, headers
+
+    async def register(request):
+        """Handle POST request for this view. Url ---> /auth/register"""
+        try:
+            data = await request_data(request)
+            email = data['email'].strip()
+        except (ValueError, KeyError, AttributeError) as e:
+            return jsonify({'message': str(e)}, 400)
+        pool = app.state.pool
+
+        if await fetchval(pool, select([users_table.c.id]).where(users_table.c.email == email)) is not None:
+            return jsonify({'message': 'User already exists. Please login.'}, 202)
+
+        try:
+            password_hash = await app.state.extensions['password_hasher'].hash_async(data['password'].strip())
+            # without RETURNING the compiled INSERT would send a NULL id instead of using the sequence
+            await fetchval(pool, users_table.insert().values(email=email, password=password_hash)
+                           .returning(users_table.c.id))
+        except asyncpg.UniqueViolationError:
+            # registered by another request in the meantime
+            return jsonify({'message': 'User already exists. Please login.'}, 202)
+        except HasherBusy as e:
+            return busy_response(e)
+        except Exception as e:
+            return jsonify({'message': str(e)}, 401)
+        return jsonify({'message': 'You registered successfully. Please log in.'}, 201)
+
+    async def login(request):
+        """Handle POST request for this view. Url ---> /auth/login"""
+        hasher = app.state.extensions['password_hasher']
+        try:
+            data = await request_data(request)
+            user = await fetchrow(app.state.pool, select([users_table.c.id, users_table.c.password])
+                                  .where(users_table.c.email == data['email'].strip()))
+
+            if user and await hasher.verify_async(user['password'], data['password'].strip()):
+                # Upgrade the hash if the bcrypt cost was changed since it was made
+                if hasher.needs_rehash(user['password']):
+                    password_hash = await hasher.hash_async(data['password'].strip())
+                    await execute(app.state.pool, users_table.update()
+                                  .where(users_table.c.id == user['id']).values(password=password_hash))
+                access_token = User.generate_token(user['id'])
+                return jsonify({
+                    'message': 'You logged in successfully.',
+                    'access_token': access_token.decode()
+                }, 200)
+            return jsonify({'message': 'Invalid email or password, Please try again'}, 401)
+        except HasherBusy as e:
+            return busy_response(e)
+        except Exception as e:
+            return jsonify({'message': str(e)}, 500)
+
+    async def expenses(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+        pool = app.state.pool
+
+        if request.method == 'POST':
+            try:
+                values = parse_expense(await request_data(request))
+            except ValueError as e:
+                return error(str(e), 400)
+
+            changes = daily_total_changes(None, (values['date_of_expense'], values['amount_spent']))
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    expense = await fetchrow(conn, expenses_table.insert()
+                                             .values(belongs_to=user_id, **values).returning(*expenses_table.c))
+                    # the daily totals are updated in the same transaction as the expense
+                    await apply_daily_totals(conn, user_id, changes)
+                    bumped = await bump_versions(conn, user_id, changes)
+            carry_forward(bumped)
+            return jsonify(expense_item(expense), 201)
+
+        response, etag_headers = await not_modified(request, user_id)
+        if response:
+            return response
+        args = request.query_params
+        try:
+            limit = int(args.get('limit', str(app.state.config['DEFAULT_PAGINATION_LIMIT'])))
+        except ValueError:
+            limit = app.state.config['DEFAULT_PAGINATION_LIMIT']
+        limit = min(limit, app.state.config['MAXIMUM_PAGINATION_LIMIT'])
+        try:
+            page = int(args.get('page', '1'))
+        except ValueError:
+            page = 1
+        if limit < 1 or page < 1:
+            return not_found_page('Page or Limit must be greater than 1')
+
+        try:
+            filters = filter_values(args)
+        except ValueError as e:
+            return error(str(e), 400)
+        queries = [FILTERS[key](value) for key, value in filters.items()]
+
+        # only select the columns of the fields asked for
+        fields = None
+        if 'fields' in args:
+            try:
+                fields = parse_fields(args.get('fields'), ExpenseTracker.ITEM_COLUMNS)
+            except ValueError as e:
+                return error(str(e), 400)
+
+        order_by = []
+        if 'q' in args:
+            # relevance ranked search, best matches first
+            terms = search_terms(args.get('q'))
+            if not terms:
+                return error('Please enter a valid search term', 400)
+            if 'cursor' in args:
+                return error('A search with q cannot be paged with a cursor', 400)
+            search_filter, order_by = search_clauses(terms, dialect.name)
+            queries.append(search_filter)
+
+        columns = list(expenses_table.c)
+        if fields:
+            # the next cursor needs the date and the id of the last row
+            extra = ('date_of_expense', 'id') if 'cursor' in args else ()
+            columns = ExpenseTracker.projection(fields, extra)
+        queries.insert(0, expenses_table.c.belongs_to == user_id)
+
+        if 'cursor' in args:
+            cursor = args.get('cursor')
+            if cursor:
+                try:
+                    cursor_date, cursor_id = decode_cursor(cursor)
+                except ValueError as e:
+                    return error(str(e), 400)
+                queries.append(tuple_(expenses_table.c.date_of_expense, expenses_table.c.id) >
+                               tuple_(cursor_date, cursor_id))
+
+        if reaches_archive(getattr(request.state, 'archived_until', None), filters):
+            query, adapt = select_including_archive(columns, and_(*queries))
+            order_by = [adapt(clause) for clause in order_by]
+        else:
+            query, adapt = select(columns).where(and_(*queries)), (lambda clause: clause)
+
+        if 'cursor' in args:
+            # fetch one extra row to find out whether there is a next page
+            rows = await fetch(pool, query.order_by(adapt(expenses_table.c.date_of_expense),
+                                                    adapt(expenses_table.c.id)).limit(limit + 1))
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1]['date_of_expense'], rows[-1]['id'])
+            return jsonify({
+                'items': list_items(rows, fields),
+                'next_cursor': next_cursor,
+            }, 200, etag_headers)
+
+        # ordered by id, after the relevance of the search, like app.reads.page_statements
+        page_query = query.order_by(*order_by, adapt(expenses_table.c.id))
+        async with pool.acquire() as conn:
+            rows = await fetch(conn, page_query.limit(limit).offset((page - 1) * limit))
+            if not rows and page != 1:
+                # past the last page, like abort(404) in the FlaskAPI app
+                return not_found_page()
+            # like Flask-SQLAlchemy's paginate, skip the COUNT when the first page is not full
+            if page == 1 and len(rows) < limit:
+                total = len(rows)
+            else:
+                total = await fetchval(conn, select([func.count()]).select_from(query.alias()))
+        pages = int(math.ceil(total / float(limit)))
+
+        return jsonify({
+            'items': list_items(rows, fields),
+            'total_items': total,
+            'total_pages': pages,
+            'prev_page': None if page == 1 else f'/expenses/?limit={limit}&page={page - 1}',
+            'next_page': f'/expenses/?limit={limit}&page={page + 1}' if page < pages else None,
+        }, 200, etag_headers)
+
+    async def expense_batch(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+        pool = app.state.pool
+
+        # the expenses are selected either by their ids or by the name, start_date and end_date filters
+        try:
+            data = await request_data(request)
+            data = data if isinstance(data, dict) else {}
+            ids, errors, filters = batch_selection(data, app.state.config['MAXIMUM_BULK_ITEMS'])
+            values = parse_expense_changes(data.get('values')) if request.method == 'PATCH' else None
+        except ValueError as e:
+            return error(str(e), 400)
+
+        if filters is None:
+            where = expenses_table.c.id.in_(ids)
+            archived = bool(ids)
+        else:
+            where = and_(*[FILTERS[key](value) for key, value in filters.items()])
+            archived = reaches_archive(
+                await fetchval(pool, archived_until_statement().params(belongs_to=user_id)), filters)
+        owned = and_(expenses_table.c.belongs_to == user_id, where)
+
+        # one transaction: the archived expenses are moved back, then one UPDATE or DELETE
+        # changes all the expenses, with their daily totals
+        bumped_versions = []
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if archived:
+                    await execute(conn, move_statement(archive_table, expenses_table, on_archive(owned)))
+                rows = await fetch(conn, ExpenseTracker.locked_rows_statement(user_id, where))
+                changed = [row['id'] for row in rows]
+                if changed:
+                    by_ids = and_(expenses_table.c.belongs_to == user_id, expenses_table.c.id.in_(changed))
+                    if request.method == 'PATCH':
+                        await execute(conn, expenses_table.update().where(by_ids).values(**values))
+                        changes = ExpenseTracker.batch_update_changes(rows, values)
+                    else:
+                        await execute(conn, expenses_table.delete().where(by_ids))
+                        changes = ExpenseTracker.batch_delete_changes(rows)
+                    await apply_daily_totals(conn, user_id, changes)
+                    bumped_versions.append(await bump_versions(conn, user_id, changes))
+        carry_forward(*bumped_versions)
+
+        found = set(changed)
+        errors += [{'id': id, 'message': f'The Expense with this ID: {id} does not exist'}
+                   for id in ids if id not in found]
+        return jsonify({
+            'updated' if request.method == 'PATCH' else 'deleted': len(changed),
+            'ids': changed,
+            'errors': errors
+        }, 200 if changed or not errors else 404)
+
+    async def expense_bulk(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+
+        # the expenses are sent either as a JSON list or as NDJSON, one JSON object per line
+        if request.headers.get('content-type', '').split(';')[0].strip() in ('application/x-ndjson',
+                                                                             'application/ndjson'):
+            items = []
+            for line in (await request.body()).decode().splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    # kept in place so that the indexes of the errors match the lines sent,
+                    # validation rejects it
+                    items.append(line)
+        else:
+            try:
+                items = await request_data(request)
+            except ValueError as e:
+                return error(str(e), 400)
+            if isinstance(items, dict) and 'expenses' in items:
+                items = items['expenses']
+
+        if not isinstance(items, list):
+            return error('Please send a list of expenses', 400)
+
+        if len(items) > app.state.config['MAXIMUM_BULK_ITEMS']:
+            return error(f'A bulk request can contain at most {app.state.config["MAXIMUM_BULK_ITEMS"]} expenses',
+                         400)
+
+        # validate everything first, then insert the valid rows in one transaction
+        rows = []
+        errors = []
+        for index, item in enumerate(items):
+            try:
+                values = parse_expense(item)
+            except ValueError as e:
+                errors.append({'index': index, 'message': str(e)})
+                continue
+            values['belongs_to'] = user_id
+            rows.append(values)
+
+        ids = await insert_rows(rows)
+        return jsonify({
+            'created': len(ids),
+            'ids': ids,
+            'errors': errors
+        }, 201 if ids or not errors else 400)
+
+    async def expense_import(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+
+        # starlette spools large uploads to a temporary file
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or isinstance(upload, str):
+            return error('Please upload a CSV file in the file field', 400)
+
+        def open_reader():
+            reader = csv.DictReader(io.TextIOWrapper(upload.file, encoding='utf-8-sig', errors='replace',
+                                                     newline=''))
+            # reads the header
+            reader.fieldnames
+            return reader
+
+        # the file is read and parsed in a thread, so a large one does not block the event loop
+        reader = await run_in_threadpool(open_reader)
+        if not reader.fieldnames or not {'name', 'amount', 'date_of_expense'} <= set(reader.fieldnames):
+            return error('The CSV file should have a header with name, amount and date_of_expense columns', 400)
+
+        chunk_size = app.state.config['IMPORT_CHUNK_SIZE']
+        imported = 0
+        chunks = 0
+        rejected = []
+        rejected_count = 0
+
+        def read_chunk():
+            """Returns the rows of the next chunk of the file, and whether the file is read through."""
+            nonlocal rejected_count
+            rows = []
+            try:
+                for row in reader:
+                    try:
+                        values = parse_expense(row)
+                    except ValueError as e:
+                        rejected_count += 1
+                        if len(rejected) < app.state.config['IMPORT_MAXIMUM_REJECTED_LINES']:
+                            rejected.append({'line': reader.line_num, 'message': str(e)})
+                        continue
+                    values['belongs_to'] = user_id
+                    rows.append(values)
+                    if len(rows) == chunk_size:
+                        return rows, False
+            except csv.Error as e:
+                # a malformed file stops the import, the chunks committed so far are kept
+                rejected_count += 1
+                rejected.append({'line': reader.line_num, 'message': f'The CSV file could not be read: {e}'})
+            return rows, True
+
+        done = False
+        while not done:
+            rows, done = await run_in_threadpool(read_chunk)
+            if rows:
+                imported += len(await insert_rows(rows))
+                chunks += 1
+
+        return jsonify({
+            'imported': imported,
+            'chunks_committed': chunks,
+            'rejected_count': rejected_count,
+            'rejected': rejected
+        }, 201)
+
+    async def expense_export(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+
+        export_format = request.query_params.get('format', 'csv')
+        if export_format not in ('csv', 'ndjson'):
+            return error(f'The format {export_format} is not supported, use csv or ndjson', 400)
+        try:
+            filters = filter_values(request.query_params)
+        except ValueError as e:
+            return error(str(e), 400)
+
+        # reads the archived_until date of the export along with the data version
+        response, etag_headers = await not_modified(request, user_id)
+        if response:
+            return response
+        archived = reaches_archive(getattr(request.state, 'archived_until', None), filters)
+        sql, params = compile_statement(export_statement(tuple(filters), archived)
+                                        .params(dict(filters, belongs_to=user_id)))
+        batch_size = app.state.config['EXPORT_BATCH_SIZE']
+
+        async def generate():
+            # a cursor fetched from in batches, so only one batch of rows is ever held in memory
+            async with app.state.pool.acquire() as conn:
+                async with conn.transaction():
+                    cursor = await conn.cursor(sql, *params)
+                    header = True
+                    while True:
+                        with timed_query():
+                            batch = await cursor.fetch(batch_size)
+                        if not batch:
+                            break
+                        yield export.text(export_format, batch, user_id, flask_json.dumps, header)
+                        header = False
+                    if header:
+                        yield export.text(export_format, [], user_id, flask_json.dumps, header)
+
+        headers = dict(etag_headers or {})
+        headers['Content-Disposition'] = f'attachment; filename=expenses.{export_format}'
+        return StreamingResponse(generate(), media_type=export.MIMETYPES[export_format], headers=headers)
+
+    async def expense(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+        id = request.path_params['id']
+        by_id = (expenses_table.c.id == id) & (expenses_table.c.belongs_to == user_id)
+        not_found = error(f'The Expense with this ID: {id} does not exist', 404)
+
+        if request.method == 'GET':
+            response, etag_headers = await not_modified(request, user_id)
+            if response:
+                return response
+            row = await fetchrow(app.state.pool, select([expenses_table]).where(by_id))
+            if not row:
+                # read from the archive only when it is not in Expense_Tracker
+                row = await fetchrow(app.state.pool, on_archive(select([expenses_table]).where(by_id)))
+            if not row:
+                return not_found
+            return jsonify(expense_item(row, date_format=None), 200, etag_headers)
+
+        if request.method == 'PUT':
+            try:
+                data = await request_data(request)
+            except ValueError as e:
+                return error(str(e), 400)
+            values = {}
+            amount = str(data.get('amount', '')).strip()
+            if amount:
+                try:
+                    values['amount_spent'] = parse_amount(amount)
+                except ValueError:
+                    return error('the amount entered is not a valid number', 400)
+            date_of_expense = str(data.get('date_of_expense', '')).strip()
+            if date_of_expense:
+                try:
+                    values['date_of_expense'] = parse_date(date_of_expense)
+                except ValueError as e:
+                    return error(str(e), 400)
+            name = str(data.get('name', ''))
+            if not name:
+                return error('PLease enter a valid name', 400)
+            values['name'] = name
+
+        async with app.state.pool.acquire() as conn:
+            async with conn.transaction():
+                # lock the expense so that concurrent writes move the daily totals one after the other
+                old = await fetchrow(conn, select([expenses_table]).where(by_id).with_for_update())
+                if not old:
+                    # an archived expense is written to in Expense_Tracker again
+                    restore = move_statement(archive_table, expenses_table, on_archive(by_id))
+                    if await fetch(conn, restore.returning(expenses_table.c.id)):
+                        old = await fetchrow(conn, select([expenses_table]).where(by_id).with_for_update())
+                if not old:
+                    return not_found
+                before = (old['date_of_expense'], old['amount_spent'])
+                if request.method == 'DELETE':
+                    await execute(conn, expenses_table.delete().where(by_id))
+                    changes = daily_total_changes(before, None)
+                else:
+                    row = await fetchrow(conn, expenses_table.update().where(by_id).values(**values)
+                                         .returning(*expenses_table.c))
+                    changes = daily_total_changes(before, (row['date_of_expense'], row['amount_spent']))
+                await apply_daily_totals(conn, user_id, changes)
+                bumped = await bump_versions(conn, user_id, changes)
+        carry_forward(bumped)
+
+        if request.method == 'DELETE':
+            return jsonify({"message": "Expense {} deleted successfully".format(id)}, 200)
+        return jsonify(expense_item(row), 200)
+
+    async def month_expense(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+        month = request.query_params.get('month')
+        if not month:
+            return error('Please enter a Month', 400)
+        try:
+            date = datetime.datetime.strptime(month, '%m-%Y')
+        except ValueError:
+            return error(f'The date {month} does not match the format MM-YYYY', 400)
+
+        response, etag_headers = await not_modified(request, user_id)
+        if response:
+            return response
+        period = date.strftime('%Y-%m')
+        cache = app.state.extensions['report_cache']
+        # keyed by the data version the ETag was made of, so a hit runs no other query
+        version = getattr(request.state, 'data_version', None)
+        report = None
+        if cache is not None and version is not None:
+            report = cache.get(user_id, period, version)
+        if report:
+            return jsonify(report, 200, etag_headers)
+
+        start_date = datetime.date(date.year, date.month, 1)
+        end_date = datetime.date(date.year + date.month // 12, date.month % 12 + 1, 1)
+        rows = await fetch(app.state.pool, select([daily_totals_table.c.total, daily_totals_table.c.day])
+                           .where(daily_totals_table.c.belongs_to == user_id)
+                           .where(daily_totals_table.c.day >= start_date)
+                           .where(daily_totals_table.c.day < end_date)
+                           .order_by(daily_totals_table.c.day.desc()))
+
+        results = []
+        consolidated_total = 0.0
+        for total_amount, expense_date in rows:
+            consolidated_total += float(total_amount)
+            results.append({
+                'date': expense_date.strftime('%d/%m/%Y'),
+                'total_expenses': float(total_amount)
+            })
+        report = {
+            'items': results,
+            'consolidated_total': consolidated_total
+        }
+        if cache is not None and version is not None:
+            cache.set(user_id, period, version, report)
+        return jsonify(report, 200, etag_headers)
+
+    async def year_expense(request):
+        user_id, response = authenticate(request)
+        if response:
+            return response
+        year = request.query_params.get('year')
+        if not year:
+            return error('Please enter a Year', 400)
+        try:
+            date = datetime.datetime.strptime(year, '%Y')
+        except ValueError:
+            return error(f'The date {year} does not match the format YYYY', 400)
+
+        response, etag_headers = await not_modified(request, user_id)
+        if response:
+            return response
+        period = date.strftime('%Y')
+        cache = app.state.extensions['report_cache']
+        # keyed by the data version the ETag was made of, so a hit runs no other query
+        version = getattr(request.state, 'data_version', None)
+        report = None
+        if cache is not None and version is not None:
+            report = cache.get(user_id, period, version)
+        if report:
+            return jsonify(report, 200, etag_headers)
+
+        month = extract('month', daily_totals_table.c.day)
+        rows = await fetch(app.state.pool, select([func.sum(daily_totals_table.c.total), month])
+                           .where(daily_totals_table.c.belongs_to == user_id)
+                           .where(daily_totals_table.c.day >= datetime.date(date.year, 1, 1))
+                           .where(daily_totals_table.c.day < datetime.date(date.year + 1, 1, 1))
+                           .group_by(month)
+                           .order_by(month))
+
+        consolidated_total = 0.0
+        results = []
+        for total_amount, month_number in rows:
+            consolidated_total += float(total_amount)
+            results.append({
+                'month': f'{int(month_number)}-{date.year}',
+                'total_expenses': float(total_amount)
+            })
+        report = {
+            'months': results,
+            'consolidated_total': consolidated_total
+        }
+        if cache is not None and version is not None:
+            cache.set(user_id, period, version, report)
+        return jsonify(report, 200, etag_headers)
+
+    async def database_pool_stats(request):
+        if not scrape_allowed(app.state.config, request.headers.get('Authorization')):
+            raise HTTPException(404)
+        pool = app.state.pool
+        return jsonify({
+            'pid': os.getpid(),
+            'pool': type(pool).__name__,
+            'min_size': pool.get_min_size(),
+            'max_size': pool.get_max_size(),
+            'size': pool.get_size(),
+            'idle': pool.get_idle_size(),
+            'checked_out': pool.get_size() - pool.get_idle_size(),
+        }, 200)
+
+    async def metrics(request):
+        if not scrape_allowed(app.state.config, request.headers.get('Authorization')):
+            raise HTTPException(404)
+        # the metrics of the worker process that answers, in the Prometheus text format
+        pool = app.state.pool
+        stats = {
+            'checked_out': pool.get_size() - pool.get_idle_size(),
+            'checked_in': pool.get_idle_size(),
+            'overflow': 0,
+            'pool_size': pool.get_max_size(),
+            'max_overflow': 0,
+        }
+        return Response(metrics_text(stats, User.token_cache_stats()), media_type=CONTENT_TYPE)
+
+    # the routes are named after the views of the FlaskAPI app, which label the metrics of both
+    routes = [
+        ('/auth/register', register, ['POST'], 'registration_view'),
+        ('/auth/login', login, ['POST'], 'login_view'),
+        ('/expenses/', expenses, ['GET', 'POST'], 'expense'),
+        ('/expenses/', expense_batch, ['PATCH', 'DELETE'], 'expense_batch'),
+        ('/expenses/bulk', expense_bulk, ['POST'], 'expense_bulk'),
+        ('/expenses/import', expense_import, ['POST'], 'expense_import'),
+        ('/expenses/export', expense_export, ['GET'], 'expense_export'),
+        ('/expenses/{id:int}', expense, ['GET', 'PUT', 'DELETE'], 'expense_manipulation'),
+        ('/monthly_report', month_expense, ['GET'], 'month_expense'),
+        ('/yearly_report', year_expense, ['GET'], 'year_expense'),
+        ('/pool_stats', database_pool_stats, ['GET'], 'database_pool_stats'),
+        ('/metrics', metrics, ['GET'], 'metrics'),
+    ]
+    for path, endpoint, methods, name in routes:
+        app.add_route(path, instrumented(name, endpoint), methods=methods, name=name)
+
+    return app
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask_bcrypt import Bcrypt
+
+
+class HasherBusy(Exception):
+    """Raised when too many passwords are already waiting to be hashed or checked."""
+
+
+class PasswordHasher(object):
+    """Hashes and checks passwords with bcrypt on a small pool of worker threads.
+
+    bcrypt releases the GIL, so the threads of a worker keep serving other requests while
+    a hash is computed. At most pool_size hashes run at once, and at most queue_size more
+    wait for a thread: a burst of logins is turned away with HasherBusy instead of taking
+    all the CPU away from the other requests.
+    """
+
+    def __init__(self, log_rounds=12, pool_size=2, queue_size=16, timeout=10):
+        self.log_rounds = log_rounds
+        self.timeout = timeout
+        self.bcrypt = Bcrypt()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='bcrypt')
+        self.slots = threading.BoundedSemaphore(pool_size + queue_size)
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy('The server is busy, please try again')
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn, *args):
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy('The server is busy, please try again') from None
+
+    async def run_async(self, fn, *args):
+        """Like run, but waits for the result without blocking the event loop."""
+        future = asyncio.wrap_future(self.submit(fn, *args))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise HasherBusy('The server is busy, please try again') from None
+
+    def hash(self, password):
+        """Returns the bcrypt hash of password, at the configured cost."""
+        return self.run(self.bcrypt.generate_password_hash, password, self.log_rounds).decode()
+
+    def verify(self, password_hash, password):
+        """Checks password against its bcrypt hash."""
+        return self.run(self.bcrypt.check_password_hash, password_hash, password)
+
+    async def hash_async(self, password):
+        return (await self.run_async(self.bcrypt.generate_password_hash, password, self.log_rounds)).decode()
+
+    async def verify_async(self, password_hash, password):
+        return await self.run_async(self.bcrypt.check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Tells whether the hash was made with another cost than the configured one.
+        bcrypt hashes look like $2b$<cost>$<salt and hash>.
+        """
+        return int(password_hash.split('$')[2]) != self.log_rounds
+
+
+def init_password_hasher(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        log_rounds=app.config['BCRYPT_LOG_ROUNDS'],
+        pool_size=app.config['BCRYPT_POOL_SIZE'],
+        queue_size=app.config['BCRYPT_QUEUE_SIZE'],
+        timeout=app.config['BCRYPT_TIMEOUT'])
@@ -1,8 +1,18 @@
 from . import auth_blueprint
 
 from flask.views import MethodView
-from flask import make_response, request, jsonify
+from flask import make_response, request
+from app import db
+from app.encoders import jsonify
 from app.models import User
+from .hashing import HasherBusy
+
+
+def busy_response(e):
+    """The response sent when there are too many passwords to hash already."""
+    response = make_response(jsonify({'message': str(e)}), 503)
+    response.headers['Retry-After'] = '1'
+    return response
 
 
 class RegistrationView(MethodView):
@@ -13,6 +23,8 @@ class RegistrationView(MethodView):
 
         # Query to see if the user already exists
         user = User.query.filter_by(email=request.data['email'].strip()).first()
+        # give the connection back to the pool while the password is hashed, for up to BCRYPT_TIMEOUT
+        db.session.close()
 
         if not user:
             # There is no user so we'll try to register them
@@ -29,6 +41,8 @@ class RegistrationView(MethodView):
                 }
                 # return a response notifying the user that they registered successfully
                 return make_response(jsonify(response)), 201
+            except HasherBusy as e:
+                return busy_response(e)
             except Exception as e:
                 # An error occured, therefore return a string message containing the error
                 response = {
@@ -53,10 +67,14 @@ class LoginView(MethodView):
         try:
             # Get the user object using their email (unique to every user)
             user = User.query.filter_by(email=request.data['email'].strip()).first()
-
+            # give the connection back to the pool while the password is checked, for up to BCRYPT_TIMEOUT;
+            # the user keeps its loaded columns, and saving a new hash attaches it to the session again
+            db.session.close()
 
             # Try to authenticate the found user using their password
             if user and user.password_is_valid(request.data['password'].strip()):
+                # Upgrade the hash if the bcrypt cost was changed since it was made
+                user.rehash_password(request.data['password'].strip())
                 # Generate the access token. This will be used as the authorization header
                 access_token = user.generate_token(user.id)
                 if access_token:
@@ -72,6 +90,8 @@ class LoginView(MethodView):
                 }
                 return make_response(jsonify(response)), 401
 
+        except HasherBusy as e:
+            return busy_response(e)
         except Exception as e:
             # Create a response containing an string error message
             response = {
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """A thread-safe cache holding at most maxsize entries, evicting the least recently used
+    one when full. Entries expire ttl seconds after they were set.
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value of key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self.timer():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key, for ttl seconds instead of the default if given."""
+        with self._lock:
+            self._entries[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class InProcessBackend(object):
+    """Keeps the cached reports in the memory of this process."""
+
+    def __init__(self, maxsize, ttl):
+        self.entries = LRUCache(maxsize, ttl)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries.set(key, value)
+
+
+class SharedStoreBackend(object):
+    """Keeps the cached reports in a store shared by every worker, such as Redis.
+
+    The client needs get(key) and set(key, value, ex=ttl), like a redis-py client.
+    The store is expected to bound its own size, e.g. Redis with an allkeys-lru maxmemory-policy.
+    """
+
+    def __init__(self, client, ttl, prefix='report:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+
+class ReportCache(object):
+    """Caches the monthly and yearly reports of every user by their data version, see app.etags, so the
+    version read for the ETag of a report tells whether it is cached without another query. The reports
+    of a user at a version are one entry of {period: report}, where the period is a month as YYYY-MM or
+    a year as YYYY.
+
+    Every write bumps the data version. Once it commits, the reports of the periods whose daily totals it
+    did not change are carried over to the new version, so the other periods stay cached. Only the cache
+    of the process that wrote is carried over: the others miss once, they never send an outdated report.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def key(user_id, version):
+        return f'{user_id}:{version}'
+
+    def get(self, user_id, period, version):
+        reports = self.backend.get(self.key(user_id, version))
+        return None if reports is None else reports.get(period)
+
+    def set(self, user_id, period, version, report):
+        # a copy, the in process backend hands out the dict it keeps
+        reports = dict(self.backend.get(self.key(user_id, version)) or {})
+        reports[period] = report
+        self.backend.set(self.key(user_id, version), reports)
+
+    def carry_forward(self, user_id, version, periods):
+        """Caches the reports of a user at version, the one a write just committed, from the ones at the
+        version before, but the reports of the periods the write changed.
+        """
+        reports = self.backend.get(self.key(user_id, version - 1))
+        if not reports:
+            return
+        kept = {period: report for period, report in reports.items() if period not in periods}
+        if kept:
+            # the reports cached at version since the write committed are newer
+            kept.update(self.backend.get(self.key(user_id, version)) or {})
+            self.backend.set(self.key(user_id, version), kept)
+
+
+def init_report_cache(app):
+    """Sets up the report cache configured by REPORT_CACHE_BACKEND: 'memory', 'redis' or None to disable it."""
+    backend = app.config.get('REPORT_CACHE_BACKEND')
+    if backend == 'memory':
+        app.extensions['report_cache'] = ReportCache(
+            InProcessBackend(app.config['REPORT_CACHE_SIZE'], app.config['REPORT_CACHE_TTL']))
+    elif backend == 'redis':
+        # only needed when the cache is shared through redis
+        import redis
+        client = redis.Redis.from_url(app.config['REPORT_CACHE_URL'])
+        app.extensions['report_cache'] = ReportCache(SharedStoreBackend(client, app.config['REPORT_CACHE_TTL']))
+    else:
+        app.extensions['report_cache'] = None
+
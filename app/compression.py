@@ -0,0 +1,66 @@
+"""Compression of the responses, gzip or deflate as the client accepts.
+
+Buffered responses are compressed at once when they are at least COMPRESS_MIN_SIZE bytes long.
+Streamed responses, whose size is not known, are always compressed, chunk by chunk: each chunk
+is flushed, so the client can decode every one of them as soon as it arrives.
+"""
+import zlib
+from flask import current_app, request
+
+# the window bits of zlib that write the gzip and the zlib format, which HTTP calls deflate
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def compress_stream(chunks, compressor, iterable):
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # the response closes this generator instead of its iterable
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+class ResponseCompressor(object):
+    """Compresses the responses of the mimetypes with the level, 0 leaves them uncompressed."""
+
+    def __init__(self, level=6, min_size=1024, mimetypes=()):
+        self.level = level
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+
+    def compress(self, response):
+        if not self.level or response.mimetype not in self.mimetypes:
+            return response
+        # the response depends on Accept-Encoding, even when it is not compressed
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers:
+            return response
+        encoding = request.accept_encodings.best_match(WBITS)
+        if encoding is None:
+            return response
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        if response.is_streamed:
+            response.response = compress_stream(response.iter_encoded(), compressor, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+def compress_response(response):
+    return current_app.extensions['compressor'].compress(response)
+
+
+def init_compression(app):
+    app.extensions['compressor'] = ResponseCompressor(
+        app.config['COMPRESS_LEVEL'], app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_MIMETYPES'])
+    app.after_request(compress_response)
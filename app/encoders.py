@@ -0,0 +1,146 @@
+"""JSON responses encoded with orjson when it is installed, byte for byte the same as Flask's jsonify.
+
+orjson only takes the responses it encodes exactly like the standard library: compact, with
+ASCII only text and without the floats Python writes with an exponent. Anything else, the pretty
+printed responses of debug mode included, is encoded by the standard library. Not a number and
+infinite floats, which are not JSON, are the exception: orjson writes them as null.
+"""
+import datetime
+import json
+import re
+from flask import current_app, stream_with_context, json as flask_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# the numbers orjson and Python write differently, 1e+16 and 1e-05 are 1e16 and 0.00001 for orjson.
+# Strings matching too are only encoded again by the standard library
+EXPONENT = re.compile(rb'e[-\d]')
+SMALL_NUMBER = b'0.0000'
+
+
+def http_date(value):
+    """Formats a date or datetime like werkzeug's http_date, which Flask's JSON encoder uses,
+    without building a time tuple first.
+    """
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None and value.utcoffset() is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+            WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year,
+            value.hour, value.minute, value.second)
+    return '%s, %02d %s %04d 00:00:00 GMT' % (WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year)
+
+
+class StdlibEncoder(object):
+    """Encodes with the standard library and the JSON encoder class of the app, like Flask does."""
+
+    name = 'stdlib'
+
+    def __init__(self, sort_keys=True, ensure_ascii=True, cls=flask_json.JSONEncoder):
+        self.sort_keys = sort_keys
+        self.ensure_ascii = ensure_ascii
+        self.cls = cls
+
+    def dumps(self, data, pretty=False):
+        """Returns the JSON of data as bytes, with the newline jsonify ends its responses with."""
+        if pretty:
+            text = json.dumps(data, cls=self.cls, indent=2, separators=(', ', ': '),
+                              sort_keys=self.sort_keys, ensure_ascii=self.ensure_ascii)
+        else:
+            text = json.dumps(data, cls=self.cls, separators=(',', ':'),
+                              sort_keys=self.sort_keys, ensure_ascii=self.ensure_ascii)
+        return (text + '\n').encode()
+
+
+class OrjsonEncoder(StdlibEncoder):
+    """Encodes with orjson the responses it writes the same as the standard library."""
+
+    name = 'orjson'
+
+    def __init__(self, sort_keys=True, ensure_ascii=True, cls=flask_json.JSONEncoder):
+        super().__init__(sort_keys, ensure_ascii, cls)
+        self.options = orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME | \
+            orjson.OPT_PASSTHROUGH_DATACLASS
+        if sort_keys:
+            self.options |= orjson.OPT_SORT_KEYS
+        self._encoder = cls()
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return http_date(o)
+        return self._encoder.default(o)
+
+    def dumps(self, data, pretty=False):
+        if not pretty:
+            try:
+                body = orjson.dumps(data, default=self.default, option=self.options)
+            except TypeError:
+                # the types orjson does not take, the standard library raises its own error if it cannot either
+                pass
+            else:
+                if EXPONENT.search(body) is None and SMALL_NUMBER not in body and \
+                        (not self.ensure_ascii or (body.isascii() and b'\x7f' not in body)):
+                    return body
+        return super().dumps(data, pretty)
+
+
+def response_encoder(config, cls=flask_json.JSONEncoder):
+    """Returns the encoder configured by JSON_BACKEND, 'orjson' or 'stdlib'. orjson falls back to
+    the standard library when it is not installed, as does an app with its own JSON encoder class.
+    """
+    sort_keys = config.get('JSON_SORT_KEYS', True)
+    ensure_ascii = config.get('JSON_AS_ASCII', True)
+    if config.get('JSON_BACKEND') == 'orjson' and orjson is not None and cls is flask_json.JSONEncoder:
+        return OrjsonEncoder(sort_keys, ensure_ascii, cls)
+    return StdlibEncoder(sort_keys, ensure_ascii, cls)
+
+
+def jsonify(*args, **kwargs):
+    """Flask's jsonify, encoded by the encoder of the app."""
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    elif len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    return current_app.response_class(
+        current_app.extensions['json_encoder'].dumps(data, pretty),
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def jsonify_stream(data, key='items'):
+    """jsonify for a dict with a list under key, sending the same bytes in chunks: the list is encoded
+    JSON_STREAM_BATCH_SIZE items at a time while the response is sent, instead of all in one string first.
+    Short lists, pretty printed responses and keys that would not come first are left to jsonify.
+    """
+    config = current_app.config
+    items = data[key]
+    pretty = config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug
+    if len(items) < config['JSON_STREAM_MIN_ITEMS'] or pretty or not config['JSON_SORT_KEYS'] or min(data) != key:
+        return jsonify(data)
+    encoder = current_app.extensions['json_encoder']
+    batch_size = config['JSON_STREAM_BATCH_SIZE']
+    rest = {name: value for name, value in data.items() if name != key}
+
+    def generate():
+        yield b'{' + encoder.dumps(key)[:-1] + b':['
+        for start in range(0, len(items), batch_size):
+            # the items of the batch, without the brackets and the newline of their list
+            batch = encoder.dumps(items[start:start + batch_size])[1:-2]
+            yield b',' + batch if start else batch
+        yield b']' + (b',' + encoder.dumps(rest)[1:] if rest else b'}\n')
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=config['JSONIFY_MIMETYPE'])
+
+
+def init_json(app):
+    # the ASGI app has no JSON encoder class of its own, it encodes like Flask
+    cls = getattr(app, 'json_encoder', flask_json.JSONEncoder)
+    app.extensions['json_encoder'] = response_encoder(app.config, cls)
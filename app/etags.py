@@ -0,0 +1,128 @@
+"""Conditional GETs of the expenses and the reports.
+
+Every user has a data version, bumped in the transaction of every write to their expenses. The
+weak ETag of a response is made of the version of its user and of the url it answers, so a
+request whose If-None-Match matches gets a 304 after reading the version alone, without running
+the query of the view. The report cache is keyed by the same version, see app.cache.ReportCache.
+"""
+import hashlib
+from flask import current_app, g, has_app_context, request, Response
+from sqlalchemy import event, select
+from app import db
+from .models import User, ExpenseTracker, report_periods
+
+users = User.__table__
+
+
+def mark_changed(session, user_id):
+    """Bumps the data version of a user when the session commits."""
+    session.info.setdefault('changed_users', set()).add(user_id)
+
+
+def bump_statement(user_ids):
+    """The UPDATE bumping the data version of users, in the order of their ids so that
+    concurrent transactions lock them in the same order.
+    """
+    return users.update().where(users.c.id.in_(sorted(user_ids))).values(data_version=users.c.data_version + 1)
+
+
+@event.listens_for(db.session, 'before_flush')
+def collect_changed_users(session, flush_context, instances):
+    for expense in list(session.new) + list(session.deleted):
+        if isinstance(expense, ExpenseTracker):
+            mark_changed(session, expense.belongs_to)
+    for expense in session.dirty:
+        if isinstance(expense, ExpenseTracker) and session.is_modified(expense):
+            mark_changed(session, expense.belongs_to)
+
+
+@event.listens_for(db.session, 'before_commit')
+def bump_data_versions(session):
+    """Bumps the data version of the users whose expenses or daily totals the transaction changed,
+    keeping their new versions and the periods of the days whose daily totals it changed for
+    carry_forward_reports.
+    """
+    if session.new or session.dirty or session.deleted:
+        # the objects are flushed after before_commit, their users must be known now
+        session.flush()
+    changed_users = session.info.pop('changed_users', set())
+    days_by_user = {}
+    for user_id, day in session.info.pop('changed_days', ()):
+        days_by_user.setdefault(user_id, set()).add(day)
+    changed_users.update(days_by_user)
+    changed_users.discard(None)
+    if not changed_users:
+        return
+    if not session.bind.dialect.implicit_returning:
+        # without RETURNING the new versions are not known, the cached reports are not carried over
+        session.execute(bump_statement(changed_users))
+        return
+    versions = session.execute(bump_statement(changed_users).returning(users.c.id, users.c.data_version))
+    session.info['bumped_versions'] = [(user_id, version, report_periods(days_by_user.get(user_id, ())))
+                                       for user_id, version in versions]
+
+
+@event.listens_for(db.session, 'after_commit')
+def carry_forward_reports(session):
+    """Carries the cached reports of the users the transaction bumped over to their new versions."""
+    bumped_versions = session.info.pop('bumped_versions', ())
+    if not bumped_versions or not has_app_context():
+        return
+    cache = current_app.extensions['report_cache']
+    if cache is None:
+        return
+    for user_id, version, periods in bumped_versions:
+        cache.carry_forward(user_id, version, periods)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_changed_users(session):
+    session.info.pop('changed_users', None)
+    session.info.pop('changed_days', None)
+    session.info.pop('bumped_versions', None)
+
+
+def version_statement(user_id):
+    """The data version of a user, with the archived_until date the reads of their expenses need, see app.archive."""
+    return select([users.c.data_version, users.c.archived_until]).where(users.c.id == user_id)
+
+
+def make_etag(user_id, version, path, args):
+    """The ETag of the response to a request for path with the (key, value) query parameters args,
+    for the data of a user at a version. The same for the same parameters in any order.
+    """
+    query = '&'.join(f'{key}={value}' for key, value in sorted(args))
+    digest = hashlib.sha1(f'{user_id}:{path}?{query}'.encode()).hexdigest()[:16]
+    return f'{version}-{digest}'
+
+
+def not_modified(user_id):
+    """Returns a 304 response if the If-None-Match header of the request matches the ETag of the
+    current data of the user, or None after setting that ETag, the version it was made of and the
+    archived_until date of the user for the view.
+    """
+    row = db.session.execute(version_statement(user_id)).first()
+    if row is None:
+        return None
+    version, archived_until = row
+    etag = make_etag(user_id, version, request.path, request.args.items(multi=True))
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    g.etag = etag
+    # the version of the report cache, and the date the reads of the view reach the archive until
+    g.data_version = version
+    g.archived_until = archived_until
+    return None
+
+
+def set_etag(response):
+    etag = g.get('etag')
+    if etag and response.status_code == 200:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_etags(app):
+    app.after_request(set_etag)
@@ -0,0 +1,59 @@
+"""The CSV and NDJSON of the export of the expenses, written the same by the FlaskAPI and the ASGI app.
+
+Both formats are written a batch of the (id, name, amount_spent, date_of_expense, date_created,
+date_modified) rows of reads.export_statement at a time, as they are fetched from the cursor.
+"""
+import csv
+import io
+import itertools
+from .encoders import http_date
+
+CSV_HEADER = ['id', 'name', 'amount', 'date_of_expense', 'date_created', 'date_modified']
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def batches(rows, batch_size):
+    """The rows in lists of batch_size rows."""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_text(rows, header=False):
+    """The CSV lines of the rows, after the header line if header."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_HEADER)
+    for id, name, amount, date_of_expense, date_created, date_modified in rows:
+        # the dates in the format of the JSON responses, like the NDJSON export
+        writer.writerow([id, name, amount, date_of_expense.strftime('%d-%m-%Y'),
+                         http_date(date_created), http_date(date_modified)])
+    return buffer.getvalue()
+
+
+def ndjson_text(rows, belongs_to, dumps):
+    """The NDJSON lines of the rows of a user, each item encoded by dumps."""
+    lines = []
+    for id, name, amount, date_of_expense, date_created, date_modified in rows:
+        lines.append(dumps({
+            'id': id,
+            'name': name,
+            'amount': amount,
+            'date_of_expense': date_of_expense.strftime('%d-%m-%Y'),
+            'date_created': date_created,
+            'date_modified': date_modified,
+            'belongs_to': belongs_to
+        }))
+    return ''.join(line + '\n' for line in lines)
+
+
+def text(export_format, rows, belongs_to, dumps, header):
+    """The export_format text of the rows of a user, after the CSV header line if header."""
+    if export_format == 'csv':
+        return csv_text(rows, header)
+    return ndjson_text(rows, belongs_to, dumps)
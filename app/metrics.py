@@ -0,0 +1,267 @@
+import bisect
+import hmac
+import threading
+import time
+from flask import request, g, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .pool import pool_stats
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labelnames, labels, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """A metric family, holding one value per combination of label values."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def value(self, *labels):
+        return self._series.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, value in series:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def set(self, *labels, value):
+        """Mirrors a counter kept elsewhere, such as the ones of the connection pool."""
+        with self._lock:
+            self._series[labels] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        # the observations per bucket, the last one for the values over every bound, made cumulative on render
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def value(self, *labels):
+        """Returns the (sum, count) of the observations."""
+        series = self._series.get(labels)
+        return (series[1], series[2]) if series else (0.0, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            series = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count)
+                            in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, observations in zip(self.buckets + (float('inf'),), counts):
+                cumulative += observations
+                le = f'le="{format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# the metrics of this process, every gunicorn worker exports its own
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time spent answering requests.', ['route', 'method']))
+request_db_duration = registry.register(Histogram(
+    'http_request_db_duration_seconds', 'Time spent executing SQL per request.', ['route', 'method']))
+request_python_duration = registry.register(Histogram(
+    'http_request_python_duration_seconds', 'Time spent outside of SQL per request.', ['route', 'method']))
+requests_total = registry.register(Counter(
+    'http_requests_total', 'Requests answered, by status code.', ['route', 'method', 'status']))
+requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'Requests being answered.', ['route']))
+query_duration = registry.register(Histogram(
+    'db_query_duration_seconds', 'Time spent executing each SQL statement.', ['route']))
+pool_connections = registry.register(Gauge(
+    'db_pool_connections', 'Connections of the pool, by state.', ['state']))
+pool_checked_out_max = registry.register(Gauge(
+    'db_pool_checked_out_max', 'The most connections checked out of the pool at once.'))
+pool_size = registry.register(Gauge(
+    'db_pool_size', 'Connections kept open by the pool.'))
+pool_max_overflow = registry.register(Gauge(
+    'db_pool_max_overflow', 'Connections the pool may open over its size.'))
+pool_checkouts = registry.register(Counter(
+    'db_pool_checkouts_total', 'Connections checked out of the pool.'))
+pool_timeouts = registry.register(Counter(
+    'db_pool_timeouts_total', 'Checkouts that timed out waiting for a connection.'))
+pool_wait = registry.register(Counter(
+    'db_pool_wait_seconds_total', 'Time spent waiting for a connection of the pool.'))
+token_cache_lookups = registry.register(Counter(
+    'token_cache_lookups_total', 'Lookups of verified access tokens, by result.', ['result']))
+
+
+def route_name():
+    """The endpoint of the request without its blueprint, or 'unmatched' for the unknown urls,
+    which would otherwise give a series for every url ever requested.
+    """
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.endpoint.rsplit('.', 1)[-1]
+
+
+def start_request():
+    g.metrics_route = route_name()
+    g.metrics_started = time.perf_counter()
+    g.metrics_db_seconds = 0.0
+    requests_in_flight.inc(g.metrics_route)
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc):
+    if 'metrics_started' not in g:
+        return
+    elapsed = time.perf_counter() - g.metrics_started
+    # a request failing with an exception is answered with a 500
+    observe_request(g.metrics_route, request.method, g.get('metrics_status', 500), elapsed, g.metrics_db_seconds)
+
+
+def observe_request(route, method, status, elapsed, db_seconds):
+    """Records an answered request, which took elapsed seconds, db_seconds of them executing SQL."""
+    requests_in_flight.dec(route)
+    requests_total.inc(route, method, str(status))
+    request_duration.observe(route, method, value=elapsed)
+    request_db_duration.observe(route, method, value=db_seconds)
+    request_python_duration.observe(route, method, value=max(elapsed - db_seconds, 0.0))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context() and 'metrics_started' in g:
+        g.metrics_db_seconds += elapsed
+        query_duration.observe(g.metrics_route, value=elapsed)
+    else:
+        query_duration.observe('none', value=elapsed)
+
+
+def scrape_allowed(config, authorization):
+    """Whether a request with the Authorization header may read the statistics of the process,
+    which takes the bearer token of METRICS_TOKEN. Nothing may when METRICS_TOKEN is not set.
+    """
+    token = config.get('METRICS_TOKEN')
+    scheme, _, credentials = (authorization or '').partition(' ')
+    if not token or scheme.lower() != 'bearer':
+        return False
+    return hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def render_metrics(engine, token_cache_stats):
+    """Renders the metrics in the Prometheus text format, with the pool and
+    token cache values read at the time of the scrape.
+    """
+    return Response(metrics_text(pool_stats(engine.pool), token_cache_stats), mimetype=CONTENT_TYPE)
+
+
+def metrics_text(stats, token_cache_stats):
+    """The metrics in the Prometheus text format, with the stats of the pool of pool_stats."""
+    if 'checked_out' in stats:
+        pool_connections.set('checked_out', value=stats['checked_out'])
+        pool_connections.set('checked_in', value=stats['checked_in'])
+        pool_connections.set('overflow', value=max(stats['overflow'], 0))
+        pool_size.set(value=stats['pool_size'])
+        pool_max_overflow.set(value=stats['max_overflow'])
+    if 'checkouts' in stats:
+        pool_checked_out_max.set(value=stats['checked_out_max'])
+        pool_checkouts.set(value=stats['checkouts'])
+        pool_timeouts.set(value=stats['timeouts'])
+        pool_wait.set(value=stats['wait_seconds_total'])
+    token_cache_lookups.set('hit', value=token_cache_stats['hits'])
+    token_cache_lookups.set('miss', value=token_cache_stats['misses'])
+    return registry.render()
+
+
+def init_metrics(app):
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
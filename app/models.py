@@ -1,10 +1,20 @@
 from app import db
-from sqlalchemy import and_
-from flask_bcrypt import Bcrypt
+from app.cache import LRUCache
+from sqlalchemy import and_, func, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from flask import current_app
+import hashlib
 import jwt
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
+from decimal import Decimal
 from instance.config import Config
 
+# tokens that were already verified, by the SHA-256 digest of the token, mapped to their (sub, exp)
+token_cache = LRUCache(Config.TOKEN_CACHE_SIZE, ttl=0)
+
+
 class User(db.Model):
     """This class defines the users table """
 
@@ -14,19 +24,32 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(256), nullable=False, unique=True)
     password = db.Column(db.String(256), nullable=False)
+    # bumped in the transaction of every change to the expenses of the user, see app.etags
+    data_version = db.Column(db.BigInteger, nullable=False, server_default='0')
+    # the newest date archived for the user, see app.archive
+    archived_until = db.Column(db.Date)
     expenses = db.relationship(
         'ExpenseTracker', order_by='ExpenseTracker.id', cascade="all, delete-orphan")
 
     def __init__(self, email, password):
         """Initialize the user with an email and a password."""
         self.email = email
-        self.password = Bcrypt().generate_password_hash(password).decode()
+        self.password = current_app.extensions['password_hasher'].hash(password)
 
     def password_is_valid(self, password):
         """
         Checks the password against it's hash to validates the user's password
         """
-        return Bcrypt().check_password_hash(self.password, password)
+        return current_app.extensions['password_hasher'].verify(self.password, password)
+
+    def rehash_password(self, password):
+        """Hashes the password again if it was hashed with another cost than the configured one.
+        Call it with a password that was just validated.
+        """
+        hasher = current_app.extensions['password_hasher']
+        if hasher.needs_rehash(self.password):
+            self.password = hasher.hash(password)
+            self.save()
 
     def save(self):
         """Save a user to the database.
@@ -35,7 +58,8 @@ class User(db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def generate_token(self, user_id):
+    @staticmethod
+    def generate_token(user_id):
         """ Generates the access token"""
 
         try:
@@ -59,10 +83,22 @@ class User(db.Model):
 
     @staticmethod
     def decode_token(token):
-        """Decodes the access token from the Authorization header."""
+        """Decodes the access token from the Authorization header.
+        Tokens that were already verified are looked up in the token cache instead.
+        """
+        digest = hashlib.sha256(token.encode() if isinstance(token, str) else token).digest()
+        cached = token_cache.get(digest)
+        if cached is not None:
+            sub, exp = cached
+            if exp > time.time():
+                return sub
+            return "Expired token. Please login to get a new token"
         try:
             # try to decode the token using our SECRET variable
             payload = jwt.decode(token, Config.SECRET)
+            if 'exp' in payload:
+                # kept until the token expires, or until it is evicted for more recent tokens
+                token_cache.set(digest, (payload['sub'], payload['exp']), ttl=payload['exp'] - time.time())
             return payload['sub']
         except jwt.ExpiredSignatureError:
             # the token is expired, return an error string
@@ -71,16 +107,26 @@ class User(db.Model):
             # the token is invalid, return an error string
             return "Invalid token. Please register or login"
 
+    @staticmethod
+    def token_cache_stats():
+        """Returns the hits, misses and size of the token cache."""
+        return {'hits': token_cache.hits, 'misses': token_cache.misses, 'size': len(token_cache)}
+
 
 class ExpenseTracker(db.Model):
     """This class represents the Expense tracker table."""
 
     __tablename__ = 'Expense_Tracker'
+    __table_args__ = (
+        # serves the per-user date range filters, the reports and cursor pagination
+        db.Index('ix_expense_tracker_belongs_to_date_of_expense', 'belongs_to', 'date_of_expense', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255))
     amount_spent = db.Column(db.Float)
-    date_of_expense = db.Column(db.Date)
+    # the partition key of the table on PostgreSQL, see app.partitioning, so it cannot be null
+    date_of_expense = db.Column(db.Date, nullable=False)
     date_created = db.Column(db.DateTime, default=db.func.current_timestamp())
     date_modified = db.Column(
         db.DateTime, default=db.func.current_timestamp(),
@@ -94,16 +140,164 @@ class ExpenseTracker(db.Model):
         self.date_of_expense = date_of_expense
         self.belongs_to = belongs_to
 
+    # the columns the fields of the expense items are read from
+    ITEM_COLUMNS = {
+        'id': 'id',
+        'name': 'name',
+        'amount': 'amount_spent',
+        'date_of_expense': 'date_of_expense',
+        'date_created': 'date_created',
+        'date_modified': 'date_modified',
+        'belongs_to': 'belongs_to',
+    }
+
+    @staticmethod
+    def projection(fields, extra=()):
+        """The columns of fields in their order, then the columns named in extra that are not among them."""
+        names = [ExpenseTracker.ITEM_COLUMNS[field] for field in fields]
+        names += [name for name in extra if name not in names]
+        return [getattr(ExpenseTracker, name) for name in names]
+
+    @staticmethod
+    def projected_item(row, fields):
+        """The expense item with only fields, from a row of the columns of projection(fields)."""
+        item = dict(zip(fields, row))
+        if 'date_of_expense' in item:
+            item['date_of_expense'] = item['date_of_expense'].strftime('%d-%m-%Y')
+        return item
+
     def save(self):
+        changes = self.daily_total_changes()
         db.session.add(self)
+        # the daily totals are updated in the same transaction as the expense
+        DailyTotal.apply(self.belongs_to, changes)
         db.session.commit()
 
+    def daily_total_changes(self):
+        """Returns the changes saving this expense makes to the daily totals of its owner,
+        as a {day: (amount, count)} dict. Changing the date moves the amount to the new day.
+        """
+        changes = defaultdict(lambda: (Decimal(0), 0))
+        state = db.inspect(self)
+        if state.persistent:
+            amount_history = state.attrs.amount_spent.history
+            date_history = state.attrs.date_of_expense.history
+            if not amount_history.has_changes() and not date_history.has_changes():
+                return {}
+            old_amount = (amount_history.deleted or amount_history.unchanged)[0]
+            old_day = to_day((date_history.deleted or date_history.unchanged)[0])
+            amount, count = changes[old_day]
+            changes[old_day] = (amount - to_decimal(old_amount), count - 1)
+        amount, count = changes[to_day(self.date_of_expense)]
+        changes[to_day(self.date_of_expense)] = (amount + to_decimal(self.amount_spent), count + 1)
+        return {day: change for day, change in changes.items() if day is not None and change != (0, 0)}
+
+    @staticmethod
+    def bulk_insert(rows, chunk_size=1000):
+        """Inserts many expenses with multi-row INSERT statements, without committing.
+        Each row is a dict of column values. Returns the ids of the new expenses, in the order of rows.
+        """
+        table = ExpenseTracker.__table__
+        ids = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            if db.session.bind.dialect.implicit_returning:
+                # PostgreSQL returns the rows of a multi-row VALUES insert in the order they were given
+                result = db.session.execute(table.insert().values(chunk).returning(table.c.id))
+                ids.extend(row[0] for row in result)
+            else:
+                # databases without RETURNING, like SQLite, only report the id of single row inserts
+                for row in chunk:
+                    ids.append(db.session.execute(table.insert().values(row)).inserted_primary_key[0])
+
+        for belongs_to, user_changes in ExpenseTracker.bulk_insert_changes(rows).items():
+            DailyTotal.apply(belongs_to, user_changes)
+        return ids
+
+    @staticmethod
+    def bulk_insert_changes(rows):
+        """The {belongs_to: {day: (Decimal amount, count)}} changes to the daily totals of inserting the rows."""
+        changes = defaultdict(lambda: defaultdict(lambda: (Decimal(0), 0)))
+        for row in rows:
+            amount, count = changes[row['belongs_to']][to_day(row['date_of_expense'])]
+            changes[row['belongs_to']][to_day(row['date_of_expense'])] = (amount + to_decimal(row['amount_spent']), count + 1)
+        return changes
+
+    @staticmethod
+    def locked_rows_statement(belongs_to, where):
+        """The SELECT of the (id, date_of_expense, amount_spent) of the expenses of a user matching where,
+        locking them until the transaction ends so that their daily totals are moved from the values
+        they still have.
+        """
+        table = ExpenseTracker.__table__
+        return db.select([table.c.id, table.c.date_of_expense, table.c.amount_spent]) \
+            .where(and_(table.c.belongs_to == belongs_to, where)).order_by(table.c.id).with_for_update()
+
+    @staticmethod
+    def locked_rows(belongs_to, where):
+        return db.session.execute(ExpenseTracker.locked_rows_statement(belongs_to, where)).fetchall()
+
+    @staticmethod
+    def batch_update_changes(rows, values):
+        """The {day: (Decimal amount, count)} changes to the daily totals of setting the column values
+        on the expenses of the rows of locked_rows_statement.
+        """
+        changes = defaultdict(lambda: (Decimal(0), 0))
+        for row in rows:
+            amount, count = changes[to_day(row['date_of_expense'])]
+            changes[to_day(row['date_of_expense'])] = (amount - to_decimal(row['amount_spent']), count - 1)
+            day = to_day(values.get('date_of_expense', row['date_of_expense']))
+            amount, count = changes[day]
+            changes[day] = (amount + to_decimal(values.get('amount_spent', row['amount_spent'])), count + 1)
+        return {day: change for day, change in changes.items() if change != (0, 0)}
+
+    @staticmethod
+    def batch_delete_changes(rows):
+        """The {day: (Decimal amount, count)} changes to the daily totals of deleting the expenses of
+        the rows of locked_rows_statement.
+        """
+        changes = defaultdict(lambda: (Decimal(0), 0))
+        for row in rows:
+            amount, count = changes[to_day(row['date_of_expense'])]
+            changes[to_day(row['date_of_expense'])] = (amount - to_decimal(row['amount_spent']), count - 1)
+        return dict(changes)
+
+    @staticmethod
+    def batch_update(belongs_to, where, values):
+        """Sets the column values on the expenses of a user matching where with one UPDATE, without
+        committing. Returns the ids of the updated expenses.
+        """
+        table = ExpenseTracker.__table__
+        rows = ExpenseTracker.locked_rows(belongs_to, where)
+        ids = [row.id for row in rows]
+        if not ids:
+            return ids
+        db.session.execute(table.update().where(and_(table.c.belongs_to == belongs_to, table.c.id.in_(ids)))
+                           .values(**values))
+        DailyTotal.apply(belongs_to, ExpenseTracker.batch_update_changes(rows, values))
+        return ids
+
+    @staticmethod
+    def batch_delete(belongs_to, where):
+        """Deletes the expenses of a user matching where with one DELETE, without committing.
+        Returns the ids of the deleted expenses.
+        """
+        table = ExpenseTracker.__table__
+        rows = ExpenseTracker.locked_rows(belongs_to, where)
+        ids = [row.id for row in rows]
+        if not ids:
+            return ids
+        db.session.execute(table.delete().where(and_(table.c.belongs_to == belongs_to, table.c.id.in_(ids))))
+        DailyTotal.apply(belongs_to, ExpenseTracker.batch_delete_changes(rows))
+        return ids
+
     @staticmethod
     def get_all():
         return ExpenseTracker.query.all()
 
     def delete(self):
         db.session.delete(self)
+        DailyTotal.apply(self.belongs_to, {to_day(self.date_of_expense): (-to_decimal(self.amount_spent), -1)})
         db.session.commit()
 
     @staticmethod
@@ -122,3 +316,173 @@ class ExpenseTracker(db.Model):
 
     def __repr__(self):
         return "<Tracker: {}>".format(self.name)
+
+
+
+def to_day(value):
+    """Returns the date of a date or datetime."""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def to_decimal(amount):
+    """Converts an amount to the exact decimal it is displayed as, so that adding and
+    subtracting amounts gives the same result as with pen and paper.
+    """
+    return Decimal(repr(float(amount or 0)))
+
+
+class ArchivedExpense(db.Model):
+    """This class represents the Expense_Tracker_archive table, the expenses moved out of
+    Expense_Tracker by python manage.py archive, see app.archive. The rows keep their ids and
+    are only read, or moved back when they are written to.
+    """
+
+    __tablename__ = 'Expense_Tracker_archive'
+    __table_args__ = (
+        db.Index('ix_expense_tracker_archive_belongs_to_date_of_expense', 'belongs_to', 'date_of_expense', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(255))
+    amount_spent = db.Column(db.Float)
+    date_of_expense = db.Column(db.Date, nullable=False)
+    date_created = db.Column(db.DateTime)
+    date_modified = db.Column(db.DateTime)
+    belongs_to = db.Column(db.Integer, db.ForeignKey(User.id))
+
+
+class DailyTotal(db.Model):
+    """This class represents the daily_totals table, the total and number of the
+    expenses of a user per day. It is kept up to date on every write so that the
+    reports do not have to aggregate the Expense_Tracker rows.
+    """
+
+    __tablename__ = 'daily_totals'
+
+    belongs_to = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    # an exact type, so that adding and removing amounts does not drift from the sum of the expenses
+    total = db.Column(db.Numeric(asdecimal=False), nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def apply(belongs_to, changes):
+        """Adds the {day: (Decimal amount, count)} changes to the daily totals of a user, without committing.
+        Days left without expenses are removed.
+        """
+        if not changes:
+            return
+        # remembered until the transaction ends, to bump the data versions of the user and of the reports
+        # of these days on commit
+        db.session.info.setdefault('changed_days', set()).update((belongs_to, day) for day in changes)
+
+        if db.session.bind.dialect.name == 'postgresql':
+            for stmt in DailyTotal.upsert_statements(belongs_to, changes):
+                db.session.execute(stmt)
+            return
+
+        table = DailyTotal.__table__
+        # the other databases, like SQLite, do not take Decimal parameters
+        rows = [{'belongs_to': belongs_to, 'day': day, 'total': float(amount), 'count': count}
+                for day, (amount, count) in changes.items()]
+        for row in rows:
+            result = db.session.execute(
+                table.update()
+                .where(and_(table.c.belongs_to == belongs_to, table.c.day == row['day']))
+                .values(total=table.c.total + row['total'], count=table.c.count + row['count']))
+            if result.rowcount == 0:
+                db.session.execute(table.insert().values(row))
+        emptied = DailyTotal.emptied_days_statement(belongs_to, changes)
+        if emptied is not None:
+            db.session.execute(emptied)
+
+    @staticmethod
+    def upsert_statements(belongs_to, changes):
+        """The PostgreSQL statements adding the {day: (Decimal amount, count)} changes to the daily totals
+        of a user: a single INSERT ... ON CONFLICT DO UPDATE, then the removal of the emptied days.
+        """
+        table = DailyTotal.__table__
+        rows = [{'belongs_to': belongs_to, 'day': day, 'total': amount, 'count': count}
+                for day, (amount, count) in changes.items()]
+        stmt = pg_insert(table).values(rows)
+        statements = [stmt.on_conflict_do_update(
+            index_elements=[table.c.belongs_to, table.c.day],
+            set_={'total': table.c.total + stmt.excluded.total, 'count': table.c.count + stmt.excluded.count})]
+        emptied = DailyTotal.emptied_days_statement(belongs_to, changes)
+        if emptied is not None:
+            statements.append(emptied)
+        return statements
+
+    @staticmethod
+    def emptied_days_statement(belongs_to, changes):
+        """The statement removing the days the changes may have left without expenses, or None."""
+        table = DailyTotal.__table__
+        emptied = [day for day, (amount, count) in changes.items() if count < 0]
+        if not emptied:
+            return None
+        return table.delete().where(and_(
+            table.c.belongs_to == belongs_to, table.c.day.in_(emptied), table.c.count <= 0))
+
+    @staticmethod
+    def rebuild():
+        """Recomputes all the daily totals from the Expense_Tracker table and its archive, without committing."""
+        table = DailyTotal.__table__
+        db.session.execute(table.delete())
+        db.session.execute(table.insert().from_select(
+            ['belongs_to', 'day', 'total', 'count'],
+            DailyTotal.aggregate_expenses()))
+
+    @staticmethod
+    def aggregate_expenses():
+        """The daily totals as computed from the Expense_Tracker table and its archive."""
+        expenses = union_all(*[
+            db.select([table.c.belongs_to, table.c.date_of_expense, table.c.amount_spent, table.c.id])
+            .where(and_(table.c.belongs_to.isnot(None), table.c.date_of_expense.isnot(None)))
+            for table in (ExpenseTracker.__table__, ArchivedExpense.__table__)
+        ]).alias('expenses')
+        return db.select([
+            expenses.c.belongs_to, expenses.c.date_of_expense,
+            func.sum(expenses.c.amount_spent), func.count(expenses.c.id)
+        ]).group_by(expenses.c.belongs_to, expenses.c.date_of_expense)
+
+    @staticmethod
+    def verify(tolerance=1e-6):
+        """Compares the daily totals with the Expense_Tracker table and its archive.
+        Returns the (belongs_to, day, expected, found) mismatches, where expected and found
+        are (total, count) tuples, or None when the row is missing.
+        """
+        aggregate = DailyTotal.aggregate_expenses()
+        expected_rows = iter(db.session.execute(
+            aggregate.order_by(*list(aggregate.c)[:2])
+            .execution_options(stream_results=True)))
+        found_rows = iter(db.session.execute(
+            db.select([DailyTotal.belongs_to, DailyTotal.day, DailyTotal.total, DailyTotal.count])
+            .order_by(DailyTotal.belongs_to, DailyTotal.day)
+            .execution_options(stream_results=True)))
+
+        # both sides are sorted by (belongs_to, day), so they are merged instead of loaded in memory
+        mismatches = []
+        expected, found = next(expected_rows, None), next(found_rows, None)
+        while expected is not None or found is not None:
+            expected_key = expected and (expected[0], to_day(expected[1]))
+            found_key = found and (found[0], found[1])
+            if found is None or (expected is not None and expected_key < found_key):
+                mismatches.append(expected_key + ((expected[2], expected[3]), None))
+                expected = next(expected_rows, None)
+            elif expected is None or found_key < expected_key:
+                mismatches.append(found_key + (None, (found[2], found[3])))
+                found = next(found_rows, None)
+            else:
+                if abs(expected[2] - found[2]) > tolerance or expected[3] != found[3]:
+                    mismatches.append(expected_key + ((expected[2], expected[3]), (found[2], found[3])))
+                expected, found = next(expected_rows, None), next(found_rows, None)
+        return mismatches
+
+
+def report_periods(days):
+    """The months, as YYYY-MM, and the years, as YYYY, of the reports covering the days."""
+    periods = set()
+    for day in days:
+        periods.add(day.strftime('%Y-%m'))
+        periods.add(day.strftime('%Y'))
+    return sorted(periods)
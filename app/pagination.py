@@ -0,0 +1,21 @@
+import base64
+import datetime
+
+
+def encode_cursor(date_of_expense, expense_id):
+    """Encodes the position of an expense into an opaque cursor string."""
+    raw = f'{date_of_expense.strftime("%Y-%m-%d")}:{expense_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor into a (date_of_expense, id) tuple.
+    Raises ValueError if the cursor was not produced by encode_cursor.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        date_str, id_str = raw.split(':')
+        return datetime.datetime.strptime(date_str, '%Y-%m-%d').date(), int(id_str)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'The cursor {cursor} is not valid') from e
@@ -0,0 +1,312 @@
+"""Range partitioning of the Expense_Tracker table by the month of date_of_expense, on PostgreSQL.
+
+The table is turned into a partitioned one without stopping the app, in three steps:
+
+1. prepare, by the migration f3a1c7d2b8e4: creates Expense_Tracker_partitioned with the columns
+   and indexes of Expense_Tracker, its monthly partitions and a default partition, and a trigger
+   copying every write to Expense_Tracker into it.
+2. backfill, by ``python manage.py partitions --backfill``: copies the existing rows in batches of
+   short transactions, which lock only the rows they copy.
+3. swap, by the migration 0b6e9d4c2a71: copies the rows the backfill did not, with
+   Expense_Tracker locked, drops it and renames Expense_Tracker_partitioned in its place.
+
+The swap refuses to run while more than PARTITION_SWAP_MAXIMUM_COPIED rows are left to copy, so
+upgrading both migrations at once, as the release does, only converts small tables; a large one
+keeps the release failing until it is backfilled. The app creates the partitions of the coming
+months itself, once a day per process, and ``python manage.py partitions`` does it on demand; the
+rows of months without a partition go to the default partition meanwhile, and are moved out of it
+when their partition is created.
+
+Queries filtering on date_of_expense only read the partitions of their dates. The primary key is
+(id, date_of_expense), as the partition key must be part of it; the ids still come from the same
+sequence, so they stay unique.
+"""
+import datetime
+import logging
+import re
+import threading
+import time
+from sqlalchemy import text
+from app import db
+
+logger = logging.getLogger('app.partitioning')
+
+TABLE = 'Expense_Tracker'
+PARTITIONED = 'Expense_Tracker_partitioned'
+DEFAULT_PARTITION = 'Expense_Tracker_default'
+SEQUENCE = 'Expense_Tracker_id_seq'
+MIRROR = 'expense_tracker_mirror'
+
+COLUMNS = 'id, name, amount_spent, date_of_expense, date_created, date_modified, belongs_to'
+# the partition key cannot be null, the expenses without a date are dated the day they were created
+DATE_OF_EXPENSE = 'coalesce({row}date_of_expense, {row}date_created::date, current_date)'
+
+
+def copied_columns(row=''):
+    """The values of COLUMNS copied from a row of Expense_Tracker, row being the name of the row and a dot."""
+    return ', '.join(DATE_OF_EXPENSE.format(row=row) if column == 'date_of_expense' else row + column
+                     for column in COLUMNS.split(', '))
+
+
+def month_start(day):
+    """The first day of the month of a date, or of a datetime, as databases migrated from an older
+    schema store date_of_expense as a timestamp.
+    """
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_{start:%Y_%m}'
+
+
+def is_partitioned(connection, table=TABLE):
+    return connection.execute(text(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)'), table=f'"{table}"').scalar() == 1
+
+
+def partitions(connection, table=TABLE):
+    """Returns the (name, bounds) of the partitions of the table, in the order of their names."""
+    return [tuple(row) for row in connection.execute(text(
+        'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname'),
+        table=f'"{table}"')]
+
+
+def index_definitions(connection, table):
+    """Returns the (name, definition) of the indexes of the table, but its primary key."""
+    return [tuple(row) for row in connection.execute(text(
+        'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid '
+        'WHERE x.indrelid = to_regclass(:table) AND NOT x.indisprimary ORDER BY i.relname'),
+        table=f'"{table}"')]
+
+
+def copy_index(connection, name, definition, new_name, table):
+    """Creates the index of definition, named name, on table under new_name."""
+    definition = definition.replace(f'INDEX {name} ON', f'INDEX {new_name} ON', 1)
+    connection.execute(re.sub(r' ON (ONLY )?\S+ USING ', f' ON "{table}" USING ', definition, count=1))
+
+
+def create_partition(connection, start, table=TABLE):
+    """Creates the partition of table for the month of start, moving its rows out of the default
+    partition. Returns its name, or None if it already exists.
+    """
+    name = partition_name(start)
+    if connection.execute(text('SELECT to_regclass(:name)'), name=f'"{name}"').scalar() is not None:
+        return None
+    end = add_months(start, 1)
+    connection.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # the default partition may not keep rows of the range of a new partition
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE date_of_expense >= :start '
+        f'AND date_of_expense < :end RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'), start=start, end=end)
+    connection.execute(f"ALTER TABLE \"{table}\" ATTACH PARTITION \"{name}\" FOR VALUES FROM ('{start}') TO ('{end}')")
+    return name
+
+
+def ensure_partitions(connection, months_ahead, today=None):
+    """Creates the missing partitions from the current month to months_ahead months after it, each in
+    its own transaction. Returns the names of the partitions created, none if the table is not partitioned.
+    """
+    if not is_partitioned(connection):
+        return []
+    start = month_start(today or datetime.date.today())
+    created = []
+    for months in range(months_ahead + 1):
+        with connection.begin():
+            # every process of the app runs it, one at a time
+            connection.execute(text('SELECT pg_advisory_xact_lock(hashtext(:table))'), table=TABLE)
+            name = create_partition(connection, add_months(start, months))
+        if name:
+            created.append(name)
+    return created
+
+
+def prepare(connection, months_ahead=3, months_behind=120, today=None):
+    """Creates Expense_Tracker_partitioned, empty, with the partitions of the months of the expenses
+    up to months_behind months ago, the older ones go to the default partition, and to months_ahead
+    months from now. Installs the trigger copying the writes to Expense_Tracker into it.
+    """
+    connection.execute(f'CREATE TABLE "{PARTITIONED}" (LIKE "{TABLE}" INCLUDING DEFAULTS) '
+                       'PARTITION BY RANGE (date_of_expense)')
+    connection.execute(f'ALTER TABLE "{PARTITIONED}" ALTER COLUMN date_of_expense SET NOT NULL, '
+                       f'ADD CONSTRAINT "{PARTITIONED}_pkey" PRIMARY KEY (id, date_of_expense), '
+                       f'ADD CONSTRAINT "{PARTITIONED}_belongs_to_fkey" FOREIGN KEY (belongs_to) REFERENCES users (id)')
+    connection.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARTITIONED}" DEFAULT')
+
+    this_month = month_start(today or datetime.date.today())
+    first = connection.execute(f'SELECT min(date_of_expense) FROM "{TABLE}"').scalar()
+    first = max(month_start(first or this_month), add_months(this_month, -months_behind))
+    start = min(first, this_month)
+    while start <= add_months(this_month, months_ahead):
+        create_partition(connection, start, table=PARTITIONED)
+        start = add_months(start, 1)
+
+    # created on the partitioned table, they are created on every partition
+    for name, definition in index_definitions(connection, TABLE):
+        copy_index(connection, name, definition, f'{name}_partitioned', PARTITIONED)
+
+    install_mirror(connection)
+
+
+def install_mirror(connection):
+    """Installs the trigger copying the writes to Expense_Tracker into Expense_Tracker_partitioned."""
+    connection.execute(f'''
+        CREATE FUNCTION {MIRROR}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM "{PARTITIONED}" WHERE id = OLD.id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO "{PARTITIONED}" ({COLUMNS}) VALUES ({copied_columns('NEW.')}) ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END $$''')
+    connection.execute(f'CREATE TRIGGER {MIRROR} AFTER INSERT OR UPDATE OR DELETE ON "{TABLE}" '
+                       f'FOR EACH ROW EXECUTE FUNCTION {MIRROR}()')
+
+
+def backfill(connection, batch_size=10000, progress=None):
+    """Copies the rows of Expense_Tracker to Expense_Tracker_partitioned, batch_size rows per transaction.
+    The rows of a batch are locked while they are copied, so the trigger and the copy cannot write
+    different versions of a row. Returns the number of rows read.
+    """
+    after_id, total = 0, 0
+    while True:
+        with connection.begin():
+            last_id, count = connection.execute(text(
+                f'WITH batch AS (SELECT {COLUMNS} FROM "{TABLE}" WHERE id > :after_id ORDER BY id '
+                f'LIMIT :batch_size FOR UPDATE), '
+                f'copied AS (INSERT INTO "{PARTITIONED}" ({COLUMNS}) SELECT {copied_columns()} FROM batch '
+                f'ON CONFLICT DO NOTHING) '
+                f'SELECT max(id), count(*) FROM batch'), after_id=after_id, batch_size=batch_size).first()
+        if not count:
+            return total
+        after_id, total = last_id, total + count
+        if progress:
+            progress(total)
+
+
+def rows_to_copy(connection, limit):
+    """The number of rows of Expense_Tracker not in Expense_Tracker_partitioned yet, counted up to limit + 1."""
+    return connection.execute(text(
+        f'SELECT count(*) FROM (SELECT 1 FROM "{TABLE}" o WHERE NOT EXISTS '
+        f'(SELECT 1 FROM "{PARTITIONED}" p WHERE p.id = o.id) LIMIT :limit) AS left_to_copy'),
+        limit=limit + 1).scalar()
+
+
+def swap(connection, maximum_copied=None):
+    """Copies the rows the backfill did not, with Expense_Tracker locked, then replaces it with
+    Expense_Tracker_partitioned. Runs in the transaction of connection. Raises a RuntimeError
+    instead when more than maximum_copied rows are left to copy.
+    """
+    if maximum_copied is not None and rows_to_copy(connection, maximum_copied) > maximum_copied:
+        raise RuntimeError(f'More than {maximum_copied} expenses are not copied to {PARTITIONED} yet, '
+                           'run python manage.py partitions --backfill before upgrading')
+    connection.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+    connection.execute(f'INSERT INTO "{PARTITIONED}" ({COLUMNS}) SELECT {copied_columns("o.")} FROM "{TABLE}" o '
+                       f'WHERE NOT EXISTS (SELECT 1 FROM "{PARTITIONED}" p WHERE p.id = o.id)')
+    connection.execute(f'DROP TRIGGER {MIRROR} ON "{TABLE}"')
+    connection.execute(f'DROP FUNCTION {MIRROR}()')
+    # the sequence belongs to the id column of the table it is dropped with otherwise
+    connection.execute(f'ALTER SEQUENCE "{SEQUENCE}" OWNED BY "{PARTITIONED}".id')
+    connection.execute(f'DROP TABLE "{TABLE}"')
+    connection.execute(f'ALTER TABLE "{PARTITIONED}" RENAME TO "{TABLE}"')
+    for suffix in ('pkey', 'belongs_to_fkey'):
+        connection.execute(f'ALTER TABLE "{TABLE}" RENAME CONSTRAINT "{PARTITIONED}_{suffix}" TO "{TABLE}_{suffix}"')
+    for name, _ in index_definitions(connection, TABLE):
+        if name.endswith('_partitioned'):
+            connection.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:-len("_partitioned")]}"')
+
+
+def unswap(connection):
+    """Undoes swap: puts back a plain Expense_Tracker with the rows, the indexes and the trigger,
+    the partitioned table being Expense_Tracker_partitioned again.
+    """
+    connection.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+    connection.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{PARTITIONED}"')
+    for suffix in ('pkey', 'belongs_to_fkey'):
+        connection.execute(f'ALTER TABLE "{PARTITIONED}" RENAME CONSTRAINT "{TABLE}_{suffix}" TO "{PARTITIONED}_{suffix}"')
+    indexes = index_definitions(connection, PARTITIONED)
+    for name, _ in indexes:
+        connection.execute(f'ALTER INDEX "{name}" RENAME TO "{name}_partitioned"')
+
+    connection.execute(f'CREATE TABLE "{TABLE}" (LIKE "{PARTITIONED}" INCLUDING DEFAULTS)')
+    connection.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN date_of_expense DROP NOT NULL, '
+                       f'ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id), '
+                       f'ADD CONSTRAINT "{TABLE}_belongs_to_fkey" FOREIGN KEY (belongs_to) REFERENCES users (id)')
+    connection.execute(f'INSERT INTO "{TABLE}" ({COLUMNS}) SELECT {COLUMNS} FROM "{PARTITIONED}"')
+    connection.execute(f'ALTER SEQUENCE "{SEQUENCE}" OWNED BY "{TABLE}".id')
+    for name, definition in indexes:
+        copy_index(connection, name, definition, name, TABLE)
+    install_mirror(connection)
+
+
+def discard(connection):
+    """Undoes prepare: drops the trigger and Expense_Tracker_partitioned with its partitions."""
+    connection.execute(f'DROP TRIGGER IF EXISTS {MIRROR} ON "{TABLE}"')
+    connection.execute(f'DROP FUNCTION IF EXISTS {MIRROR}()')
+    connection.execute(f'DROP TABLE IF EXISTS "{PARTITIONED}"')
+
+
+class PartitionMaintainer(object):
+    """Creates the partitions of the coming months from the app, in a background thread at most
+    once every interval seconds, so that they exist without a scheduled job.
+    """
+
+    def __init__(self, engine, months_ahead, interval, timer=time.monotonic):
+        self.engine = engine
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self.timer = timer
+        self.next_run = 0
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def due(self):
+        """Whether it is time to check the partitions, the next check being scheduled if so."""
+        with self._lock:
+            now = self.timer()
+            if now < self.next_run:
+                return False
+            self.next_run = now + self.interval
+            return True
+
+    def run(self, today=None):
+        """Creates the missing partitions, returns their names."""
+        with self.engine.connect() as connection:
+            created = ensure_partitions(connection, self.months_ahead, today=today)
+        for name in created:
+            logger.info('Created the partition %s', name)
+        return created
+
+    def check(self):
+        if self.due():
+            self.thread = threading.Thread(target=self.run_logged, daemon=True)
+            self.thread.start()
+
+    def run_logged(self):
+        try:
+            self.run()
+        except Exception:
+            logger.exception('Could not create the partitions of %s', TABLE)
+
+
+def init_partitions(app):
+    """Checks the partitions of the coming months on the requests, every PARTITION_CHECK_INTERVAL
+    seconds, if it is set and the database is PostgreSQL.
+    """
+    interval = app.config.get('PARTITION_CHECK_INTERVAL')
+    engine = db.get_engine(app)
+    if not interval or engine.dialect.name != 'postgresql':
+        app.extensions['partition_maintainer'] = None
+        return
+    maintainer = PartitionMaintainer(engine, app.config['PARTITION_MONTHS_AHEAD'], interval)
+    app.before_request(maintainer.check)
+    app.extensions['partition_maintainer'] = maintainer
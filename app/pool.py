@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+# the options only a queue pool takes
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that keeps track of how long the checkouts waited for a connection,
+    how many timed out and how many connections were checked out at most at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.checked_out_max = 0
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        # includes opening a new connection and the pre-ping, everything a request waits for
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            self.checked_out_max = max(self.checked_out_max, self.checkedout())
+        return connection
+
+
+class RoutingSession(SignallingSession):
+    """A session reading from the replica engine in info['replica'] when one is set, see app.replicas.
+    Flushes and INSERT, UPDATE and DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with an InstrumentedQueuePool for the server databases,
+    and sessions that can read from replicas.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        if sa_url.drivername.startswith('sqlite'):
+            # SQLite gets a static or a null pool, which take none of the queue options
+            for option in QUEUE_POOL_OPTIONS:
+                engine_opts.pop(option, None)
+        else:
+            engine_opts.setdefault('poolclass', InstrumentedQueuePool)
+        return super().create_engine(sa_url, engine_opts)
+
+
+def pool_stats(pool):
+    """Returns the statistics of the connection pool of this process.
+    Each worker process has its own pool, so the statistics are per process.
+    """
+    stats = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'pool_size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            # negative while the pool has not opened pool_size connections yet
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update({
+            'checked_out_max': pool.checked_out_max,
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_seconds_total': pool.wait_seconds_total,
+            'wait_seconds_max': pool.wait_seconds_max,
+            'wait_seconds_mean': pool.wait_seconds_total / pool.checkouts if pool.checkouts else 0.0,
+        })
+    return stats
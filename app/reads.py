@@ -0,0 +1,158 @@
+"""Reads of the expenses on SQLAlchemy Core, for the views that only read them.
+
+The rows are turned into items directly, without a Query, ExpenseTracker objects or the identity
+map of the session. Each statement is built once per shape of the request, which filters, search
+and page it has, with bound parameters for its values, so its compiled form is cached and reused.
+The statements run on the connection of the session, in the transaction of the request.
+"""
+import functools
+from flask import g
+from flask_sqlalchemy import Pagination
+from sqlalchemy import select, bindparam, func, and_, tuple_
+from sqlalchemy.util import LRUCache
+from app import db, archive
+from .models import ExpenseTracker
+from .search import FILTERS, search_expressions
+
+expenses = ExpenseTracker.__table__
+
+# the fields of the items when the client does not ask for some
+ALL_FIELDS = tuple(ExpenseTracker.ITEM_COLUMNS)
+
+# the compiled statements, SQLAlchemy keys them by statement and dialect
+compiled_cache = LRUCache(1000)
+
+
+def execute(statement, parameters):
+    connection = db.session.connection().execution_options(compiled_cache=compiled_cache)
+    return connection.execute(statement, parameters)
+
+
+@functools.lru_cache(maxsize=None)
+def expense_statement():
+    return select([expenses]).where(and_(expenses.c.id == bindparam('id'),
+                                         expenses.c.belongs_to == bindparam('belongs_to')))
+
+
+@functools.lru_cache(maxsize=None)
+def archived_expense_statement():
+    return archive.on_archive(expense_statement())
+
+
+def get_expense(expense_id, belongs_to):
+    """Returns the row of the expense of a user, or None if the user has no such expense.
+    The archive is only read when the expense is not in Expense_Tracker.
+    """
+    parameters = {'id': expense_id, 'belongs_to': belongs_to}
+    row = execute(expense_statement(), parameters).first()
+    if row is None:
+        row = execute(archived_expense_statement(), parameters).first()
+    return row
+
+
+def filtered_statement(columns, filters, search, dialect_name, archived=False, clauses=()):
+    """The expenses of a user with columns, for the names of the filters and of the search values,
+    and of the archive too if archived. Returns the statement, its ORDER BY clauses for the search
+    and a function adapting the clauses on Expense_Tracker to the columns of the statement.
+    """
+    clauses = [expenses.c.belongs_to == bindparam('belongs_to'), *clauses]
+    clauses += [FILTERS[key](bindparam(key)) for key in filters]
+    order_by = []
+    if search:
+        search_filter, order_by = search_expressions({key: bindparam(key) for key in search}, dialect_name)
+        clauses.append(search_filter)
+    if not archived:
+        return select(columns).where(and_(*clauses)), order_by, lambda clause: clause
+
+    statement, adapt = archive.select_including_archive(columns, and_(*clauses))
+    return statement, [adapt(clause) for clause in order_by], adapt
+
+
+@functools.lru_cache(maxsize=512)
+def page_statements(fields, filters, search, dialect_name, archived=False):
+    """The statements of a page of items with fields and of the count of all of them. The items
+    are ordered by id, the order they were created in, after the relevance of the search, so the
+    pages do not overlap once the reads include the archive.
+    """
+    statement, order_by, adapt = filtered_statement(
+        ExpenseTracker.projection(fields), filters, search, dialect_name, archived)
+    count = select([func.count()]).select_from(statement.alias())
+    statement = statement.order_by(*order_by, adapt(expenses.c.id))
+    return statement.limit(bindparam('limit')).offset(bindparam('offset')), count
+
+
+@functools.lru_cache(maxsize=512)
+def cursor_statement(fields, filters, after_cursor, archived=False):
+    """The statement of a page of items with fields after a cursor, with the date and the id
+    of the rows the next cursor is made of.
+    """
+    columns = ExpenseTracker.projection(fields, extra=('date_of_expense', 'id'))
+    clauses = []
+    if after_cursor:
+        clauses.append(tuple_(expenses.c.date_of_expense, expenses.c.id) >
+                       tuple_(bindparam('cursor_date'), bindparam('cursor_id')))
+    statement, _, adapt = filtered_statement(columns, filters, (), None, archived, clauses)
+    return statement.order_by(adapt(expenses.c.date_of_expense), adapt(expenses.c.id)).limit(bindparam('limit'))
+
+
+@functools.lru_cache(maxsize=64)
+def export_statement(filters, archived=False):
+    """The statement of the rows of the export, ordered by date and id."""
+    columns = [ExpenseTracker.id, ExpenseTracker.name, ExpenseTracker.amount_spent, ExpenseTracker.date_of_expense,
+               ExpenseTracker.date_created, ExpenseTracker.date_modified]
+    statement, _, adapt = filtered_statement(columns, filters, (), None, archived)
+    return statement.order_by(adapt(expenses.c.date_of_expense), adapt(expenses.c.id))
+
+
+def reaches_archive(belongs_to, filters):
+    """Whether the reads of the expenses of a user with the filter values include the archive. The
+    archived_until date is the one app.etags.not_modified read with the data version, when it did.
+    """
+    archived_until = g.archived_until if 'archived_until' in g else archive.archived_until(belongs_to)
+    return archive.reaches_archive(archived_until, filters)
+
+
+def expense_page(belongs_to, page, per_page, fields=ALL_FIELDS, filters=None, search=None):
+    """Returns the Pagination of the rows of a page, like Query.paginate, with the filter values
+    of filter_values and the search values of search_values. Returns None past the last page.
+    """
+    filters, search = filters or {}, search or {}
+    statement, count = page_statements(tuple(fields), tuple(filters), tuple(search), db.engine.dialect.name,
+                                       reaches_archive(belongs_to, filters))
+    parameters = dict(filters, **search, belongs_to=belongs_to)
+    items = execute(statement, dict(parameters, limit=per_page, offset=(page - 1) * per_page)).fetchall()
+    if not items and page != 1:
+        return None
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = execute(count, parameters).scalar()
+    return Pagination(None, page, per_page, total, items)
+
+
+def expenses_after(belongs_to, cursor, limit, fields=ALL_FIELDS, filters=None):
+    """Returns the rows of the limit expenses after cursor, a (date_of_expense, id) tuple or None
+    for the first ones, ordered by date and id.
+    """
+    filters = filters or {}
+    statement = cursor_statement(tuple(fields), tuple(filters), cursor is not None,
+                                 reaches_archive(belongs_to, filters))
+    parameters = dict(filters, belongs_to=belongs_to, limit=limit)
+    if cursor is not None:
+        parameters['cursor_date'], parameters['cursor_id'] = cursor
+    return execute(statement, parameters).fetchall()
+
+
+def export_rows(belongs_to, filters=None, batch_size=1000):
+    """Returns the result of the (id, name, amount_spent, date_of_expense, date_created, date_modified)
+    rows of the export, fetched batch_size at a time from a server-side cursor.
+    """
+    filters = filters or {}
+    statement = export_statement(tuple(filters), reaches_archive(belongs_to, filters))
+    connection = db.session.connection().execution_options(
+        compiled_cache=compiled_cache, stream_results=True, max_row_buffer=batch_size)
+    return connection.execute(statement, dict(filters, belongs_to=belongs_to))
+
+
+def items(rows, fields=ALL_FIELDS):
+    return [ExpenseTracker.projected_item(row, fields) for row in rows]
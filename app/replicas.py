@@ -0,0 +1,151 @@
+"""Routing of the read-only requests to the read replicas.
+
+The replicas are the binds of DATABASE_REPLICA_URLS. A GET or HEAD request reads from one of them,
+in turn, while the writes and every other request use the primary. A user who wrote in the last
+READ_YOUR_WRITES_SECONDS reads from the primary, so they see their writes before the replicas
+replay them; the users who wrote are remembered by each process, which is enough as long as a
+client keeps using the same workers or the window covers how far behind the replicas are.
+
+A replica that cannot be connected to, or that is more than REPLICA_MAX_LAG_SECONDS behind, is
+left out for REPLICA_RETRY_SECONDS, the requests it would have served read from the primary.
+"""
+import itertools
+import logging
+import threading
+import time
+from flask import current_app, request
+from sqlalchemy import event, text
+from app import db
+from .cache import LRUCache
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+# the seconds a PostgreSQL replica is behind, 0 when it replayed everything it received or is a primary
+LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END')
+
+
+class Replica(object):
+    """A replica engine and when it is checked again."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.checked_at = None
+        self.healthy = True
+
+
+class ReplicaRouter(object):
+    """Picks the replica the read-only requests of the users who did not write recently read from."""
+
+    def __init__(self, engines=(), read_your_writes=5, max_lag=None, retry=30, check_interval=10,
+                 timer=time.monotonic):
+        self.replicas = [Replica(name, engine) for name, engine in engines]
+        self.max_lag = max_lag
+        self.retry = retry
+        self.check_interval = check_interval
+        self.timer = timer
+        self.recent_writers = LRUCache(100000, ttl=read_your_writes, timer=timer)
+        self._turns = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error', self.disconnect_handler(replica))
+
+    def disconnect_handler(self, replica):
+        def handle_error(context):
+            if context.is_disconnect:
+                self.mark_unhealthy(replica, context.original_exception)
+        return handle_error
+
+    def mark_unhealthy(self, replica, reason):
+        if replica.healthy:
+            logger.warning('Replica %s left out for %s seconds: %s', replica.name, self.retry, reason)
+        replica.healthy = False
+        replica.checked_at = self.timer() + self.retry - self.check_interval
+
+    def check(self, replica):
+        """Connects to the replica, and measures its lag if there is a maximum."""
+        replica.checked_at = self.timer()
+        try:
+            with replica.engine.connect() as connection:
+                if self.max_lag is not None and replica.engine.dialect.name == 'postgresql':
+                    lag = connection.execute(LAG_QUERY).scalar() or 0
+                    if lag > self.max_lag:
+                        self.mark_unhealthy(replica, f'{lag:.1f} seconds behind')
+                        return
+                else:
+                    connection.execute(text('SELECT 1'))
+        except Exception as e:
+            self.mark_unhealthy(replica, e)
+        else:
+            replica.healthy = True
+
+    def wrote(self, user_id):
+        """Sends the reads of the user to the primary for the read your writes window."""
+        self.recent_writers.set(user_id, True)
+
+    def replica_for(self, user_id):
+        """Returns the engine of the next healthy replica, or None to read from the primary."""
+        if not self.replicas or (user_id is not None and self.recent_writers.get(user_id)):
+            return None
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = next(self._turns)
+                due = replica.checked_at is None or self.timer() - replica.checked_at >= self.check_interval
+                if due:
+                    # the other requests do not wait for the check, they use the last result
+                    replica.checked_at = self.timer()
+            if due:
+                self.check(replica)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+
+def request_user():
+    """The id of the user of the access token of the request, or None."""
+    parts = request.headers.get('Authorization', '').split(' ')
+    if len(parts) < 2 or not parts[1]:
+        return None
+    user_id = User.decode_token(parts[1])
+    return None if isinstance(user_id, str) else user_id
+
+
+def route_request():
+    router = current_app.extensions['replica_router']
+    if router.replicas and request.method in READ_ONLY_METHODS:
+        engine = router.replica_for(request_user())
+        if engine is not None:
+            db.session.info['replica'] = engine
+
+
+def forget_replica(exception=None):
+    # the session outlives the request when the app context was pushed before it
+    db.session.info.pop('replica', None)
+
+
+def remember_writes(response):
+    router = current_app.extensions['replica_router']
+    if router.replicas and request.method not in READ_ONLY_METHODS:
+        user_id = request_user()
+        if user_id is not None:
+            router.wrote(user_id)
+    return response
+
+
+def init_replicas(app):
+    engines = [(key, db.get_engine(app, bind=key)) for key in sorted(app.config.get('SQLALCHEMY_BINDS') or {})
+               if key.startswith('replica_')]
+    app.extensions['replica_router'] = ReplicaRouter(
+        engines,
+        read_your_writes=app.config['READ_YOUR_WRITES_SECONDS'],
+        max_lag=app.config['REPLICA_MAX_LAG_SECONDS'],
+        retry=app.config['REPLICA_RETRY_SECONDS'],
+        check_interval=app.config['REPLICA_CHECK_INTERVAL_SECONDS'])
+    app.before_request(route_request)
+    app.after_request(remember_writes)
+    app.teardown_request(forget_replica)
@@ -0,0 +1,147 @@
+import datetime
+import logging
+import re
+from sqlalchemy import DDL, event, case, func, and_, text
+from app import db
+from app.models import ExpenseTracker
+from app.validation import parse_date
+
+logger = logging.getLogger('app.search')
+
+# the text search configuration used by both the index and the queries, they must match
+# for PostgreSQL to use the index
+TS_CONFIG = 'simple'
+
+name_vector = func.to_tsvector(TS_CONFIG, func.coalesce(ExpenseTracker.name, ''))
+
+event.listen(
+    ExpenseTracker.__table__,
+    'after_create',
+    DDL(f'CREATE INDEX ix_expense_tracker_name_fts ON "Expense_Tracker" '
+        f"USING gin (to_tsvector('{TS_CONFIG}', coalesce(name, '')))").execute_if(dialect='postgresql')
+)
+
+
+def has_pg_trgm(ddl, target, bind, **kw):
+    """Whether the pg_trgm extension can be created, it is a contrib extension that is not installed on
+    every PostgreSQL server. Logs a warning when it cannot: the ILIKE of ?name= then scans the expenses.
+    """
+    if bind.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar() is None:
+        logger.warning('pg_trgm is not available, the names of %s get no trigram index', target.name)
+        return False
+    return True
+
+
+def pg_trgm_created(ddl, target, bind, **kw):
+    return bind.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar() is not None
+
+
+# the trigram index of the ILIKE '%...%' substring match of ?name=, as created by the migrations
+event.listen(
+    ExpenseTracker.__table__,
+    'after_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql', callable_=has_pg_trgm)
+)
+event.listen(
+    ExpenseTracker.__table__,
+    'after_create',
+    DDL('CREATE INDEX ix_expense_tracker_name_trgm ON "Expense_Tracker" USING gin (name gin_trgm_ops)')
+    .execute_if(dialect='postgresql', callable_=pg_trgm_created)
+)
+
+
+def search_terms(q):
+    """Splits a search string into the words that are searched for."""
+    return re.findall(r'\w+', q or '')
+
+
+# the filters of the query parameters, built from their values or from bound parameters
+FILTERS = {
+    'name': lambda value: ExpenseTracker.name.ilike(value),
+    'start_date': lambda value: ExpenseTracker.date_of_expense >= value,
+    # half-open range so the (belongs_to, date_of_expense) index can be used
+    'end_date': lambda value: ExpenseTracker.date_of_expense < value,
+}
+
+
+def filter_values(args):
+    """Returns the values of the filters of the name, start_date and end_date query parameters.
+    Raises ValueError with a message for the client if a date is not valid.
+    """
+    values = {}
+    search_str = args.get('name')
+    if search_str:
+        values['name'] = f'%{search_str}%'
+
+    start_date_str = args.get('start_date')
+    if start_date_str:
+        values['start_date'] = parse_date(start_date_str)
+
+    end_date_str = args.get('end_date')
+    if end_date_str:
+        values['end_date'] = parse_date(end_date_str) + datetime.timedelta(days=1)
+    return values
+
+
+def batch_selection(data, maximum_ids):
+    """Validates how a batch PATCH or DELETE selects the expenses: by their ids, or by the name,
+    start_date and end_date filters. Returns (ids, errors, None), errors being the ids that are
+    not valid, or ([], [], filter values). Raises ValueError with a message for the client.
+    """
+    if ('ids' in data) == ('filter' in data):
+        raise ValueError('Please send either the ids of the expenses or a filter')
+    if 'ids' in data:
+        if not isinstance(data['ids'], list) or len(data['ids']) > maximum_ids:
+            raise ValueError(f'Please send a list of at most {maximum_ids} ids')
+        ids = []
+        errors = []
+        for id in data['ids']:
+            if isinstance(id, int) and not isinstance(id, bool):
+                if id not in ids:
+                    ids.append(id)
+            else:
+                errors.append({'id': id, 'message': f'{id} is not a valid id'})
+        return ids, errors, None
+    filters = filter_values(data['filter'] if hasattr(data['filter'], 'get') else {})
+    if not filters:
+        raise ValueError('Please filter the expenses by name, start_date or end_date')
+    return [], [], filters
+
+
+def search_values(terms, dialect_name):
+    """Returns the values search_expressions matches the expense names against."""
+    if dialect_name == 'postgresql':
+        return {'tsquery': ' & '.join(f'{term}:*' for term in terms)}
+    phrase = ' '.join(terms)
+    values = {'phrase': phrase.lower(), 'phrase_prefix': f'{phrase}%'}
+    values.update({f'term_{index}': f'%{term}%' for index, term in enumerate(terms)})
+    return values
+
+
+def search_expressions(values, dialect_name):
+    """Returns the filter and the ORDER BY clauses of a search, from the values of search_values
+    or from bound parameters of the same names.
+    """
+    if dialect_name == 'postgresql':
+        query = func.to_tsquery(TS_CONFIG, values['tsquery'])
+        return name_vector.op('@@')(query), [func.ts_rank(name_vector, query, 1).desc()]
+
+    rank = case([
+        (func.lower(ExpenseTracker.name) == values['phrase'], 0),
+        (ExpenseTracker.name.ilike(values['phrase_prefix']), 1),
+    ], else_=2)
+    terms = [value for key, value in values.items() if key.startswith('term_')]
+    return and_(*[ExpenseTracker.name.ilike(term) for term in terms]), [rank, func.length(ExpenseTracker.name)]
+
+
+def search_clauses(terms, dialect_name=None):
+    """Returns a filter matching expense names against the search terms and a list of
+    ORDER BY clauses that put the best matches first.
+
+    PostgreSQL uses the full-text index on the name, matching every term as a prefix and ranking
+    with ts_rank normalised by the name length. Other databases, such as SQLite, fall back to
+    ILIKE and rank exact matches first, then names starting with the search string, then shorter
+    names. The dialect defaults to the one of the app's database.
+    """
+    dialect_name = dialect_name or db.engine.dialect.name
+    return search_expressions(search_values(terms, dialect_name), dialect_name)
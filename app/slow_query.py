@@ -0,0 +1,190 @@
+import logging
+import re
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from app import db
+from .cache import LRUCache
+from .metrics import registry, Counter
+
+logger = logging.getLogger('app.slow_query')
+
+slow_queries = registry.register(Counter(
+    'db_slow_queries_total', 'Statements over the slow query threshold, by whether they were logged.',
+    ['route', 'logged']))
+
+# the longest parameters logged, bulk inserts can have thousands
+MAXIMUM_PARAMETERS_LENGTH = 2000
+
+# the parameters whose values are never logged, by a part of their name, such as the password hashes
+# written to users
+SECRET_PARAMETERS = ('password', 'secret', 'token')
+
+# the statements EXPLAIN takes, the others such as the DDL only get logged
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES')
+
+
+class TokenBucket(object):
+    """Allows rate events per second on average, and bursts of up to burst events. The lock, a
+    reentrant one, can be shared with the state its callers update along with the tokens.
+    """
+
+    def __init__(self, rate, burst, timer=time.monotonic, lock=None):
+        self.rate = rate
+        self.burst = burst
+        self.timer = timer
+        self.tokens = burst
+        self.updated = timer()
+        self._lock = lock or threading.RLock()
+
+    def take(self):
+        """Takes a token if there is one left. Returns whether it did."""
+        with self._lock:
+            now = self.timer()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def statement_shape(statement):
+    """The statement without its parameters, with the lists of IN clauses and multi-row VALUES
+    collapsed, so the statements differing only by their number of parameters share a shape.
+    """
+    shape = re.sub(r'%\([^)]*\)s|\?|\$\d+', '?', statement)
+    shape = re.sub(r'\?(, \?)+', '?, ...', shape)
+    return re.sub(r'(\([?., ]+\))(, \([?., ]+\))+', r'\1, ...', shape)
+
+
+def redact(parameters):
+    """The parameters of a statement to log, without the values of the secret ones. The positional
+    parameters, which have no names to tell them by, are logged as their types and lengths.
+    """
+    if isinstance(parameters, dict):
+        return {name: '<redacted>' if any(secret in name.lower() for secret in SECRET_PARAMETERS) else value
+                for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and all(isinstance(row, (dict, list, tuple)) for row in parameters):
+            # the rows of an executemany
+            return [redact(row) for row in parameters]
+        return [f'{type(value).__name__}({len(value)})' if isinstance(value, (str, bytes)) else type(value).__name__
+                for value in parameters]
+    return parameters
+
+
+def current_route():
+    if not has_request_context():
+        return 'none'
+    return g.get('metrics_route') or request.endpoint or 'unmatched'
+
+
+class SlowQueryLog(object):
+    """Logs the statements taking longer than threshold seconds, with their redacted parameters, the route
+    that issued them and their plan. The plan of a statement shape is captured once per
+    explain_ttl seconds, and at most rate statements are logged per second.
+    """
+
+    def __init__(self, threshold, rate=1, burst=10, explain=True, explain_ttl=3600, max_shapes=1000):
+        self.threshold = threshold
+        self.explain = explain
+        # the threads of a worker share the log, the dropped count is updated with the tokens
+        self._lock = threading.RLock()
+        self.bucket = TokenBucket(rate, burst, lock=self._lock)
+        self.explained = LRUCache(max_shapes, explain_ttl)
+        self.dropped = 0
+
+    def attach(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('slow_query_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        if elapsed < self.threshold:
+            return
+
+        route = current_route()
+        with self._lock:
+            logged = self.bucket.take()
+            if logged:
+                dropped, self.dropped = self.dropped, 0
+            else:
+                self.dropped += 1
+        if not logged:
+            # dropped, but still counted so the metrics show how many there were
+            slow_queries.inc(route, 'false')
+            return
+        slow_queries.inc(route, 'true')
+
+        plan = None
+        shape = statement_shape(statement)
+        if self.explain and not executemany and conn.dialect.name == 'postgresql' \
+                and statement.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS) \
+                and self.explained.get(shape) is None:
+            self.explained.set(shape, True)
+            streamed = context is not None and context.execution_options.get('stream_results')
+            plan = self.explain_statement(cursor.connection, statement, parameters, analyze=not streamed)
+
+        parameters_text = repr(redact(parameters))
+        if len(parameters_text) > MAXIMUM_PARAMETERS_LENGTH:
+            parameters_text = parameters_text[:MAXIMUM_PARAMETERS_LENGTH] + '...'
+        message = f'Slow query on {route} took {elapsed * 1000:.1f} ms: {statement}\nParameters: {parameters_text}'
+        if plan:
+            message += '\nPlan:\n' + plan
+        if dropped:
+            message += f'\n{dropped} slow queries before this one were not logged'
+        logger.warning(message)
+
+    @staticmethod
+    def explain_statement(connection, statement, parameters, analyze=True):
+        """Returns the plan of a statement, run on the DBAPI connection that ran it, in its transaction.
+
+        EXPLAIN ANALYZE runs the statement again, so it is only used for SELECTs, the writes are
+        only planned. A WITH statement can hold a DELETE or an INSERT, such as the moves of
+        app.archive, so it is only planned too. The EXPLAIN runs in a savepoint that is always
+        rolled back, so it neither aborts the transaction nor leaves any change in it.
+        """
+        analyze = analyze and statement.lstrip().upper().startswith('SELECT')
+        options = '(ANALYZE, BUFFERS) ' if analyze else ''
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(f'EXPLAIN {options}{statement}', parameters)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            except Exception as e:
+                plan = f'The plan could not be captured: {e}'
+            cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        except Exception as e:
+            # e.g. a connection in autocommit mode, outside of a transaction
+            return f'The plan could not be captured: {e}'
+        finally:
+            cursor.close()
+
+
+def init_slow_query_log(app):
+    """Attaches a slow query log to the engine of the app if SLOW_QUERY_THRESHOLD_MS is set."""
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    if threshold is None:
+        app.extensions['slow_query_log'] = None
+        return
+    slow_query_log = SlowQueryLog(
+        threshold / 1000,
+        rate=app.config['SLOW_QUERY_LOG_RATE'],
+        burst=app.config['SLOW_QUERY_LOG_BURST'],
+        explain=app.config['SLOW_QUERY_EXPLAIN'],
+        explain_ttl=app.config['SLOW_QUERY_EXPLAIN_TTL'])
+    # the primary and the replicas
+    for bind in [None] + sorted(app.config.get('SQLALCHEMY_BINDS') or {}):
+        slow_query_log.attach(db.get_engine(app, bind=bind))
+    app.extensions['slow_query_log'] = slow_query_log
@@ -0,0 +1,96 @@
+import datetime
+import math
+
+# the length of the String column of the names of the expenses
+MAXIMUM_NAME_LENGTH = 255
+
+
+def parse_date(date_str, date_format='%d-%m-%Y', display_format='DD-MM-YYYY'):
+    """Parses a date sent by the client.
+    Raises ValueError with a message for the client if it does not match the format.
+    """
+    try:
+        return datetime.datetime.strptime(date_str, date_format).date()
+    except ValueError:
+        raise ValueError(f'The date {date_str} does not match the format {display_format}') from None
+
+
+def parse_amount(amount):
+    """Parses an amount sent by the client.
+    Raises ValueError with a message for the client if it is not a finite number: the daily totals
+    keep running sums, which a NaN or an infinity would never come back from.
+    """
+    try:
+        amount_num = float(amount)
+    except ValueError:
+        raise ValueError('the amount entered is not a valid number') from None
+    if not math.isfinite(amount_num):
+        raise ValueError('the amount entered is not a valid number')
+    return amount_num
+
+
+def parse_name(name):
+    """Validates the name of an expense sent by the client.
+    Raises ValueError with a message for the client if it is empty or too long for its column.
+    """
+    if not name:
+        raise ValueError('PLease enter a valid name')
+    if len(name) > MAXIMUM_NAME_LENGTH:
+        raise ValueError(f'The name can be at most {MAXIMUM_NAME_LENGTH} characters long')
+    return name
+
+
+def parse_expense(data):
+    """Validates the name, amount and date_of_expense of a new expense.
+    Returns the column values of the expense, or raises ValueError with a message for the client.
+    """
+    if not hasattr(data, 'get'):
+        raise ValueError('Each expense should be a JSON object with a name, amount and date_of_expense')
+
+    name = str(data.get('name', ''))
+    amount = str(data.get('amount', '')).strip()
+    amount_num = parse_amount(amount)
+    date = parse_date(str(data.get('date_of_expense', '')).strip())
+    parse_name(name)
+
+    return {
+        'name': name,
+        'amount_spent': amount_num,
+        'date_of_expense': date,
+    }
+
+
+def parse_expense_changes(data):
+    """Validates the name, amount and date_of_expense to set on expenses, any of them.
+    Returns the column values to set, or raises ValueError with a message for the client.
+    """
+    if not hasattr(data, 'get'):
+        raise ValueError('The values should be a JSON object with a name, amount or date_of_expense')
+
+    values = {}
+    if 'name' in data:
+        values['name'] = parse_name(str(data.get('name') or ''))
+    if 'amount' in data:
+        values['amount_spent'] = parse_amount(str(data.get('amount')).strip())
+    if 'date_of_expense' in data:
+        values['date_of_expense'] = parse_date(str(data.get('date_of_expense')).strip())
+    if not values:
+        raise ValueError('Please enter a name, amount or date_of_expense to set')
+    return values
+
+
+def parse_fields(value, fields):
+    """Parses the comma separated fields the client asks for, out of fields.
+    Returns them in the order they were asked for, or raises ValueError with a message for the client.
+    """
+    requested = []
+    for field in value.split(','):
+        field = field.strip()
+        if field and field not in requested:
+            requested.append(field)
+    if not requested:
+        raise ValueError('Please enter the fields to return, separated by commas')
+    unknown = [field for field in requested if field not in fields]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}. The fields are {", ".join(fields)}')
+    return requested
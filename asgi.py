@@ -0,0 +1,7 @@
+import os
+
+from app.asgi import create_asgi_app
+
+config_name = os.getenv('APP_SETTINGS') # config_name = "development"
+
+app = create_asgi_app(config_name)
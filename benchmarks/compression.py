@@ -0,0 +1,68 @@
+"""Compares the bytes on the wire and the CPU time per request of the responses at each compression level.
+
+    python -m benchmarks.compression [expenses] [requests]
+
+The requests are sent to the app with Accept-Encoding: gzip, on the test database filled with
+synthetic expenses; level 0 is the uncompressed baseline. The CPU time is the time of the
+process per request, so it counts the query, the encoding and the compression.
+"""
+import datetime
+import random
+import sys
+import time
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db  # noqa: E402
+from app.compression import ResponseCompressor  # noqa: E402
+from app.models import User, ExpenseTracker  # noqa: E402
+from benchmarks.load import synthetic_expenses  # noqa: E402
+
+LEVELS = [0, 1, 3, 6, 9]
+URLS = ['/expenses/?limit=100', '/expenses/?limit=20', '/expenses/?limit=100&cursor=',
+        '/monthly_report?month=01-2021', '/yearly_report?year=2021', '/expenses/export?format=ndjson']
+
+
+def measure(client, url, headers, requests):
+    """Returns the bytes of the response body and the CPU seconds per request."""
+    size = len(client.get(url, headers=headers).data)
+    started = time.process_time()
+    for _ in range(requests):
+        client.get(url, headers=headers).data
+    return size, (time.process_time() - started) / requests
+
+
+def main(expenses=2000, requests=100):
+    app = create_app('testing')
+    # the compact responses of production, debug mode pretty prints them
+    app.debug = False
+    with app.app_context():
+        db.session.close()
+        db.drop_all()
+        db.create_all()
+        db.session.execute(User.__table__.insert(), {'email': 'compression@bench.test', 'password': 'x'})
+        user_id = User.query.with_entities(User.id).scalar()
+        # all in 2021, the year of the reports
+        ExpenseTracker.bulk_insert(synthetic_expenses(user_id, expenses, random.Random(0),
+                                                      end_date=datetime.date(2021, 12, 31), days=365))
+        db.session.commit()
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + User.generate_token(user_id).decode(), 'Accept-Encoding': 'gzip'}
+    with app.app_context():
+        print(f'{"":40}' + ''.join(f'{f"level {level}":>22}' for level in LEVELS))
+        for url in URLS:
+            results = []
+            for level in LEVELS:
+                app.extensions['compressor'] = ResponseCompressor(
+                    level, app.config['COMPRESS_MIN_SIZE'], app.config['COMPRESS_MIMETYPES'])
+                results.append(measure(client, url, headers, requests))
+            print(f'{url:40}' + ''.join(f'{size:>9} B {cpu * 1000:7.2f} ms' for size, cpu in results))
+
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
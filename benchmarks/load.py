@@ -0,0 +1,294 @@
+"""Seeds synthetic users and expenses, then drives a mixed workload against the app and reports
+the latency percentiles and throughput of every endpoint as JSON, to compare runs between commits.
+
+    python -m benchmarks.load [--users 20] [--expenses 500] [--requests 2000] [--concurrency 8]
+    python manage.py bench ...
+
+The app is served by a threaded server in this process, as it is by the gthread gunicorn
+workers, unless --url points at a running server sharing the database and the SECRET.
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from sqlalchemy import func
+from werkzeug.serving import make_server
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db  # noqa: E402
+from app.models import User, ExpenseTracker  # noqa: E402
+
+BENCH_PASSWORD = 'bench-password'
+
+# the names of the synthetic expenses with their relative frequency and typical amount
+EXPENSE_KINDS = [
+    ('groceries', 30, 35.0), ('coffee', 25, 4.5), ('lunch', 20, 12.0), ('fuel', 10, 55.0),
+    ('taxi', 8, 18.0), ('restaurant', 8, 45.0), ('books', 4, 20.0), ('electricity bill', 2, 90.0),
+    ('internet bill', 2, 40.0), ('rent', 1, 900.0), ('flight tickets', 1, 350.0), ('gym membership', 1, 30.0),
+]
+
+# the operations of the workload with their weights, lists and single reads dominate
+WORKLOAD = [
+    ('list', 30), ('filter', 15), ('search', 5), ('get', 20), ('put', 10),
+    ('monthly_report', 10), ('yearly_report', 8), ('login', 2),
+]
+
+
+def synthetic_expenses(belongs_to, number, rng, end_date=None, days=730):
+    """Returns number rows of expenses spread over the days before end_date, more of them on the
+    weekends and recently, with log-normal amounts around the typical amount of their kind.
+    """
+    end_date = end_date or datetime.date.today()
+    names = [kind[0] for kind in EXPENSE_KINDS]
+    weights = [kind[1] for kind in EXPENSE_KINDS]
+    typical = {kind[0]: kind[2] for kind in EXPENSE_KINDS}
+    rows = []
+    while len(rows) < number:
+        # triangular, so the recent days have more expenses, like an account in active use
+        date = end_date - datetime.timedelta(days=int(rng.triangular(0, days, 0)))
+        if date.weekday() < 5 and rng.random() < 0.3:
+            continue
+        name = rng.choices(names, weights)[0]
+        amount = round(typical[name] * rng.lognormvariate(0, 0.5), 2)
+        rows.append({'name': name, 'amount_spent': max(amount, 0.01), 'date_of_expense': date,
+                     'belongs_to': belongs_to})
+    return rows
+
+
+def seed(app, users, expenses_per_user, rng, prefix='bench'):
+    """Creates the users that do not exist yet with expenses_per_user expenses each.
+    Returns a {user id: [expense ids]} dict of the benchmark users.
+    """
+    with app.app_context():
+        db.create_all()
+        emails = [f'{prefix}{number}@bench.test' for number in range(users)]
+        existing = {email for email, in User.query.with_entities(User.email).filter(User.email.in_(emails))}
+        missing = [email for email in emails if email not in existing]
+        if missing:
+            # every user gets the same password, hashed once instead of once per user
+            password = app.extensions['password_hasher'].hash(BENCH_PASSWORD)
+            db.session.execute(User.__table__.insert(), [{'email': email, 'password': password} for email in missing])
+            new_users = User.query.with_entities(User.id).filter(User.email.in_(missing)).all()
+            for user_id, in new_users:
+                ExpenseTracker.bulk_insert(synthetic_expenses(user_id, expenses_per_user, rng))
+            db.session.commit()
+
+        expense_ids = {user_id: [] for user_id, in
+                       User.query.with_entities(User.id).filter(User.email.in_(emails))}
+        rows = ExpenseTracker.query.with_entities(ExpenseTracker.belongs_to, ExpenseTracker.id) \
+            .filter(ExpenseTracker.belongs_to.in_(list(expense_ids)))
+        for belongs_to, expense_id in rows:
+            expense_ids[belongs_to].append(expense_id)
+        db.session.remove()
+        return expense_ids
+
+
+def percentile(samples, p):
+    """The nearest-rank percentile of samples, sorted."""
+    return samples[max(0, math.ceil(len(samples) * p / 100) - 1)]
+
+
+def summarize(timings, statuses, duration):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'throughput': round(len(timings) / duration, 2),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+    }
+
+
+class Workload(object):
+    """The requests of the mixed workload, picked at random for the benchmark users."""
+
+    def __init__(self, base, expense_ids, tokens, emails):
+        self.base = base
+        self.expense_ids = expense_ids
+        self.tokens = tokens
+        self.emails = emails
+        self.user_ids = [user_id for user_id in expense_ids if expense_ids[user_id]]
+        self.operations = [operation for operation, _ in WORKLOAD]
+        self.weights = [weight for _, weight in WORKLOAD]
+
+    def request(self, rng):
+        """Picks an operation and returns it with its (method, path, body, headers)."""
+        operation = rng.choices(self.operations, self.weights)[0]
+        user_id = rng.choice(self.user_ids)
+        headers = {'Authorization': 'Bearer ' + self.tokens[user_id]}
+        day = datetime.date.today() - datetime.timedelta(days=rng.randrange(700))
+        body = None
+        if operation == 'list':
+            # one of the first pages that exist, the pages past the last one are a 404
+            pages = math.ceil(len(self.expense_ids[user_id]) / 20)
+            path = f'/expenses/?limit=20&page={rng.randint(1, min(pages, 5))}'
+        elif operation == 'filter':
+            end = day + datetime.timedelta(days=30)
+            path = f'/expenses/?start_date={day:%d-%m-%Y}&end_date={end:%d-%m-%Y}&limit=20'
+        elif operation == 'search':
+            path = '/expenses/?q=' + urllib.parse.quote(rng.choice(EXPENSE_KINDS)[0].split()[0])
+        elif operation == 'get':
+            path = f'/expenses/{rng.choice(self.expense_ids[user_id])}'
+        elif operation == 'put':
+            path = f'/expenses/{rng.choice(self.expense_ids[user_id])}'
+            name, _, amount = rng.choice(EXPENSE_KINDS)
+            body = {'name': name, 'amount': round(amount * rng.lognormvariate(0, 0.5), 2),
+                    'date_of_expense': f'{day:%d-%m-%Y}'}
+        elif operation == 'monthly_report':
+            path = f'/monthly_report?month={day:%m-%Y}'
+        elif operation == 'yearly_report':
+            path = f'/yearly_report?year={day:%Y}'
+        else:
+            path = '/auth/login'
+            body = {'email': self.emails[user_id], 'password': BENCH_PASSWORD}
+            headers = {}
+        method = 'GET' if body is None else ('PUT' if operation == 'put' else 'POST')
+        return operation, (method, path, body, headers)
+
+    def send(self, method, path, body, headers):
+        data = urllib.parse.urlencode(body).encode() if body is not None else None
+        request = urllib.request.Request(self.base + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def run_workload(workload, requests, concurrency, seed=0, warmup=50):
+    """Sends requests requests from concurrency threads. Returns the per operation timings,
+    statuses and the wall clock duration of the run.
+    """
+    warmup_rng = random.Random(seed - 1)
+    for _ in range(warmup):
+        workload.send(*workload.request(warmup_rng)[1])
+
+    timings, statuses = {}, {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            operation, request = workload.request(rng)
+            started = time.perf_counter()
+            status = workload.send(*request)
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.setdefault(operation, []).append(elapsed)
+                statuses.setdefault(operation, []).append(status)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, statuses, time.perf_counter() - started
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(app, users=20, expenses=500, requests=2000, concurrency=8, seed_value=0, warmup=50, url=None):
+    """Seeds the data, runs the workload and returns the report."""
+    started = time.perf_counter()
+    expense_ids = seed(app, users, expenses, random.Random(seed_value))
+    seed_seconds = time.perf_counter() - started
+
+    with app.app_context():
+        # the tokens are made here, logging every user in would only benchmark bcrypt
+        tokens = {user_id: User.generate_token(user_id).decode() for user_id in expense_ids}
+        emails = dict(User.query.with_entities(User.id, User.email).filter(User.id.in_(list(expense_ids))))
+        expense_count = db.session.query(func.count(ExpenseTracker.id)) \
+            .filter(ExpenseTracker.belongs_to.in_(list(expense_ids))).scalar()
+        db.session.remove()
+
+    server = None
+    if url is None:
+        # keep the request log out of the results
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_port}'
+
+    workload = Workload(url.rstrip('/'), expense_ids, tokens, emails)
+    try:
+        timings, statuses, duration = run_workload(workload, requests, concurrency, seed_value, warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    all_timings = [timing for operation in timings for timing in timings[operation]]
+    all_statuses = [status for operation in statuses for status in statuses[operation]]
+    return {
+        'commit': git_commit(),
+        'date': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'database': db.get_engine(app).dialect.name,
+        'parameters': {'users': users, 'expenses_per_user': expenses, 'requests': requests,
+                       'concurrency': concurrency, 'seed': seed_value, 'warmup': warmup},
+        'dataset': {'users': len(expense_ids), 'expenses': expense_count, 'seed_seconds': round(seed_seconds, 3)},
+        'duration_seconds': round(duration, 3),
+        'total': summarize(all_timings, all_statuses, duration),
+        'endpoints': {operation: summarize(timings[operation], statuses[operation], duration)
+                      for operation in sorted(timings)},
+    }
+
+
+def parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=20, help='Benchmark users to seed')
+    parser.add_argument('--expenses', type=int, default=500, help='Expenses seeded per user')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests to send')
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads sending requests')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data and of the workload')
+    parser.add_argument('--warmup', type=int, default=50, help='Requests sent before measuring')
+    parser.add_argument('--url', help='A running server to benchmark instead of an in-process one')
+    parser.add_argument('--output', help='File to write the JSON report to, instead of the standard output')
+    return parser
+
+
+def write_report(report, output=None):
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+    report = bench(app, args.users, args.expenses, args.requests, args.concurrency, args.seed, args.warmup, args.url)
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
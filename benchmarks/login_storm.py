@@ -0,0 +1,107 @@
+"""Measures the latency of GET /expenses/ while a storm of logins hashes passwords.
+
+    python -m benchmarks.login_storm [logins] [login threads]
+
+The app is served by a threaded server, as it is by the gthread gunicorn workers, with
+the production bcrypt cost. Logins over the hasher's pool and queue are answered with 503.
+"""
+import json
+import logging
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from werkzeug.serving import make_server
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db  # noqa: E402
+from instance.config import ProductionConfig  # noqa: E402
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def measure_reads(url, headers, number=200):
+    timings = []
+    for _ in range(number):
+        started = time.perf_counter()
+        urllib.request.urlopen(urllib.request.Request(url, headers=headers)).read()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main(logins=200, login_threads=16):
+    app = create_app('testing')
+    app.extensions['password_hasher'].log_rounds = ProductionConfig.BCRYPT_LOG_ROUNDS
+    with app.app_context():
+        db.session.close()
+        db.drop_all()
+        db.create_all()
+
+    client = app.test_client()
+    user = {'email': 'storm@test.com', 'password': 'test1234'}
+    client.post('/auth/register', data=user)
+    token = json.loads(client.post('/auth/login', data=user).data.decode())['access_token']
+    headers = {'Authorization': 'Bearer ' + token}
+
+    # keep the request log out of the results
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # the requests go through the real server, so they compete for the same process
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    def login():
+        body = urllib.parse.urlencode(user).encode()
+        try:
+            urllib.request.urlopen(base + '/auth/login', data=body).read()
+            return 200
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    baseline = measure_reads(base + '/expenses/', headers)
+
+    statuses = []
+    remaining = [logins]
+    lock = threading.Lock()
+
+    def storm():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            status = login()
+            with lock:
+                statuses.append(status)
+
+    threads = [threading.Thread(target=storm) for _ in range(login_threads)]
+    for thread in threads:
+        thread.start()
+    during = measure_reads(base + '/expenses/', headers)
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    for label, timings in [('baseline', baseline), ('login storm', during)]:
+        print(f'{label:12} p50 {percentile(timings, 50) * 1000:7.2f} ms  '
+              f'p95 {percentile(timings, 95) * 1000:7.2f} ms  '
+              f'p99 {percentile(timings, 99) * 1000:7.2f} ms  '
+              f'mean {statistics.mean(timings) * 1000:7.2f} ms')
+    print(f'logins: {statuses.count(200)} succeeded, {statuses.count(503)} shed with 503')
+
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
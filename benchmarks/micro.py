@@ -0,0 +1,154 @@
+"""Micro-benchmarks of the primitives every request goes through, against an in-memory database.
+
+    python -m benchmarks.micro [--save] [--baseline benchmarks/micro_baseline.json] [--threshold 0.2]
+
+Each benchmark reports the best per call time of several repeats. The results are compared with
+the baseline file, if there is one, and the benchmarks slower than the baseline by more than the
+threshold are flagged, with an exit status of 1. --save records the results as the new baseline.
+The timings depend on the machine, so a baseline is only comparable on the machine that saved it.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import timeit
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db  # noqa: E402
+from app.encoders import jsonify  # noqa: E402
+from app import reads  # noqa: E402
+from app.models import User, ExpenseTracker, token_cache  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'micro_baseline.json')
+
+# the size of the pages serialized, the maximum page size is 100
+PAGE_SIZE = 100
+
+
+def measure(function, repeat=5):
+    """Returns the best time per call of function in seconds, out of repeat runs
+    of as many calls as take at least 0.2 seconds.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def setup_app(bcrypt_log_rounds):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    # the compact responses of production, debug mode pretty prints them
+    app.debug = False
+    app.extensions['password_hasher'].log_rounds = bcrypt_log_rounds
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), {'email': 'micro@bench.test', 'password': 'x'})
+        ExpenseTracker.bulk_insert([{
+            'name': f'expense {number}', 'amount_spent': number * 1.25, 'belongs_to': 1,
+            'date_of_expense': datetime.date(2021, 1, 1) + datetime.timedelta(days=number),
+        } for number in range(PAGE_SIZE)])
+        db.session.commit()
+    return app
+
+
+def benchmarks(app, bcrypt_log_rounds):
+    """Returns the {name: function} benchmarks, to be run in an app context."""
+    hasher = app.extensions['password_hasher']
+    password_hash = hasher.hash('test1234')
+    token = User.generate_token(1).decode()
+    rows = ExpenseTracker.query.with_entities(*ExpenseTracker.projection(reads.ALL_FIELDS)) \
+        .filter_by(belongs_to=1).order_by(ExpenseTracker.id).all()
+    page = reads.items(rows)
+
+    def decode_token_uncached():
+        token_cache.clear()
+        User.decode_token(token)
+
+    return {
+        'decode_token': decode_token_uncached,
+        'decode_token_cached': lambda: User.decode_token(token),
+        'generate_token': lambda: User.generate_token(1),
+        f'bcrypt_hash_cost_{bcrypt_log_rounds}': lambda: hasher.hash('test1234'),
+        f'bcrypt_verify_cost_{bcrypt_log_rounds}': lambda: hasher.verify(password_hash, 'test1234'),
+        'strptime_date': lambda: datetime.datetime.strptime('25-12-2021', '%d-%m-%Y'),
+        'serialize_page_100': lambda: reads.items(rows),
+        'jsonify_page_100': lambda: jsonify({'items': page, 'total_items': PAGE_SIZE, 'total_pages': 1,
+                                             'prev_page': None, 'next_page': None}).get_data(),
+    }
+
+
+def run(bcrypt_log_rounds=Config.BCRYPT_LOG_ROUNDS, only=None):
+    """Runs the benchmarks and returns their {name: seconds per call}."""
+    app = setup_app(bcrypt_log_rounds)
+    results = {}
+    with app.test_request_context('/expenses/'):
+        for name, function in benchmarks(app, bcrypt_log_rounds).items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            # bcrypt is slow on purpose, a few calls are plenty
+            results[name] = measure(function, repeat=3 if name.startswith('bcrypt') else 5)
+        db.session.remove()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns the (name, baseline seconds, seconds, ratio) of the benchmarks slower than
+    their baseline by more than threshold, as a fraction of the baseline.
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        before = baseline.get(name)
+        if before and seconds > before * (1 + threshold):
+            regressions.append((name, before, seconds, seconds / before))
+    return regressions
+
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:9.3f} ms'
+    return f'{seconds * 1e6:9.3f} us'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='The baseline file to compare with')
+    parser.add_argument('--save', action='store_true', help='Record the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='The slowdown over the baseline flagged as a regression, 0.2 for 20%%')
+    parser.add_argument('--bcrypt-rounds', type=int, default=Config.BCRYPT_LOG_ROUNDS,
+                        help='The bcrypt cost, the configured one by default')
+    parser.add_argument('only', nargs='*', help='Only run the benchmarks with these words in their name')
+    args = parser.parse_args(argv)
+
+    results = run(args.bcrypt_rounds, args.only)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    for name, seconds in results.items():
+        line = f'{name:28} {format_time(seconds)}'
+        if name in baseline:
+            line += f'  baseline {format_time(baseline[name])}  {(seconds / baseline[name] - 1) * 100:+7.1f}%'
+        print(line)
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, before, seconds, ratio in regressions:
+        print(f'REGRESSION {name}: {format_time(before).strip()} -> {format_time(seconds).strip()} '
+              f'({ratio:.2f}x, over the {args.threshold:.0%} threshold)')
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'date': datetime.date.today().isoformat(), 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Saved the baseline to {args.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
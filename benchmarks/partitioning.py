@@ -0,0 +1,102 @@
+"""Times the queries on Expense_Tracker before and after it is partitioned by month, and each step
+of the conversion.
+
+    python -m benchmarks.partitioning [users] [expenses per user]
+
+Runs on the test database, which must be PostgreSQL, filled with synthetic expenses over five years.
+The queries are a month of expenses of a user, the list filter, an expense by id, and the total of
+every user over a month, which no index of a user covers; each is the median of REPEAT runs.
+"""
+import datetime
+import random
+import statistics
+import sys
+import time
+from sqlalchemy import text
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db, partitioning  # noqa: E402
+from app.models import User, ExpenseTracker  # noqa: E402
+from benchmarks.load import synthetic_expenses  # noqa: E402
+
+REPEAT = 50
+END_DATE = datetime.date(2021, 12, 31)
+QUERIES = {
+    'month of a user': ('SELECT id, name, amount_spent, date_of_expense FROM "Expense_Tracker" '
+                        "WHERE belongs_to = :user AND date_of_expense BETWEEN '2021-06-01' AND '2021-06-30' "
+                        'ORDER BY date_of_expense, id'),
+    'expense by id': 'SELECT * FROM "Expense_Tracker" WHERE id = :id',
+    'month of every user': ('SELECT belongs_to, sum(amount_spent) FROM "Expense_Tracker" '
+                            "WHERE date_of_expense >= '2021-06-01' AND date_of_expense < '2021-07-01' "
+                            'GROUP BY belongs_to'),
+}
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def measure(connection, query, parameters):
+    """Returns the median seconds of the query."""
+    times = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        connection.execute(text(query), **parameters).fetchall()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def measure_all(parameters):
+    with db.engine.connect() as connection:
+        connection.execute('ANALYZE "Expense_Tracker"')
+        return {name: measure(connection, query, parameters) for name, query in QUERIES.items()}
+
+
+def main(users=50, expenses=2000):
+    app = create_app('testing')
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit('partitioning needs PostgreSQL')
+        db.session.close()
+        with db.engine.begin() as connection:
+            partitioning.discard(connection)
+            connection.execute(f'DROP TABLE IF EXISTS "{partitioning.TABLE}" CASCADE')
+        db.drop_all()
+        db.create_all()
+        rng = random.Random(0)
+        for number in range(users):
+            user_id = db.session.execute(User.__table__.insert().returning(User.id), {
+                'email': f'partitioning{number}@bench.test', 'password': 'x'}).scalar()
+            ExpenseTracker.bulk_insert(synthetic_expenses(user_id, expenses, rng, end_date=END_DATE, days=5 * 365))
+        db.session.commit()
+        parameters = {'user': user_id, 'id': rng.randint(1, users * expenses)}
+        db.session.remove()
+
+        before = measure_all(parameters)
+        with db.engine.begin() as connection:
+            _, prepared = timed(partitioning.prepare, connection, today=END_DATE)
+        with db.engine.connect() as connection:
+            copied, backfilled = timed(partitioning.backfill, connection)
+        with db.engine.begin() as connection:
+            _, swapped = timed(partitioning.swap, connection)
+        after = measure_all(parameters)
+
+        print(f'{users * expenses} expenses of {users} users')
+        print(f'prepare {prepared:.2f} s, backfill of {copied} rows {backfilled:.2f} s, '
+              f'swap {swapped * 1000:.1f} ms (Expense_Tracker locked)')
+        print(f'{"":24}{"plain":>12}{"partitioned":>14}')
+        for name in QUERIES:
+            print(f'{name:24}{before[name] * 1000:9.3f} ms{after[name] * 1000:11.3f} ms')
+
+        with db.engine.begin() as connection:
+            partitioning.discard(connection)
+            connection.execute(f'DROP TABLE IF EXISTS "{partitioning.TABLE}" CASCADE')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,86 @@
+"""Compares the rows per second of full expense pages with pages of only some fields.
+
+    python -m benchmarks.projection [expenses] [pages]
+
+Pages of 100 expenses are read from the test database, once as rows of every column and once as
+rows of the columns of ?fields=id,name,amount, first the query and serializing alone, then through
+GET /expenses/.
+"""
+import json
+import random
+import sys
+import time
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db, reads  # noqa: E402
+from app.models import User, ExpenseTracker  # noqa: E402
+from benchmarks.load import synthetic_expenses  # noqa: E402
+
+PAGE_SIZE = 100
+FIELDS = ['id', 'name', 'amount']
+
+
+def rows_per_second(function, pages):
+    started = time.perf_counter()
+    for page in range(pages):
+        function(page)
+    return pages * PAGE_SIZE / (time.perf_counter() - started)
+
+
+def main(expenses=5000, pages=200):
+    app = create_app('testing')
+    # the compact responses of production, debug mode pretty prints them
+    app.debug = False
+    with app.app_context():
+        db.session.close()
+        db.drop_all()
+        db.create_all()
+        db.session.execute(User.__table__.insert(), {'email': 'projection@bench.test', 'password': 'x'})
+        user_id = User.query.with_entities(User.id).scalar()
+        ExpenseTracker.bulk_insert(synthetic_expenses(user_id, expenses, random.Random(0)))
+        db.session.commit()
+
+    page_count = expenses // PAGE_SIZE
+
+    def query(page):
+        return ExpenseTracker.query.filter_by(belongs_to=user_id) \
+            .order_by(ExpenseTracker.date_of_expense, ExpenseTracker.id) \
+            .limit(PAGE_SIZE).offset(page % page_count * PAGE_SIZE)
+
+    def full(page):
+        reads.items(query(page).with_entities(*ExpenseTracker.projection(reads.ALL_FIELDS)).all())
+        db.session.remove()
+
+    def projected(page):
+        reads.items(query(page).with_entities(*ExpenseTracker.projection(FIELDS)).all(), FIELDS)
+        db.session.remove()
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + User.generate_token(user_id).decode()}
+
+    def request(url):
+        def get(page):
+            response = client.get(url.format(page=page % page_count + 1), headers=headers)
+            assert len(json.loads(response.data)['items']) == PAGE_SIZE
+        return get
+
+    with app.app_context():
+        for label, function in [
+            ('query, full', full),
+            (f'query, fields={",".join(FIELDS)}', projected),
+            ('GET /expenses/, full', request(f'/expenses/?limit={PAGE_SIZE}&page={{page}}')),
+            (f'GET /expenses/, fields={",".join(FIELDS)}',
+             request(f'/expenses/?limit={PAGE_SIZE}&page={{page}}&fields={",".join(FIELDS)}')),
+        ]:
+            # warm up the connections and the caches
+            rows_per_second(function, 5)
+            print(f'{label:40} {rows_per_second(function, pages):10.0f} rows/s')
+
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,90 @@
+"""Measures what the report cache saves on the monthly and yearly reports: a hit only reads the data
+version the ETag is made of, without it the report reads the daily totals as well.
+
+    python -m benchmarks.report_cache [--expenses 2000] [--requests 500]
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+from sqlalchemy import event
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app, db  # noqa: E402
+from app.cache import ReportCache, InProcessBackend  # noqa: E402
+from app.models import User  # noqa: E402
+from benchmarks.load import seed  # noqa: E402
+
+
+def time_requests(app, url, headers, requests):
+    """Sends requests GETs of url after a first one. Returns the median time in seconds and the
+    statements run by one of them.
+    """
+    client = app.test_client()
+    client.get(url, headers=headers)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    timings = []
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(requests):
+            del statements[:]
+            started = time.perf_counter()
+            response = client.get(url, headers=headers)
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.data
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return statistics.median(timings), len(statements)
+
+
+def measure(app, expenses=2000, requests=500):
+    """Returns the {report: {'hit': (seconds, statements), 'rollup': (seconds, statements)}} of the
+    reports of the current month and year of a user with expenses expenses.
+    """
+    user_id = next(iter(seed(app, 1, expenses, random.Random(0), prefix='report-cache')))
+    with app.app_context():
+        headers = dict(Authorization='Bearer ' + User.generate_token(user_id).decode())
+    today = datetime.date.today()
+    urls = {'monthly_report': f'/monthly_report?month={today:%m-%Y}', 'yearly_report': f'/yearly_report?year={today:%Y}'}
+
+    results = {}
+    cache = app.extensions['report_cache']
+    try:
+        for report, url in urls.items():
+            app.extensions['report_cache'] = ReportCache(InProcessBackend(maxsize=100, ttl=3600))
+            hit = time_requests(app, url, headers, requests)
+            app.extensions['report_cache'] = None
+            rollup = time_requests(app, url, headers, requests)
+            results[report] = {'hit': hit, 'rollup': rollup}
+    finally:
+        app.extensions['report_cache'] = cache
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--expenses', type=int, default=2000, help='Expenses seeded for the benchmark user')
+    parser.add_argument('--requests', type=int, default=500, help='Requests timed per report')
+    args = parser.parse_args(argv)
+
+    app = create_app(os.getenv('APP_SETTINGS', 'testing'))
+    for report, timings in measure(app, args.expenses, args.requests).items():
+        (hit, hit_statements), (rollup, rollup_statements) = timings['hit'], timings['rollup']
+        print(f'{report} cache hit:   {hit * 1e3:8.3f} ms, {hit_statements} statement(s)')
+        print(f'{report} rollup read: {rollup * 1e3:8.3f} ms, {rollup_statements} statement(s)')
+        print(f'{report} saved:       {(rollup - hit) * 1e3:8.3f} ms per request ({rollup / hit:.2f}x faster)')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,35 @@
+"""Measures what the token cache saves on every authenticated request.
+
+    python -m benchmarks.token_cache
+"""
+import timeit
+from instance.config import Config
+
+Config.SECRET = Config.SECRET or 'benchmark-secret'
+
+from app import create_app  # noqa: E402
+from app.models import User, token_cache  # noqa: E402
+
+
+def main(number=20000):
+    create_app('testing')
+    token = User.generate_token(1).decode()
+
+    def uncached():
+        token_cache.clear()
+        User.decode_token(token)
+
+    def cached():
+        User.decode_token(token)
+
+    User.decode_token(token)
+    uncached_time = min(timeit.repeat(uncached, number=number, repeat=3)) / number
+    cached_time = min(timeit.repeat(cached, number=number, repeat=3)) / number
+    print(f'decode_token without cache: {uncached_time * 1e6:8.2f} us')
+    print(f'decode_token with cache:    {cached_time * 1e6:8.2f} us')
+    print(f'saved per request:          {(uncached_time - cached_time) * 1e6:8.2f} us '
+          f'({uncached_time / cached_time:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
+import datetime
 import os
 import unittest
 from flask_script import Manager  # class for handling a set of commands
 from flask_migrate import Migrate, MigrateCommand
 from app import db, create_app
-from app import models
+from app import models, partitioning
+from app.archive import archive_expenses
 import coverage
 
 app = create_app(config_name=os.getenv('APP_SETTINGS'))
@@ -23,6 +25,65 @@ def test():
     return 1
 
 
+@manager.option('--verify-only', dest='verify_only', action='store_true',
+                help='Only compare the daily totals with the expenses, without rebuilding them')
+def rollups(verify_only=False):
+    """Rebuilds the daily totals from the expenses and verifies them."""
+    if not verify_only:
+        models.DailyTotal.rebuild()
+        db.session.commit()
+        print('Rebuilt the daily totals.')
+    mismatches = models.DailyTotal.verify()
+    for belongs_to, day, expected, found in mismatches:
+        print(f'User {belongs_to} on {day}: expected (total, count) {expected}, found {found}')
+    if mismatches:
+        print(f'{len(mismatches)} daily totals do not match the expenses.')
+        return 1
+    print('The daily totals match the expenses.')
+    return 0
+
+
+@manager.option('--backfill', action='store_true',
+                help='Copy the expenses to the partitioned table prepared by the migration instead')
+def partitions(backfill=False):
+    """Creates the partitions of Expense_Tracker for the coming months, to run daily."""
+    with db.engine.connect() as connection:
+        if backfill:
+            copied = partitioning.backfill(connection, app.config['PARTITION_BACKFILL_BATCH_SIZE'],
+                                           progress=lambda total: print(f'{total} expenses copied'))
+            print(f'Copied {copied} expenses, upgrade the database to swap the tables.')
+            return 0
+        for name in partitioning.ensure_partitions(connection, app.config['PARTITION_MONTHS_AHEAD']):
+            print(f'Created the partition {name}.')
+    return 0
+
+
+@manager.option('--older-than', dest='older_than', type=int, required=True,
+                help='Archive the expenses dated more than this many days ago')
+def archive(older_than):
+    """Moves the old expenses to the archive, the reads still see them."""
+    before = datetime.date.today() - datetime.timedelta(days=older_than)
+    moved = archive_expenses(before, app.config['ARCHIVE_BATCH_SIZE'],
+                             progress=lambda total: print(f'{total} expenses archived'))
+    print(f'Archived {moved} expenses dated before {before:%d-%m-%Y}.')
+    return 0
+
+
+@manager.option('--users', type=int, default=20, help='Benchmark users to seed')
+@manager.option('--expenses', type=int, default=500, help='Expenses seeded per user')
+@manager.option('--requests', type=int, default=2000, help='Requests to send')
+@manager.option('--concurrency', type=int, default=8, help='Threads sending requests')
+@manager.option('--seed', dest='seed_value', type=int, default=0, help='Seed of the data and of the workload')
+@manager.option('--warmup', type=int, default=50, help='Requests sent before measuring')
+@manager.option('--url', help='A running server to benchmark instead of an in-process one')
+@manager.option('--output', help='File to write the JSON report to, instead of the standard output')
+def bench(users=20, expenses=500, requests=2000, concurrency=8, seed_value=0, warmup=50, url=None, output=None):
+    """Seeds synthetic data and reports the latency of a mixed workload per endpoint as JSON."""
+    from benchmarks import load
+    report = load.bench(app, users, expenses, requests, concurrency, seed_value, warmup, url)
+    load.write_report(report, output)
+
+
 @manager.command
 def cov():
     """Runs the unit tests with coverage."""
@@ -0,0 +1,27 @@
+"""swap Expense_Tracker for Expense_Tracker_partitioned
+
+Revision ID: 0b6e9d4c2a71
+Revises: f3a1c7d2b8e4
+Create Date: 2026-10-18 17:41:03.551980
+
+"""
+from alembic import op
+from flask import current_app
+from app import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e9d4c2a71'
+down_revision = 'f3a1c7d2b8e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # copies the rows the backfill has not copied yet while Expense_Tracker is locked, refusing to
+    # when there are too many of them to keep it locked
+    partitioning.swap(op.get_bind(), current_app.config['PARTITION_SWAP_MAXIMUM_COPIED'])
+
+
+def downgrade():
+    partitioning.unswap(op.get_bind())
@@ -0,0 +1,41 @@
+"""add the Expense_Tracker_archive table
+
+Revision ID: 5d8e2b7a4c19
+Revises: 0b6e9d4c2a71
+Create Date: 2026-10-18 19:41:27.513806
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e2b7a4c19'
+down_revision = '0b6e9d4c2a71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Expense_Tracker_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('amount_spent', sa.Float(), nullable=True),
+    sa.Column('date_of_expense', sa.Date(), nullable=False),
+    sa.Column('date_created', sa.DateTime(), nullable=True),
+    sa.Column('date_modified', sa.DateTime(), nullable=True),
+    sa.Column('belongs_to', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['belongs_to'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_expense_tracker_archive_belongs_to_date_of_expense', 'Expense_Tracker_archive',
+                    ['belongs_to', 'date_of_expense', 'id'], unique=False)
+
+
+def downgrade():
+    # the archived expenses go back to Expense_Tracker before the archive is dropped
+    op.execute('INSERT INTO "Expense_Tracker" (id, name, amount_spent, date_of_expense, date_created, '
+               'date_modified, belongs_to) SELECT id, name, amount_spent, date_of_expense, date_created, '
+               'date_modified, belongs_to FROM "Expense_Tracker_archive"')
+    op.drop_index('ix_expense_tracker_archive_belongs_to_date_of_expense', table_name='Expense_Tracker_archive')
+    op.drop_table('Expense_Tracker_archive')
@@ -0,0 +1,24 @@
+"""add users.data_version for the ETags
+
+Revision ID: 9b2d4f61c0a8
+Revises: e7f4a2c6d915
+Create Date: 2026-10-18 15:02:13.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4f61c0a8'
+down_revision = 'e7f4a2c6d915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('data_version', sa.BigInteger(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'data_version')
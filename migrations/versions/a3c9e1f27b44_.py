@@ -0,0 +1,24 @@
+"""index Expense_Tracker on belongs_to and date_of_expense
+
+Revision ID: a3c9e1f27b44
+Revises: 4813a5b7a7ba
+Create Date: 2026-10-18 09:12:40.118203
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9e1f27b44'
+down_revision = '4813a5b7a7ba'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_expense_tracker_belongs_to_date_of_expense', 'Expense_Tracker',
+                    ['belongs_to', 'date_of_expense', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_expense_tracker_belongs_to_date_of_expense', table_name='Expense_Tracker')
@@ -0,0 +1,44 @@
+"""index Expense_Tracker names for search
+
+Revision ID: c51d0b8e9f3a
+Revises: a3c9e1f27b44
+Create Date: 2026-10-18 10:02:17.540612
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51d0b8e9f3a'
+down_revision = 'a3c9e1f27b44'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def has_pg_trgm():
+    """pg_trgm is a contrib extension, so it is not installed on every PostgreSQL server."""
+    bind = op.get_bind()
+    return bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar() is not None
+
+
+def upgrade():
+    # full-text index used by the relevance ranked ?q= search
+    op.execute('CREATE INDEX ix_expense_tracker_name_fts ON "Expense_Tracker" '
+               "USING gin (to_tsvector('simple', coalesce(name, '')))")
+    # trigram index used by the ILIKE '%...%' substring match of ?name=
+    if not has_pg_trgm():
+        logger.warning('pg_trgm is not available, the names of Expense_Tracker get no trigram index '
+                       'and ?name= scans the expenses of the user')
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_expense_tracker_name_trgm ON "Expense_Tracker" '
+               'USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_expense_tracker_name_trgm')
+    op.execute('DROP INDEX ix_expense_tracker_name_fts')
@@ -0,0 +1,26 @@
+"""add users.archived_until, the newest date archived for each user
+
+Revision ID: e2a7c9f4b6d1
+Revises: 5d8e2b7a4c19
+Create Date: 2026-10-18 23:41:36.180245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c9f4b6d1'
+down_revision = '5d8e2b7a4c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('archived_until', sa.Date(), nullable=True))
+    op.execute('UPDATE users SET archived_until = (SELECT max(date_of_expense) FROM "Expense_Tracker_archive" '
+               'WHERE "Expense_Tracker_archive".belongs_to = users.id)')
+
+
+def downgrade():
+    op.drop_column('users', 'archived_until')
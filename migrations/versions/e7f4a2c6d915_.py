@@ -0,0 +1,36 @@
+"""add daily_totals rollup table
+
+Revision ID: e7f4a2c6d915
+Revises: c51d0b8e9f3a
+Create Date: 2026-10-18 11:24:51.306877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f4a2c6d915'
+down_revision = 'c51d0b8e9f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_totals',
+    sa.Column('belongs_to', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('total', sa.Numeric(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['belongs_to'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('belongs_to', 'day')
+    )
+    # backfill from the existing expenses
+    op.execute('INSERT INTO daily_totals (belongs_to, day, total, count) '
+               'SELECT belongs_to, date_of_expense::date, sum(amount_spent), count(id) FROM "Expense_Tracker" '
+               'WHERE belongs_to IS NOT NULL AND date_of_expense IS NOT NULL '
+               'GROUP BY belongs_to, date_of_expense::date')
+
+
+def downgrade():
+    op.drop_table('daily_totals')
@@ -0,0 +1,25 @@
+"""prepare Expense_Tracker_partitioned, partitioned by month of date_of_expense
+
+Revision ID: f3a1c7d2b8e4
+Revises: 9b2d4f61c0a8
+Create Date: 2026-10-18 17:40:26.902117
+
+"""
+from alembic import op
+from app import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a1c7d2b8e4'
+down_revision = '9b2d4f61c0a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the existing rows are copied by python manage.py partitions --backfill, or by the next revision
+    partitioning.prepare(op.get_bind())
+
+
+def downgrade():
+    partitioning.discard(op.get_bind())
@@ -0,0 +1,54 @@
+import unittest
+import contextlib
+import json
+from sqlalchemy import event
+from app import create_app, db
+
+
+class APITestCase(unittest.TestCase):
+    """The test case of the endpoints: every test starts on new tables, with a logged in user."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+        self.client = self.api_client()
+        self.headers = self.user('user@test.com')
+
+    def api_client(self):
+        """Returns the function giving the client the requests of the test are sent with."""
+        return self.app.test_client
+
+    def user(self, email, password='test1234'):
+        """Registers and logs in a user, returns the headers of their requests."""
+        self.client().post('/auth/register', data={'email': email, 'password': password})
+        result = self.client().post('/auth/login', data={'email': email, 'password': password})
+        return dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+
+    @contextlib.contextmanager
+    def statements(self):
+        """Collects the SQL of the statements the app runs in the with block."""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                yield statements
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,148 @@
+import unittest
+import datetime
+import json
+import re
+from sqlalchemy import func, select
+from app import db
+from app.archive import archive_expenses, archived_until
+from app.models import ExpenseTracker, ArchivedExpense, DailyTotal
+from base import APITestCase
+
+DAYS = ['15-03-2019', '01-11-2019', '20-06-2020', '31-12-2020', '01-01-2021', '10-02-2021', '15-06-2021']
+URLS = ['/expenses/?limit=100', '/expenses/?start_date=01-06-2020&limit=100',
+        '/expenses/?end_date=31-12-2019&limit=100', '/expenses/?q=snacks&limit=100',
+        '/expenses/?fields=name,date_of_expense&limit=100', '/expenses/?name=sn&limit=3&page=1']
+
+
+class ArchiveTestCase(APITestCase):
+    """Test case for the archive of the old expenses."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        for number, day in enumerate(DAYS):
+            self.client().post('/expenses/', headers=self.headers,
+                               data={'name': 'snacks' if number % 2 else 'soda', 'amount': number + 1,
+                                     'date_of_expense': day})
+        # the expense of another user, archived too
+        self.other = self.user('other@test.com')
+        self.client().post('/expenses/', headers=self.other,
+                           data={'name': 'snacks', 'amount': 5, 'date_of_expense': '01-01-2019'})
+
+    def archive(self, before=datetime.date(2021, 1, 1), batch_size=2):
+        with self.app.app_context():
+            return archive_expenses(before, batch_size)
+
+    def count(self, model):
+        with self.app.app_context():
+            return db.session.execute(select([func.count()]).select_from(model.__table__)).scalar()
+
+    def get(self, url, headers=None):
+        res = self.client().get(url, headers=headers or self.headers)
+        self.assertEqual(res.status_code, 200, url)
+        return json.loads(res.data)
+
+    def pages(self, url):
+        """The items of all the pages of a cursor paginated list."""
+        items, cursor = [], ''
+        while cursor is not None:
+            data = self.get(f'{url}&cursor={cursor}')
+            items += data['items']
+            cursor = data['next_cursor']
+        return items
+
+    def test_archive(self):
+        """Test the expenses dated before the date are moved to the archive, in batches."""
+        self.assertEqual(self.archive(), 5)
+        self.assertEqual(self.count(ExpenseTracker), 3)
+        self.assertEqual(self.count(ArchivedExpense), 5)
+        self.assertEqual(self.archive(), 0)
+
+    def test_lists_include_the_archive(self):
+        """Test the lists are the same before and after archiving."""
+        before = [self.get(url) for url in URLS]
+        cursor_before = self.pages('/expenses/?limit=2')
+        self.archive()
+        for url, expected in zip(URLS, before):
+            self.assertEqual(self.get(url), expected, url)
+        self.assertEqual(self.pages('/expenses/?limit=2'), cursor_before)
+        # the pages are ordered by id across both tables, so none of them repeats or skips a row
+        ids = [item['id'] for page in range(1, 5) for item in self.get(f'/expenses/?limit=2&page={page}')['items']]
+        self.assertEqual(ids, list(range(1, 8)))
+        self.assertEqual(len(self.get('/expenses/', self.other)['items']), 1)
+
+    def test_recent_reads_skip_the_archive(self):
+        """Test the archive is only read when the start date reaches back to it."""
+        self.archive()
+        with self.statements() as recent:
+            self.get('/expenses/?start_date=01-01-2021')
+        with self.statements() as statements:
+            self.get('/expenses/?start_date=01-01-2020')
+        # the archived_until date is read along with the data version, without another query
+        self.assertEqual(len(recent), 2)
+        self.assertIn('archived_until', recent[0])
+        self.assertFalse(any(re.search('"Expense_Tracker_archive"', statement) for statement in recent))
+        self.assertTrue(any('UNION ALL' in statement for statement in statements))
+
+    def test_archived_until(self):
+        """Test archiving keeps the newest date archived for each user."""
+        self.archive()
+        with self.app.app_context():
+            self.assertEqual(archived_until(1), datetime.date(2020, 12, 31))
+            self.assertEqual(archived_until(2), datetime.date(2019, 1, 1))
+        # moving an expense back from the archive leaves it as is
+        self.assertEqual(self.client().delete('/expenses/4', headers=self.headers).status_code, 200)
+        with self.app.app_context():
+            self.assertEqual(archived_until(1), datetime.date(2020, 12, 31))
+
+    def test_export_includes_the_archive(self):
+        """Test the export is the same before and after archiving."""
+        before = self.client().get('/expenses/export?format=ndjson', headers=self.headers).data
+        self.archive()
+        self.assertEqual(self.client().get('/expenses/export?format=ndjson', headers=self.headers).data, before)
+
+    def test_archived_expense(self):
+        """Test an archived expense is read, and moved back to be updated or deleted."""
+        self.archive()
+        self.assertEqual(self.get('/expenses/1')['name'], 'soda')
+        self.assertEqual(self.client().get('/expenses/8', headers=self.headers).status_code, 404)
+
+        res = self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips', 'amount': 10})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.client().delete('/expenses/2', headers=self.headers).status_code, 200)
+        self.assertEqual(self.client().get('/expenses/2', headers=self.headers).status_code, 404)
+        self.assertEqual(self.client().delete('/expenses/8', headers=self.headers).status_code, 404)
+        self.assertEqual(self.get('/expenses/1')['name'], 'chips')
+        self.assertEqual(self.count(ExpenseTracker), 4)
+        self.assertEqual(self.count(ArchivedExpense), 3)
+
+        self.assertEqual(self.get('/yearly_report?year=2019')['consolidated_total'], 10)
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+
+    def test_archived_expense_among_live_ones(self):
+        """Test an archived expense is read from the archive alone, while other users have live expenses."""
+        self.client().post('/expenses/', headers=self.other,
+                           data={'name': 'secret', 'amount': 99, 'date_of_expense': '01-06-2021'})
+        before = self.get('/expenses/2')
+        self.archive()
+        found = self.get('/expenses/2')
+        self.assertEqual((found['id'], found['belongs_to'], found['date_of_expense']),
+                         (2, 1, before['date_of_expense']))
+        self.assertEqual(found, before)
+        self.assertEqual(self.client().get('/expenses/2', headers=self.other).status_code, 404)
+
+    def test_rollups_include_the_archive(self):
+        """Test the daily totals rebuilt from the expenses count the archived ones."""
+        self.archive()
+        with self.app.app_context():
+            totals = sorted((row.belongs_to, row.day, row.total) for row in DailyTotal.query)
+            DailyTotal.rebuild()
+            db.session.commit()
+            self.assertEqual(sorted((row.belongs_to, row.day, row.total) for row in DailyTotal.query), totals)
+            self.assertEqual(DailyTotal.verify(), [])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
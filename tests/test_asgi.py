@@ -0,0 +1,189 @@
+import contextlib
+import json
+import unittest
+from unittest import mock
+# imported as modules, so that their test cases are not collected a second time from here
+import test_archive
+import test_auth
+import test_bulk
+import test_cache
+import test_etags
+import test_export
+import test_metrics
+import test_tracker
+from app.models import DailyTotal
+
+try:
+    from starlette.testclient import TestClient
+    from app.asgi import create_asgi_app, compile_statement
+except ImportError:
+    TestClient = None
+
+
+class ASGIClient(object):
+    """Sends the requests of the test cases to the ASGI app, with the interface of Flask's test client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, url, method='GET', data=None, json=None, headers=None, content_type=None):
+        files = None
+        if content_type == 'multipart/form-data':
+            # the (file, filename) values of Flask's test client are uploads, httpx adds the boundary
+            files = {key: (value[1], value[0]) for key, value in data.items() if isinstance(value, tuple)}
+            data = {key: value for key, value in data.items() if not isinstance(value, tuple)}
+        elif content_type:
+            headers = dict(headers or {}, **{'Content-Type': content_type})
+        if isinstance(data, (str, bytes)):
+            response = self.client.request(method, url, content=data, headers=headers)
+        else:
+            response = self.client.request(method, url, data=data, files=files, json=json, headers=headers)
+        response.data = response.content
+        response.content_type = response.headers.get('content-type', '')
+        response.mimetype = response.content_type.split(';')[0]
+        return response
+
+    def get(self, url, **kwargs):
+        return self.open(url, method='GET', **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.open(url, method='POST', **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.open(url, method='PUT', **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.open(url, method='DELETE', **kwargs)
+
+
+class ASGIMixin(object):
+    """Runs the scenarios of a test case against the ASGI app instead of the FlaskAPI one,
+    from the requests that set up their data on.
+    """
+
+    def setUp(self):
+        if TestClient is None:
+            self.skipTest('the ASGI app needs starlette, asyncpg and httpx')
+        self.asgi_client = None
+        super().setUp()
+        if self.asgi_client is None:
+            # the test cases not based on APITestCase make their client in setUp
+            self.client = self.api_client()
+
+    def api_client(self):
+        self.asgi_app = create_asgi_app('testing')
+        # share the settings and the extensions, so that the scenarios changing them reach the ASGI app
+        self.asgi_app.state.config = self.app.config
+        self.asgi_app.state.extensions = self.app.extensions
+        self.asgi_client = TestClient(self.asgi_app)
+        self.asgi_client.__enter__()
+        return lambda: ASGIClient(self.asgi_client)
+
+    @contextlib.contextmanager
+    def statements(self):
+        """Collects the SQL of the statements the ASGI app runs in the with block."""
+        statements = []
+
+        def capture(stmt):
+            sql, params = compile_statement(stmt)
+            statements.append(sql)
+            return sql, params
+
+        with mock.patch('app.asgi.compile_statement', capture):
+            yield statements
+
+    def tearDown(self):
+        # close the connection pool before the tables are dropped
+        self.asgi_client.__exit__(None, None, None)
+        super().tearDown()
+
+
+class ASGITrackerTestCase(ASGIMixin, test_tracker.TrackerTestCase):
+    """The tracker test case, against the ASGI app."""
+
+
+    def test_writes_keep_daily_totals(self):
+        """Test the writes of the ASGI app keep the daily totals in step with the expenses."""
+        self.register_user()
+        access_token = json.loads(self.login_user().data.decode())['access_token']
+        headers = dict(Authorization="Bearer " + access_token)
+        for day in ['01-01-2021', '02-01-2021', '02-01-2021']:
+            res = self.client().post('/expenses/', headers=headers, data=dict(self.expense, date_of_expense=day))
+            self.assertEqual(res.status_code, 201)
+        self.assertEqual(self.client().put('/expenses/1', headers=headers,
+                                           data={'name': 'soda', 'date_of_expense': '03-01-2021'}).status_code, 200)
+        self.assertEqual(self.client().delete('/expenses/2', headers=headers).status_code, 200)
+
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+            self.assertEqual(sorted((row.day.day, row.count) for row in DailyTotal.query), [(2, 1), (3, 1)])
+
+    def test_page_errors_match_flask(self):
+        """Test the ASGI app answers the pages out of range with the same 404 page as the FlaskAPI app."""
+        self.register_user()
+        access_token = json.loads(self.login_user().data.decode())['access_token']
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client().post('/expenses/', headers=headers, data=self.expense)
+        for url in ['/expenses/?page=0', '/expenses/?limit=0', '/expenses/?page=2&limit=1']:
+            found = self.client().get(url, headers=headers)
+            expected = self.app.test_client().get(url, headers=headers)
+            self.assertEqual(found.status_code, 404, url)
+            self.assertEqual((found.status_code, found.mimetype, found.data),
+                             (expected.status_code, expected.mimetype, expected.data), url)
+
+
+class ASGIAuthTestCase(ASGIMixin, test_auth.AuthTestCase):
+    """The authentication test case, against the ASGI app."""
+
+    def test_hashing_holds_no_connection(self):
+        """Test registering and logging in give the connection back to the pool before hashing the password."""
+        hasher = self.app.extensions['password_hasher']
+        pool = self.asgi_app.state.pool
+        checked_out = []
+        run_async = hasher.run_async
+
+        async def holding(fn, *args):
+            checked_out.append(pool.get_size() - pool.get_idle_size())
+            return await run_async(fn, *args)
+
+        hasher.run_async = holding
+        self.assertEqual(self.client().post('/auth/register', data=self.user_data).status_code, 201)
+        hasher.log_rounds = 5
+        self.assertEqual(self.client().post('/auth/login', data=self.user_data).status_code, 200)
+        # the registration, the login and the new hash of the changed cost
+        self.assertEqual(checked_out, [0, 0, 0])
+
+
+class ASGIEtagsTestCase(ASGIMixin, test_etags.EtagsTestCase):
+    """The conditional GETs test case, against the ASGI app."""
+
+
+class ASGIArchiveTestCase(ASGIMixin, test_archive.ArchiveTestCase):
+    """The archive test case, against the ASGI app."""
+
+
+class ASGIBulkTestCase(ASGIMixin, test_bulk.BulkTestCase):
+    """The test case of the endpoints working on many expenses at once, against the ASGI app."""
+
+
+class ASGIExportTestCase(ASGIMixin, test_export.ExportTestCase):
+    """The export test case, against the ASGI app."""
+
+    def test_same_export_as_the_flask_app(self):
+        """Test the ASGI app exports the same CSV and NDJSON as the FlaskAPI app."""
+        for url in ['/expenses/export', '/expenses/export?format=ndjson&start_date=05-01-2021']:
+            self.assertEqual(self.client().get(url, headers=self.headers).data,
+                             self.app.test_client().get(url, headers=self.headers).data, url)
+
+
+class ASGIReportCacheTestCase(ASGIMixin, test_cache.ReportCacheTestCase):
+    """The report cache test case, against the ASGI app."""
+
+
+class ASGIMetricsTestCase(ASGIMixin, test_metrics.MetricsTestCase):
+    """The request and database metrics test case, against the ASGI app."""
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,11 @@
 import unittest
+import hashlib
 import json
+import threading
+import time
 from app import create_app, db
+from app.auth.hashing import PasswordHasher
+from app.models import User, token_cache
 
 
 class AuthTestCase(unittest.TestCase):
@@ -75,3 +80,80 @@ class AuthTestCase(unittest.TestCase):
         self.assertEqual(
             result['message'], "Invalid email or password, Please try again")
 
+    def test_token_cache(self):
+        """Test verified tokens are cached and still expire."""
+        self.client().post('/auth/register', data=self.user_data)
+        login_res = self.client().post('/auth/login', data=self.user_data)
+        access_token = json.loads(login_res.data.decode())['access_token']
+
+        # the same token may have been issued and cached by another test within the same second
+        token_cache.clear()
+        stats = User.token_cache_stats()
+        self.assertEqual(User.decode_token(access_token), 1)
+        self.assertEqual(User.decode_token(access_token), 1)
+        self.assertEqual(User.token_cache_stats()['misses'], stats['misses'] + 1)
+        self.assertEqual(User.token_cache_stats()['hits'], stats['hits'] + 1)
+
+        # a cached token past its expiry is refused
+        key = hashlib.sha256(access_token.encode()).digest()
+        token_cache.set(key, (1, time.time() - 1), ttl=60)
+        try:
+            self.assertEqual(User.decode_token(access_token), "Expired token. Please login to get a new token")
+        finally:
+            # the other tests may be handed the very same token within the same second
+            token_cache.delete(key)
+
+    def test_rehash_on_login(self):
+        """Test a password hashed with an old bcrypt cost is hashed again when the user logs in."""
+        self.client().post('/auth/register', data=self.user_data)
+        with self.app.app_context():
+            old_hash = User.query.first().password
+        self.assertTrue(old_hash.startswith('$2b$04$'))
+
+        self.app.extensions['password_hasher'].log_rounds = 5
+        login_res = self.client().post('/auth/login', data=self.user_data)
+        self.assertEqual(login_res.status_code, 200)
+        with self.app.app_context():
+            new_hash = User.query.first().password
+        self.assertTrue(new_hash.startswith('$2b$05$'))
+        # the new hash still checks out
+        self.assertEqual(self.client().post('/auth/login', data=self.user_data).status_code, 200)
+
+    def test_hashing_holds_no_connection(self):
+        """Test registering and logging in give the database connection back before hashing the password."""
+        hasher = self.app.extensions['password_hasher']
+        checked_out = []
+
+        def holding(function):
+            def wrapper(*args):
+                checked_out.append(db.get_engine(self.app).pool.checkedout())
+                return function(*args)
+            return wrapper
+
+        hasher.hash = holding(hasher.hash)
+        hasher.verify = holding(hasher.verify)
+        self.assertEqual(self.client().post('/auth/register', data=self.user_data).status_code, 201)
+        hasher.log_rounds = 5
+        self.assertEqual(self.client().post('/auth/login', data=self.user_data).status_code, 200)
+        # the registration, the login and the new hash of the changed cost
+        self.assertEqual(checked_out, [0, 0, 0])
+
+    def test_busy_hasher(self):
+        """Test logins are turned away with a 503 once every hashing slot is taken."""
+        self.client().post('/auth/register', data=self.user_data)
+        hasher = PasswordHasher(log_rounds=4, pool_size=1, queue_size=0)
+        self.app.extensions['password_hasher'] = hasher
+        release = threading.Event()
+        hasher.executor.submit(release.wait)
+        # take the only slot while the only thread is stuck
+        self.assertTrue(hasher.slots.acquire(blocking=False))
+        try:
+            res = self.client().post('/auth/login', data=self.user_data)
+        finally:
+            hasher.slots.release()
+            release.set()
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(json.loads(res.data.decode())['message'], 'The server is busy, please try again')
+        # once the slot is free again the login goes through
+        self.assertEqual(self.client().post('/auth/login', data=self.user_data).status_code, 200)
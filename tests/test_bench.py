@@ -0,0 +1,79 @@
+import unittest
+import datetime
+import random
+from app import create_app, db
+from benchmarks.load import synthetic_expenses, bench, WORKLOAD
+from benchmarks.micro import compare, run
+from benchmarks import report_cache
+
+
+class BenchTestCase(unittest.TestCase):
+    """Test case for the load test harness."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def test_synthetic_expenses(self):
+        """Test the synthetic expenses are reproducible and within the period."""
+        end_date = datetime.date(2021, 6, 30)
+        rows = synthetic_expenses(1, 500, random.Random(3), end_date=end_date, days=365)
+        self.assertEqual(rows, synthetic_expenses(1, 500, random.Random(3), end_date=end_date, days=365))
+        self.assertEqual(len(rows), 500)
+        for row in rows:
+            self.assertTrue(end_date - datetime.timedelta(days=365) <= row['date_of_expense'] <= end_date)
+            self.assertGreater(row['amount_spent'], 0)
+        # more expenses in the recent half of the period
+        recent = sum(1 for row in rows if row['date_of_expense'] > end_date - datetime.timedelta(days=182))
+        self.assertGreater(recent, 250)
+
+    def test_bench_report(self):
+        """Test a small run reports every endpoint without errors, and reuses the seeded users."""
+        report = bench(self.app, users=2, expenses=20, requests=200, concurrency=2, warmup=0)
+        self.assertEqual(report['dataset']['users'], 2)
+        self.assertEqual(report['dataset']['expenses'], 40)
+        self.assertEqual(report['total']['requests'], 200)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(set(report['endpoints']), {operation for operation, _ in WORKLOAD})
+        for stats in report['endpoints'].values():
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+
+        report = bench(self.app, users=2, expenses=20, requests=10, concurrency=1, warmup=0)
+        self.assertEqual(report['dataset']['expenses'], 40)
+
+    def test_micro_benchmarks(self):
+        """Test the micro-benchmarks run and the regressions over the threshold are flagged."""
+        results = run(bcrypt_log_rounds=4, only=['serialize'])
+        self.assertEqual(list(results), ['serialize_page_100'])
+        self.assertGreater(results['serialize_page_100'], 0)
+
+        baseline = {'fast': 1.0, 'slow': 1.0, 'new_in_baseline': 1.0}
+        regressions = compare({'fast': 1.1, 'slow': 1.5, 'new': 9.0}, baseline, threshold=0.2)
+        self.assertEqual(regressions, [('slow', 1.0, 1.5, 1.5)])
+
+    def test_report_cache_benchmark(self):
+        """Test a cached report only reads the data version, and a report without the cache the daily totals too."""
+        results = report_cache.measure(self.app, expenses=20, requests=2)
+        self.assertEqual(set(results), {'monthly_report', 'yearly_report'})
+        for timings in results.values():
+            self.assertEqual(timings['hit'][1], 1)
+            self.assertEqual(timings['rollup'][1], 2)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
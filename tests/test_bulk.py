@@ -0,0 +1,206 @@
+import unittest
+import io
+import json
+import datetime
+from app.archive import archive_expenses
+from app.models import DailyTotal
+from base import APITestCase
+
+
+class BulkTestCase(APITestCase):
+    """Test case for the endpoints working on many expenses at once."""
+
+    def test_bulk_creation(self):
+        """Test API can create many expenses in one request (POST request)."""
+        expenses = [{'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'},
+                    {'name': 'soda', 'amount': 'cazc', 'date_of_expense': '10-01-2021'},
+                    {'name': 'soda', 'amount': 200, 'date_of_expense': '10-01-2021'}]
+        res = self.client().post('/expenses/bulk', headers=self.headers, data=json.dumps(expenses),
+                                 content_type='application/json')
+        self.assertEqual(res.status_code, 201)
+        results = json.loads(res.data)
+        self.assertEqual(results['created'], 2)
+        self.assertEqual(results['errors'], [{'index': 1, 'message': 'the amount entered is not a valid number'}])
+
+        res = self.client().get(f'/expenses/{results["ids"][1]}', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['amount'], 200)
+        res = self.client().get('/monthly_report?month=01-2021', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['consolidated_total'], 212.23)
+
+    def test_bulk_creation_ndjson(self):
+        """Test API can create many expenses sent as NDJSON (POST request)."""
+        lines = '\n'.join([json.dumps({'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'}),
+                           '{"name": ',
+                           json.dumps({'name': 'soda', 'amount': 200, 'date_of_expense': 'fgjfj'})])
+        res = self.client().post('/expenses/bulk', headers=self.headers, data=lines,
+                                 content_type='application/x-ndjson')
+        self.assertEqual(res.status_code, 201)
+        results = json.loads(res.data)
+        self.assertEqual(results['created'], 1)
+        self.assertEqual([error['index'] for error in results['errors']], [1, 2])
+        self.assertEqual(results['errors'][1]['message'], 'The date fgjfj does not match the format DD-MM-YYYY')
+
+    def test_bulk_creation_error(self):
+        """Test API rejects a bulk request without any valid expense (POST request)."""
+        res = self.client().post('/expenses/bulk', headers=self.headers, data=json.dumps({'name': 'snacks'}),
+                                 content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'], 'Please send a list of expenses')
+
+        res = self.client().post('/expenses/bulk', headers=self.headers, data=json.dumps([{'name': ''}]),
+                                 content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['created'], 0)
+
+    def test_bulk_creation_long_name(self):
+        """Test API reports a name too long for its column as the error of its expense (POST request)."""
+        message = 'The name can be at most 255 characters long'
+        expenses = [{'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'},
+                    {'name': 'x' * 300, 'amount': 200, 'date_of_expense': '10-01-2021'}]
+        res = self.client().post('/expenses/bulk', headers=self.headers, data=json.dumps(expenses),
+                                 content_type='application/json')
+        self.assertEqual(res.status_code, 201)
+        results = json.loads(res.data)
+        self.assertEqual(results['created'], 1)
+        self.assertEqual(results['errors'], [{'index': 1, 'message': message}])
+
+        lines = b'name,amount,date_of_expense\n' + b'x' * 300 + b',200,10-01-2021\n'
+        res = self.client().post('/expenses/import', headers=self.headers,
+                                 data={'file': (io.BytesIO(lines), 'expenses.csv')}, content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(json.loads(res.data)['rejected'], [{'line': 2, 'message': message}])
+
+    def test_csv_import(self):
+        """Test API can import expenses from an uploaded CSV file (POST request)."""
+        self.app.config['IMPORT_CHUNK_SIZE'] = 2
+        lines = b'name,amount,date_of_expense\n' \
+                b'snacks,12.23,01-01-2021\n' \
+                b'soda,cazc,10-01-2021\n' \
+                b'soda,200,10-01-2021\n' \
+                b'rent,500,01-02-2021\n'
+        res = self.client().post('/expenses/import', headers=self.headers,
+                                 data={'file': (io.BytesIO(lines), 'expenses.csv')}, content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 201)
+        results = json.loads(res.data)
+        self.assertEqual(results['imported'], 3)
+        self.assertEqual(results['chunks_committed'], 2)
+        self.assertEqual(results['rejected'], [{'line': 3, 'message': 'the amount entered is not a valid number'}])
+
+        res = self.client().get('/monthly_report?month=01-2021', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['consolidated_total'], 212.23)
+
+    def test_csv_import_error(self):
+        """Test API rejects a CSV file without the expected columns (POST request)."""
+        res = self.client().post('/expenses/import', headers=self.headers,
+                                 data={'file': (io.BytesIO(b'a,b\n1,2\n'), 'expenses.csv')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'],
+                         'The CSV file should have a header with name, amount and date_of_expense columns')
+
+    def create_expenses(self):
+        expenses = [{'name': 'snacks', 'amount': 10, 'date_of_expense': '01-01-2021'},
+                    {'name': 'soda', 'amount': 20, 'date_of_expense': '15-01-2021'},
+                    {'name': 'snacks', 'amount': 30, 'date_of_expense': '01-02-2021'},
+                    {'name': 'rent', 'amount': 500, 'date_of_expense': '01-03-2021'}]
+        self.client().post('/expenses/bulk', headers=self.headers, data=json.dumps(expenses),
+                           content_type='application/json')
+
+    def batch(self, method, body, status_code=200):
+        res = self.client().open('/expenses/', method=method, headers=self.headers, data=json.dumps(body),
+                                 content_type='application/json')
+        self.assertEqual(res.status_code, status_code, res.data)
+        return json.loads(res.data)
+
+    def total(self, month):
+        res = self.client().get(f'/monthly_report?month={month}', headers=self.headers)
+        return json.loads(res.data)['consolidated_total']
+
+    def test_batch_update(self):
+        """Test API can update many expenses by id in one request (PATCH request)."""
+        self.create_expenses()
+        etag = self.client().get('/expenses/', headers=self.headers).headers['ETag']
+        with self.statements() as statements:
+            results = self.batch('PATCH', {'ids': [1, 3, 3, 99, 'x'],
+                                           'values': {'amount': 15, 'date_of_expense': '10-02-2021'}})
+        self.assertEqual(results['updated'], 2)
+        self.assertEqual(results['ids'], [1, 3])
+        self.assertEqual(results['errors'], [
+            {'id': 'x', 'message': 'x is not a valid id'},
+            {'id': 99, 'message': 'The Expense with this ID: 99 does not exist'}])
+        self.assertEqual(len([statement for statement in statements
+                              if statement.startswith('UPDATE "Expense_Tracker"')]), 1)
+
+        res = self.client().get('/expenses/3', headers=self.headers)
+        self.assertEqual((json.loads(res.data)['amount'], json.loads(res.data)['name']), (15, 'snacks'))
+        self.assertEqual(self.total('01-2021'), 20)
+        self.assertEqual(self.total('02-2021'), 30)
+        self.assertNotEqual(self.client().get('/expenses/', headers=self.headers).headers['ETag'], etag)
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+
+    def test_batch_update_by_filter(self):
+        """Test API can update the expenses matching a filter in one request (PATCH request)."""
+        self.create_expenses()
+        results = self.batch('PATCH', {'filter': {'name': 'snack', 'end_date': '31-01-2021'},
+                                       'values': {'name': 'chips'}})
+        self.assertEqual((results['updated'], results['ids'], results['errors']), (1, [1], []))
+        res = self.client().get('/expenses/?name=chips', headers=self.headers)
+        self.assertEqual([item['id'] for item in json.loads(res.data)['items']], [1])
+        self.assertEqual(self.total('01-2021'), 30)
+
+    def test_batch_delete(self):
+        """Test API can delete many expenses by id or by filter in one request (DELETE request)."""
+        self.create_expenses()
+        results = self.batch('DELETE', {'ids': [2, 4, 7]})
+        self.assertEqual((results['deleted'], results['ids']), (2, [2, 4]))
+        self.assertEqual([error['id'] for error in results['errors']], [7])
+        self.assertEqual(self.client().get('/expenses/4', headers=self.headers).status_code, 404)
+        self.assertEqual(self.total('03-2021'), 0)
+
+        results = self.batch('DELETE', {'filter': {'start_date': '01-01-2021', 'end_date': '31-01-2021'}})
+        self.assertEqual(results['ids'], [1])
+        self.assertEqual(self.total('01-2021'), 0)
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+
+        # another user's expenses are not found
+        other = self.user('other@test.com')
+        res = self.client().delete('/expenses/', headers=other, data=json.dumps({'ids': [3]}),
+                                   content_type='application/json')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(self.client().get('/expenses/3', headers=self.headers).status_code, 200)
+
+    def test_batch_archived_expenses(self):
+        """Test the archived expenses are updated and deleted like the others."""
+        self.create_expenses()
+        with self.app.app_context():
+            archive_expenses(datetime.date(2021, 2, 1))
+        self.assertEqual(self.batch('PATCH', {'ids': [1, 3], 'values': {'amount': 1}})['ids'], [1, 3])
+        self.assertEqual(self.batch('DELETE', {'filter': {'name': 'soda'}})['ids'], [2])
+        self.assertEqual(self.total('01-2021'), 1)
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+
+    def test_batch_error(self):
+        """Test API rejects batch requests without a selection or valid values."""
+        self.create_expenses()
+        messages = [
+            ('PATCH', {'values': {'name': 'chips'}}, 'Please send either the ids of the expenses or a filter'),
+            ('DELETE', {'ids': [1], 'filter': {'name': 'soda'}},
+             'Please send either the ids of the expenses or a filter'),
+            ('PATCH', {'ids': [1]}, 'The values should be a JSON object with a name, amount or date_of_expense'),
+            ('PATCH', {'ids': [1], 'values': {}}, 'Please enter a name, amount or date_of_expense to set'),
+            ('PATCH', {'ids': [1], 'values': {'amount': 'cazc'}}, 'the amount entered is not a valid number'),
+            ('DELETE', {'ids': 1}, 'Please send a list of at most 10000 ids'),
+            ('DELETE', {'filter': {}}, 'Please filter the expenses by name, start_date or end_date'),
+            ('DELETE', {'filter': {'start_date': 'fgjfj'}}, 'The date fgjfj does not match the format DD-MM-YYYY'),
+        ]
+        for method, body, message in messages:
+            self.assertEqual(self.batch(method, body, 400)['message'], message)
+        self.assertEqual(self.total('01-2021'), 30)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
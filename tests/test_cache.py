@@ -0,0 +1,118 @@
+import unittest
+import json
+from app import create_app, db
+from app.cache import LRUCache, ReportCache, SharedStoreBackend
+from base import APITestCase
+
+
+class LocalStore(object):
+    """Stands in for a redis client, keeping the values in a dict and ignoring expiry."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode()
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """Test case for the size bounded, expiring cache."""
+
+    def setUp(self):
+        self.now = 0
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (3, 1))
+
+    def test_entries_expire(self):
+        self.cache.set('a', 1)
+        self.now = 9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+
+class ReportCacheTestCase(APITestCase):
+    """Test case for caching the monthly and yearly reports."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'})
+
+    def change_totals_behind_the_cache(self):
+        """Changes the daily totals directly in the database, so only the cache still has the old ones."""
+        with self.app.app_context():
+            db.engine.execute('UPDATE daily_totals SET total = 1')
+
+    def consolidated_total(self, url):
+        return json.loads(self.client().get(url, headers=self.headers).data)['consolidated_total']
+
+    def assert_writes_invalidate_touched_periods(self):
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 12.23)
+        self.assertEqual(self.consolidated_total('/yearly_report?year=2021'), 12.23)
+        self.change_totals_behind_the_cache()
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 12.23)
+
+        # a write in another month leaves the January report cached, but not the 2021 one
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'soda', 'amount': 200, 'date_of_expense': '10-02-2021'})
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 12.23)
+        self.assertEqual(self.consolidated_total('/yearly_report?year=2021'), 201)
+
+        # renaming does not change any total, changing the amount does
+        self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips'})
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 12.23)
+        self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips', 'amount': 20})
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 8.77)
+
+    def test_in_process_cache(self):
+        """Test the reports are cached in process and writes invalidate the periods they touch."""
+        self.assert_writes_invalidate_touched_periods()
+
+    def test_shared_store_cache(self):
+        """Test the reports can be cached in a shared store."""
+        store = LocalStore()
+        self.app.extensions['report_cache'] = ReportCache(SharedStoreBackend(store, ttl=300))
+        self.assert_writes_invalidate_touched_periods()
+        # the reports of a version, carried over to the next one but for the periods the write changed
+        self.assertEqual({key: sorted(json.loads(value)) for key, value in store.values.items()}, {
+            'report:1:1': ['2021', '2021-01'],
+            'report:1:2': ['2021', '2021-01'],
+            'report:1:3': ['2021', '2021-01'],
+            'report:1:4': ['2021-01'],
+        })
+
+    def test_hit_reads_the_data_version_only(self):
+        """Test a cached report is sent after reading the data version of the ETag alone."""
+        self.assertEqual(self.consolidated_total('/yearly_report?year=2021'), 12.23)
+        with self.statements() as statements:
+            self.assertEqual(self.consolidated_total('/yearly_report?year=2021'), 12.23)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('data_version', statements[0])
+
+    def test_writes_through_another_instance(self):
+        """Test a write made by another process is not hidden by the reports this one cached."""
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 12.23)
+        other = create_app(config_name="testing")
+        other.test_client().post('/expenses/', headers=self.headers,
+                                 data={'name': 'soda', 'amount': 10, 'date_of_expense': '02-01-2021'})
+        self.assertEqual(self.consolidated_total('/monthly_report?month=01-2021'), 22.23)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import datetime
+import json
+import zlib
+from app import create_app, db
+from app.compression import ResponseCompressor
+from app.encoders import OrjsonEncoder, StdlibEncoder, jsonify, jsonify_stream
+from app.models import ExpenseTracker
+
+
+class CompressionTestCase(unittest.TestCase):
+    """Test case for the compressed and the streamed responses."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        # production responses are compact, debug mode pretty prints them
+        self.app.debug = False
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        result = self.client().post('/auth/login', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.headers = dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+        with self.app.app_context():
+            ExpenseTracker.bulk_insert([{'name': f'snacks {number}', 'amount_spent': number * 1.5,
+                                         'date_of_expense': datetime.date(2021, 1, number % 28 + 1), 'belongs_to': 1}
+                                        for number in range(120)])
+            db.session.commit()
+
+    def get(self, url, encoding=None):
+        headers = dict(self.headers, **{'Accept-Encoding': encoding}) if encoding else self.headers
+        return self.client().get(url, headers=headers)
+
+    def test_negotiated_encodings(self):
+        """Test the responses are compressed with the encoding the client accepts, if any."""
+        body = self.get('/expenses/?limit=100').data
+        res = self.get('/expenses/?limit=100', 'gzip, deflate')
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(zlib.decompress(res.data, 16 + zlib.MAX_WBITS), body)
+        self.assertLess(len(res.data), len(body) / 4)
+
+        res = self.get('/expenses/?limit=100', 'gzip;q=0.5, deflate')
+        self.assertEqual(res.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(res.data), body)
+
+        for encoding in ['identity', 'gzip;q=0', 'br']:
+            res = self.get('/expenses/?limit=100', encoding)
+            self.assertNotIn('Content-Encoding', res.headers, encoding)
+            self.assertEqual(res.data, body)
+
+    def test_small_responses_are_not_compressed(self):
+        """Test the buffered responses under COMPRESS_MIN_SIZE and the 304s are sent as they are."""
+        res = self.get('/expenses/1', 'gzip')
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(json.loads(res.data)['id'], 1)
+
+        res = self.get('/monthly_report?month=01-2021', 'gzip')
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+        res = self.client().get('/monthly_report?month=01-2021', headers=dict(
+            self.headers, **{'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']}))
+        self.assertEqual(res.status_code, 304)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_compression_level(self):
+        """Test the level is configurable, and 0 turns compression off."""
+        sizes = []
+        for level in [1, 9]:
+            self.app.extensions['compressor'] = ResponseCompressor(level, 1024, ['application/json'])
+            sizes.append(len(self.get('/expenses/?limit=100', 'gzip').data))
+        self.assertLessEqual(sizes[1], sizes[0])
+        self.app.extensions['compressor'] = ResponseCompressor(0, 1024, ['application/json'])
+        self.assertNotIn('Content-Encoding', self.get('/expenses/?limit=100', 'gzip').headers)
+
+    def test_streamed_json(self):
+        """Test long lists are streamed, in the same bytes as jsonify, with both encoders."""
+        items = [{'id': number, 'name': f'expense {number}', 'amount': number * 1.25 + 1e-05}
+                 for number in range(60)]
+        payloads = [{'items': items, 'total_items': 60, 'prev_page': None, 'next_page': '/expenses/?page=2'},
+                    {'items': items}, {'items': items[:10], 'next_cursor': None}]
+        for encoder in [OrjsonEncoder(), StdlibEncoder()]:
+            self.app.extensions['json_encoder'] = encoder
+            with self.app.test_request_context():
+                for payload in payloads:
+                    response = jsonify_stream(payload)
+                    self.assertEqual(response.is_streamed, len(payload['items']) >= 50)
+                    self.assertEqual(response.get_data(), jsonify(payload).get_data(), (encoder.name, payload))
+
+        res = self.get('/expenses/?limit=100', 'gzip')
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        body = json.loads(zlib.decompress(res.data, 16 + zlib.MAX_WBITS))
+        self.assertEqual([item['id'] for item in body['items']], list(range(1, 101)))
+        self.assertEqual(body['next_page'], '/expenses/?limit=100&page=2')
+        body = json.loads(zlib.decompress(self.get('/expenses/?limit=100&cursor=', 'gzip').data, 16 + zlib.MAX_WBITS))
+        self.assertEqual(len(body['items']), 100)
+        self.assertIsNotNone(body['next_cursor'])
+
+    def test_streamed_export(self):
+        """Test the streamed exports are compressed chunk by chunk."""
+        self.app.config['EXPORT_BATCH_SIZE'] = 50
+        for export_format in ['csv', 'ndjson']:
+            url = f'/expenses/export?format={export_format}'
+            body = self.get(url).data
+            res = self.get(url, 'gzip')
+            self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(zlib.decompress(res.data, 16 + zlib.MAX_WBITS), body)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
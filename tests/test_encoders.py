@@ -0,0 +1,122 @@
+import unittest
+import datetime
+import json
+import uuid
+from unittest import mock
+from flask import jsonify as flask_jsonify
+from app import create_app, db
+from app.encoders import OrjsonEncoder, StdlibEncoder, response_encoder, jsonify, http_date
+from werkzeug.http import http_date as werkzeug_http_date
+
+NOW = datetime.datetime(2021, 1, 31, 23, 59, 7, 123456)
+
+# payloads covering what the views send and the cases orjson writes differently
+PAYLOADS = [
+    {'items': [{'id': number, 'name': f'expense {number}', 'amount': number * 1.25 + 0.1,
+                'date_of_expense': '31-01-2021', 'date_created': NOW, 'date_modified': NOW,
+                'belongs_to': 1} for number in range(100)],
+     'total_items': 100, 'total_pages': 1, 'prev_page': None, 'next_page': '/expenses/?limit=100&page=2'},
+    {'message': 'Expense 1 deleted successfully', 'status': 'error'},
+    {'day': datetime.date(2020, 2, 29), 'aware': datetime.datetime(2021, 1, 1, 1, 30, tzinfo=datetime.timezone(
+        datetime.timedelta(hours=3)))},
+    {'floats': [0.1, 12.23, 1e16, 1.5e300, 1e-05, 0.0001, 0.00012, -0.0, 5e-324, 123456789012345.6]},
+    {'text': 'café   \x7f \x00 "quoted" \\ / \t\n', 'emoji': '\U0001f600'},
+    {'ints': [0, -1, 2 ** 63, 2 ** 70, True, False, None], 'nested': {'b': [1, {'z': 1, 'a': 2}], 'a': ()}},
+    {'id': uuid.UUID('12345678-1234-5678-1234-567812345678')},
+    [1, 'two', [3.0]],
+    {},
+]
+
+
+class EncodersTestCase(unittest.TestCase):
+    """Test case for the JSON encoders of the responses."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        # production responses are compact, debug mode pretty prints them
+        self.app.debug = False
+        self.client = self.app.test_client
+        self.user_data = {'email': 'user@test.com', 'password': 'test1234'}
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def test_orjson_is_configured(self):
+        """Test the app encodes with orjson, and with the standard library when configured to."""
+        self.assertIsInstance(self.app.extensions['json_encoder'], OrjsonEncoder)
+        self.assertIsInstance(response_encoder({'JSON_BACKEND': 'stdlib'}), StdlibEncoder)
+        self.assertNotIsInstance(response_encoder({'JSON_BACKEND': 'stdlib'}), OrjsonEncoder)
+
+    def test_same_bytes_as_flask(self):
+        """Test both encoders write the bytes Flask's jsonify writes, compact and pretty printed."""
+        encoders = [OrjsonEncoder(), StdlibEncoder()]
+        for debug in (False, True):
+            self.app.debug = debug
+            with self.app.test_request_context():
+                for payload in PAYLOADS:
+                    expected = flask_jsonify(payload).get_data()
+                    for encoder in encoders:
+                        self.app.extensions['json_encoder'] = encoder
+                        self.assertEqual(jsonify(payload).get_data(), expected, (encoder.name, debug, payload))
+
+    def test_keyword_arguments(self):
+        """Test jsonify takes keyword arguments and several arguments like Flask's."""
+        with self.app.test_request_context():
+            self.assertEqual(jsonify(b=1, a=NOW).get_data(), flask_jsonify(b=1, a=NOW).get_data())
+            self.assertEqual(jsonify(1, 2).get_data(), flask_jsonify(1, 2).get_data())
+            self.assertEqual(jsonify(1, 2).mimetype, 'application/json')
+            self.assertRaises(TypeError, jsonify, 1, a=2)
+
+    def test_unserializable(self):
+        """Test the types Flask cannot encode raise a TypeError with both encoders."""
+        for encoder in [OrjsonEncoder(), StdlibEncoder()]:
+            self.assertRaises(TypeError, encoder.dumps, {'a': object()})
+            self.assertRaises(TypeError, encoder.dumps, {'a': datetime.time(1, 2)})
+
+    def test_page_uses_orjson(self):
+        """Test a page of expenses is encoded by orjson, without going through the standard library."""
+        with mock.patch.object(StdlibEncoder, 'dumps', side_effect=AssertionError('encoded by the standard library')):
+            body = OrjsonEncoder().dumps(PAYLOADS[0])
+        self.assertEqual(json.loads(body)['items'][0]['date_created'], 'Sun, 31 Jan 2021 23:59:07 GMT')
+
+    def test_http_date(self):
+        """Test dates and datetimes are formatted like werkzeug's http_date."""
+        aware = datetime.datetime(2021, 1, 1, 1, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+        self.assertEqual(http_date(NOW), werkzeug_http_date(NOW.utctimetuple()))
+        self.assertEqual(http_date(aware), werkzeug_http_date(aware.utctimetuple()))
+        self.assertEqual(http_date(aware), 'Thu, 31 Dec 2020 22:30:00 GMT')
+        self.assertEqual(http_date(datetime.date(2020, 2, 29)), werkzeug_http_date(datetime.date(2020, 2, 29).timetuple()))
+
+    def test_responses_are_unchanged(self):
+        """Test the responses of the views are the same bytes with orjson and the standard library."""
+        self.client().post('/auth/register', data=self.user_data)
+        res = self.client().post('/auth/login', data=self.user_data)
+        headers = dict(Authorization="Bearer " + json.loads(res.data.decode())['access_token'])
+        for number in range(1, 25):
+            self.client().post('/expenses/', headers=headers, data={
+                'name': f'snacks {number}', 'amount': number * 3.1, 'date_of_expense': f'{number:02d}-01-2021'})
+
+        urls = ['/expenses/?limit=100', '/expenses/?limit=10&page=2', '/expenses/?limit=5&cursor=',
+                '/expenses/?q=snacks', '/expenses/1', '/expenses/999', '/monthly_report?month=01-2021',
+                '/yearly_report?year=2021', '/monthly_report?month=2021']
+        responses = {}
+        for encoder in [OrjsonEncoder(), StdlibEncoder()]:
+            self.app.extensions['json_encoder'] = encoder
+            responses[encoder.name] = [self.client().get(url, headers=headers).data for url in urls]
+        self.assertEqual(responses['orjson'], responses['stdlib'])
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import json
+from app import create_app
+from app.models import User
+from base import APITestCase
+
+URLS = ['/expenses/', '/expenses/?limit=5&page=1', '/expenses/?limit=5&cursor=', '/expenses/1',
+        '/monthly_report?month=01-2021', '/yearly_report?year=2021']
+
+
+class EtagsTestCase(APITestCase):
+    """Test case for the conditional GETs of the expenses and the reports."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'})
+
+    def get(self, url, etag=None):
+        headers = dict(self.headers, **{'If-None-Match': etag}) if etag else self.headers
+        return self.client().get(url, headers=headers)
+
+    def data_version(self):
+        with self.app.app_context():
+            return User.query.with_entities(User.data_version).scalar()
+
+    def test_not_modified(self):
+        """Test the GETs send a weak ETag, and a 304 without a body when it matches If-None-Match."""
+        for url in URLS:
+            res = self.get(url)
+            self.assertEqual(res.status_code, 200, url)
+            etag = res.headers['ETag']
+            self.assertTrue(etag.startswith('W/"'), url)
+
+            res = self.get(url, etag)
+            self.assertEqual(res.status_code, 304, url)
+            self.assertEqual(res.headers['ETag'], etag)
+            self.assertEqual(res.data, b'')
+            self.assertEqual(self.get(url, f'"other", {etag}').status_code, 304, url)
+            self.assertEqual(self.get(url, '"other"').status_code, 200, url)
+
+    def test_etags_of_the_query_parameters(self):
+        """Test the ETag depends on the query parameters, but not on their order."""
+        etags = [self.get(url).headers['ETag'] for url in URLS]
+        self.assertEqual(len(set(etags)), len(URLS))
+        self.assertEqual(self.get('/expenses/?page=1&limit=5').headers['ETag'], etags[1])
+
+    def test_writes_change_the_etags(self):
+        """Test every POST, PUT and DELETE bumps the data version, so the old ETags stop matching."""
+        self.assertEqual(self.data_version(), 1)
+        writes = [
+            lambda: self.client().post('/expenses/', headers=self.headers,
+                                       data={'name': 'soda', 'amount': 2, 'date_of_expense': '02-01-2021'}),
+            lambda: self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips'}),
+            lambda: self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips', 'amount': 20}),
+            lambda: self.client().delete('/expenses/2', headers=self.headers),
+        ]
+        for write in writes:
+            self.assert_write_changes_the_etags(write)
+
+    def test_bulk_changes_the_etags(self):
+        """Test the bulk creation bumps the data version."""
+        self.assert_write_changes_the_etags(lambda: self.client().post(
+            '/expenses/bulk', headers=self.headers, content_type='application/json',
+            data=json.dumps([{'name': 'tea', 'amount': 1, 'date_of_expense': '03-01-2021'}])))
+
+    def test_report_written_by_another_instance(self):
+        """Test a report cached before a write made by another instance is not sent under the new ETag."""
+        url = '/monthly_report?month=01-2021'
+        etag = self.get(url).headers['ETag']
+        other = create_app(config_name="testing")
+        other.test_client().post('/expenses/', headers=self.headers,
+                                 data={'name': 'soda', 'amount': 10, 'date_of_expense': '02-01-2021'})
+        res = self.get(url, etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['consolidated_total'], 22.23)
+        self.assertEqual(self.get(url, res.headers['ETag']).status_code, 304)
+
+    def assert_write_changes_the_etags(self, write):
+        etags = [self.get(url).headers['ETag'] for url in URLS]
+        version = self.data_version()
+        self.assertLess(write().status_code, 300)
+        self.assertEqual(self.data_version(), version + 1)
+        for url, etag in zip(URLS, etags):
+            self.assertEqual(self.get(url, etag).status_code, 200, url)
+
+    def test_failed_writes_keep_the_etags(self):
+        """Test the writes that change nothing leave the data version alone."""
+        self.client().put('/expenses/1', headers=self.headers, data={'name': ''})
+        self.client().delete('/expenses/99', headers=self.headers)
+        self.client().post('/expenses/', headers=self.headers, data={'name': 'soda'})
+        self.assertEqual(self.data_version(), 1)
+
+    def test_not_modified_skips_the_query(self):
+        """Test a 304 only reads the data version."""
+        etags = [self.get(url).headers['ETag'] for url in URLS]
+        for url, etag in zip(URLS, etags):
+            with self.statements() as statements:
+                self.assertEqual(self.get(url, etag).status_code, 304, url)
+            self.assertEqual(len(statements), 1, url)
+            self.assertIn('data_version', statements[0])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import csv
+import io
+import json
+from base import APITestCase
+
+
+class ExportTestCase(APITestCase):
+    """Test case for exporting the expenses of a user."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.app.config['EXPORT_BATCH_SIZE'] = 2
+        for name, day in [('snacks', '01-01-2021'), ('soda', '10-01-2021'), ('rent', '01-02-2021')]:
+            self.client().post('/expenses/', headers=self.headers,
+                               data={'name': name, 'amount': 10, 'date_of_expense': day})
+
+    def test_csv_export(self):
+        """Test API can export all the expenses of a user as CSV (GET request)."""
+        res = self.client().get('/expenses/export', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(res.data.decode())))
+        self.assertEqual([row['name'] for row in rows], ['snacks', 'soda', 'rent'])
+        self.assertEqual(rows[1]['date_of_expense'], '10-01-2021')
+
+        # the same dates as the NDJSON export
+        res = self.client().get('/expenses/export?format=ndjson', headers=self.headers)
+        items = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual([(row['date_created'], row['date_modified']) for row in rows],
+                         [(item['date_created'], item['date_modified']) for item in items])
+
+    def test_ndjson_export_with_filters(self):
+        """Test API can export the expenses matching the filters as NDJSON (GET request)."""
+        res = self.client().get('/expenses/export?format=ndjson&start_date=05-01-2021&end_date=01-02-2021',
+                                headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        items = [json.loads(line) for line in res.data.decode().splitlines()]
+        self.assertEqual([item['name'] for item in items], ['soda', 'rent'])
+
+    def test_export_not_modified(self):
+        """Test API answers 304 to an export the client already has, until the expenses change (GET request)."""
+        res = self.client().get('/expenses/export', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        headers = dict(self.headers, **{'If-None-Match': res.headers['ETag']})
+        self.assertEqual(self.client().get('/expenses/export', headers=headers).status_code, 304)
+        self.client().delete('/expenses/1', headers=self.headers)
+        self.assertEqual(self.client().get('/expenses/export', headers=headers).status_code, 200)
+
+    def test_export_error(self):
+        """Test API rejects an unknown export format (GET request)."""
+        res = self.client().get('/expenses/export?format=xml', headers=self.headers)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'], 'The format xml is not supported, use csv or ndjson')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import re
+from app import create_app, db
+from app.metrics import Histogram, requests_total, request_duration, request_db_duration, requests_in_flight
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="[^"]*",?)*\})? -?[0-9.e+-]+$|^[a-z_]+_bucket\{.*le="\+Inf"\} \d+$')
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Test case for the request and database metrics."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def test_request_metrics(self):
+        """Test the requests are counted and timed per route, with the time spent in SQL apart."""
+        count = requests_total.value('registration_view', 'POST', '201')
+        observations = request_duration.value('registration_view', 'POST')[1]
+        db_seconds = request_db_duration.value('registration_view', 'POST')[0]
+
+        res = self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.assertEqual(res.status_code, 201)
+        self.client().get('/expenses/')
+
+        self.assertEqual(requests_total.value('registration_view', 'POST', '201'), count + 1)
+        self.assertEqual(request_duration.value('registration_view', 'POST')[1], observations + 1)
+        self.assertGreater(request_db_duration.value('registration_view', 'POST')[0], db_seconds)
+        self.assertEqual(requests_in_flight.value('registration_view'), 0)
+        self.assertGreaterEqual(requests_total.value('expense', 'GET', '401'), 1)
+
+    def test_metrics_endpoint(self):
+        """Test /metrics renders every metric in the Prometheus text format."""
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.assertEqual(self.client().get('/metrics').status_code, 404)
+        res = self.client().get('/metrics', headers=dict(Authorization="Bearer " + self.app.config['METRICS_TOKEN']))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        text = res.data.decode()
+        for name in ['http_request_duration_seconds', 'http_request_db_duration_seconds', 'http_requests_total',
+                     'http_requests_in_flight', 'db_query_duration_seconds', 'db_pool_connections',
+                     'db_pool_wait_seconds_total', 'token_cache_lookups_total']:
+            self.assertIn(f'# TYPE {name} ', text)
+        self.assertIn('http_requests_total{route="registration_view",method="POST",status="201"}', text)
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                self.assertRegex(line, SAMPLE)
+
+    def test_histogram_buckets(self):
+        """Test the histogram buckets are rendered cumulative."""
+        histogram = Histogram('test_seconds', 'A test histogram.', ['route'], buckets=(0.1, 1))
+        for value in [0.05, 0.1, 0.5, 5]:
+            histogram.observe('a', value=value)
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{route="a",le="0.1"} 2',
+            'test_seconds_bucket{route="a",le="1"} 3',
+            'test_seconds_bucket{route="a",le="+Inf"} 4',
+            'test_seconds_sum{route="a"} 5.65',
+            'test_seconds_count{route="a"} 4',
+        ])
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import datetime
+import json
+from sqlalchemy import select, text
+from app import create_app, db, partitioning
+from app.models import ExpenseTracker
+
+TODAY = datetime.date(2021, 3, 15)
+
+
+class PartitioningTestCase(unittest.TestCase):
+    """Test case for the online conversion of Expense_Tracker to monthly partitions."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            db.session.close()
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('partitioning is only available on PostgreSQL')
+            # a failed test may leave the partitioned table behind
+            with db.engine.begin() as connection:
+                partitioning.discard(connection)
+                connection.execute(f'DROP TABLE IF EXISTS "{partitioning.TABLE}" CASCADE')
+            db.drop_all()
+            db.create_all()
+
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        result = self.client().post('/auth/login', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.headers = dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+        for day in ['10-01-2021', '20-01-2021', '05-02-2021', '01-03-2021']:
+            self.post('snacks', day)
+
+    def post(self, name, day):
+        res = self.client().post('/expenses/', headers=self.headers,
+                                 data={'name': name, 'amount': 10, 'date_of_expense': day})
+        self.assertEqual(res.status_code, 201)
+        return json.loads(res.data)['id']
+
+    def rows(self, table=partitioning.TABLE):
+        with self.app.app_context():
+            return db.engine.execute(text(
+                f'SELECT id, name, amount_spent, date_of_expense FROM "{table}" ORDER BY id')).fetchall()
+
+    def step(self, function, *args, **kwargs):
+        """Runs a function of app.partitioning on a connection of its own, in a transaction unless it
+        makes its own. The requests run outside of the app context, its session would lock the table.
+        """
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                if function in (partitioning.backfill, partitioning.ensure_partitions):
+                    return function(connection, *args, **kwargs)
+                with connection.begin():
+                    return function(connection, *args, **kwargs)
+
+    def convert(self):
+        """Runs the three steps of the conversion, with writes between them."""
+        self.step(partitioning.prepare, months_ahead=2, today=TODAY)
+        # mirrored by the trigger
+        self.post('soda', '12-02-2021')
+        self.client().put('/expenses/1', headers=self.headers, data={'name': 'chips'})
+        self.client().delete('/expenses/2', headers=self.headers)
+        self.assertEqual(self.step(partitioning.backfill, batch_size=2), 4)
+        self.assertEqual(self.rows(partitioning.PARTITIONED), self.rows())
+        # written after the backfill and before the swap
+        self.post('water', '13-03-2021')
+        self.step(partitioning.swap)
+
+    def test_convert(self):
+        """Test the conversion keeps every row and the API keeps working on the partitioned table."""
+        before = self.rows()
+        self.convert()
+        self.assertTrue(self.step(partitioning.is_partitioned))
+        self.assertEqual([name for name, _ in self.step(partitioning.partitions)], [
+            'Expense_Tracker_2021_01', 'Expense_Tracker_2021_02', 'Expense_Tracker_2021_03',
+            'Expense_Tracker_2021_04', 'Expense_Tracker_2021_05', 'Expense_Tracker_default'])
+        self.assertIn('ix_expense_tracker_belongs_to_date_of_expense',
+                      dict(self.step(partitioning.index_definitions, partitioning.TABLE)))
+        self.assertEqual(len(self.rows()), len(before) + 1)
+        self.assertEqual(self.rows()[0].name, 'chips')
+
+        new_id = self.post('tea', '20-04-2021')
+        self.assertGreater(new_id, max(row.id for row in before))
+        # moves the row to another partition
+        res = self.client().put(f'/expenses/{new_id}', headers=self.headers, data={'name': 'tea', 'date_of_expense': '20-01-2021'})
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/expenses/?start_date=01-01-2021&end_date=31-01-2021', headers=self.headers)
+        self.assertEqual([item['name'] for item in json.loads(res.data)['items']], ['chips', 'tea'])
+        self.assertEqual(self.client().delete(f'/expenses/{new_id}', headers=self.headers).status_code, 200)
+        self.assertEqual(self.client().get(f'/expenses/{new_id}', headers=self.headers).status_code, 404)
+        res = self.client().get('/monthly_report?month=03-2021', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['consolidated_total'], 20)
+
+    def test_ensure_partitions(self):
+        """Test the rows of a month without a partition are moved out of the default one with its partition."""
+        self.convert()
+        self.post('later', '01-07-2021')
+        self.assertEqual([row.name for row in self.rows(partitioning.DEFAULT_PARTITION)], ['later'])
+        self.assertEqual(self.step(partitioning.ensure_partitions, 3, today=datetime.date(2021, 5, 2)), [
+            'Expense_Tracker_2021_06', 'Expense_Tracker_2021_07', 'Expense_Tracker_2021_08'])
+        self.assertEqual(self.step(partitioning.ensure_partitions, 3, today=datetime.date(2021, 5, 2)), [])
+        self.assertEqual(self.rows(partitioning.DEFAULT_PARTITION), [])
+        self.assertEqual([row.name for row in self.rows('Expense_Tracker_2021_07')], ['later'])
+
+    def test_ensure_partitions_before_the_conversion(self):
+        """Test the partitions are not created while the table is not partitioned."""
+        self.assertEqual(self.step(partitioning.ensure_partitions, 3), [])
+
+    def test_swap_refuses_to_copy_too_many_rows(self):
+        """Test the swap does not lock the table to copy more rows than allowed, and does once backfilled."""
+        self.step(partitioning.prepare, months_ahead=2, today=TODAY)
+        with self.assertRaises(RuntimeError):
+            self.step(partitioning.swap, maximum_copied=3)
+        self.assertFalse(self.step(partitioning.is_partitioned))
+        self.step(partitioning.backfill, batch_size=2)
+        self.post('water', '13-03-2021')
+        self.step(partitioning.swap, maximum_copied=3)
+        self.assertTrue(self.step(partitioning.is_partitioned))
+        self.assertEqual(len(self.rows()), 5)
+
+    def test_maintainer(self):
+        """Test the app checks the partitions of the coming months at most once per interval."""
+        self.convert()
+        now = [0]
+        with self.app.app_context():
+            maintainer = partitioning.PartitionMaintainer(db.engine, 3, interval=60, timer=lambda: now[0])
+            self.assertTrue(maintainer.due())
+            self.assertFalse(maintainer.due())
+            now[0] = 60
+            self.assertTrue(maintainer.due())
+            self.assertEqual(maintainer.run(today=datetime.date(2021, 5, 2)), [
+                'Expense_Tracker_2021_06', 'Expense_Tracker_2021_07', 'Expense_Tracker_2021_08'])
+
+        app = create_app(config_name="testing")
+        app.config['PARTITION_CHECK_INTERVAL'] = 60
+        partitioning.init_partitions(app)
+        app.test_client().get('/expenses/', headers=self.headers)
+        app.extensions['partition_maintainer'].thread.join()
+        this_month = partitioning.partition_name(partitioning.month_start(datetime.date.today()))
+        self.assertIn(this_month, [name for name, _ in self.step(partitioning.partitions)])
+
+    def test_pruning(self):
+        """Test a query on a date range only reads the partitions of its dates."""
+        self.convert()
+        table = ExpenseTracker.__table__
+        query = select([table.c.id]).where(table.c.belongs_to == 1) \
+            .where(table.c.date_of_expense.between(datetime.date(2021, 2, 1), datetime.date(2021, 2, 28)))
+        with self.app.app_context():
+            compiled = query.compile(dialect=db.engine.dialect)
+            plan = '\n'.join(row[0] for row in db.engine.execute(f'EXPLAIN {compiled}', compiled.params))
+        self.assertIn('Expense_Tracker_2021_02', plan)
+        for name in ['Expense_Tracker_2021_01', 'Expense_Tracker_2021_03', 'Expense_Tracker_default']:
+            self.assertNotIn(name, plan)
+
+    def test_unswap(self):
+        """Test the downgrade puts back a plain table with the rows, mirrored again until discarded."""
+        self.convert()
+        rows = self.rows()
+        self.step(partitioning.unswap)
+        self.assertEqual(self.rows(), rows)
+        self.client().put('/expenses/1', headers=self.headers, data={'name': 'crisps'})
+        self.assertEqual(self.rows(partitioning.PARTITIONED), self.rows())
+        self.step(partitioning.discard)
+        self.assertFalse(self.step(partitioning.is_partitioned, partitioning.PARTITIONED))
+        self.assertEqual(self.client().delete('/expenses/1', headers=self.headers).status_code, 200)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            db.session.remove()
+            with db.engine.begin() as connection:
+                partitioning.discard(connection)
+                # the partitioned table is not the one of the model, drop_all would not drop its partitions
+                connection.execute(f'DROP TABLE IF EXISTS "{partitioning.TABLE}" CASCADE')
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
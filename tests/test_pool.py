@@ -0,0 +1,87 @@
+import unittest
+import json
+import sqlite3
+from sqlalchemy import exc
+from sqlalchemy.pool import StaticPool
+from app import create_app, db
+from app.pool import InstrumentedQueuePool, pool_stats
+
+
+class PoolTestCase(unittest.TestCase):
+    """Test case for the configured connection pool and its statistics."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def test_pool_is_configured(self):
+        """Test the engine gets the pool options of the configuration."""
+        with self.app.app_context():
+            pool = db.engine.pool
+            self.assertIsInstance(pool, InstrumentedQueuePool)
+            self.assertEqual(pool.size(), self.app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'])
+            self.assertEqual(pool._max_overflow, self.app.config['SQLALCHEMY_ENGINE_OPTIONS']['max_overflow'])
+            self.assertTrue(pool._pre_ping)
+
+    def test_pool_stats(self):
+        """Test the pool statistics count the checkouts of the requests."""
+        headers = dict(Authorization="Bearer " + self.app.config['METRICS_TOKEN'])
+        first = json.loads(self.client().get('/pool_stats', headers=headers).data.decode())
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        res = self.client().get('/pool_stats', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        stats = json.loads(res.data.decode())
+        self.assertGreater(stats['checkouts'], first['checkouts'])
+        self.assertEqual(stats['timeouts'], 0)
+        self.assertEqual(stats['pool_size'], 2)
+        for key in ['checked_out', 'checked_in', 'overflow', 'checked_out_max', 'wait_seconds_max', 'pid']:
+            self.assertIn(key, stats)
+
+    def test_pool_stats_need_the_token(self):
+        """Test the pool statistics are only sent with the metrics token, and never without one configured."""
+        for authorization in [None, 'Bearer other', self.app.config['METRICS_TOKEN']]:
+            headers = {'Authorization': authorization} if authorization else {}
+            self.assertEqual(self.client().get('/pool_stats', headers=headers).status_code, 404)
+        self.app.config['METRICS_TOKEN'] = None
+        self.assertEqual(self.client().get('/pool_stats', headers=dict(Authorization='Bearer ')).status_code, 404)
+
+    def test_pool_wait_timeout(self):
+        """Test the checkouts timing out on an exhausted pool are counted."""
+        pool = InstrumentedQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.05)
+        connection = pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        connection.close()
+        pool.connect().close()
+        stats = pool_stats(pool)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['checked_out_max'], 1)
+        self.assertEqual(stats['checked_out'], 0)
+
+    def test_sqlite_ignores_queue_options(self):
+        """Test an SQLite database still gets its own pool with the queue options configured."""
+        app = create_app(config_name="testing")
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        with app.app_context():
+            self.assertIsInstance(db.engine.pool, StaticPool)
+            self.assertEqual(pool_stats(db.engine.pool)['pool'], 'StaticPool')
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
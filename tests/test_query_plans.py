@@ -0,0 +1,116 @@
+import unittest
+import json
+import re
+from sqlalchemy import event
+from app import create_app, db
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """Test case checking that the hot queries are able to use their indexes."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('query plans are only checked on PostgreSQL')
+
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        result = self.client().post('/auth/login', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.headers = dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+        for day in ['01-01-2021', '15-01-2021', '10-02-2021', '10-02-2022']:
+            self.client().post('/expenses/', headers=self.headers,
+                               data={'name': 'snacks', 'amount': 10, 'date_of_expense': day})
+
+    def explain(self, url, table='Expense_Tracker', hidden_indexes=()):
+        """Runs a GET request and returns the query plans of the statements it issued against table.
+        The hidden indexes are dropped, inside a transaction that is rolled back, while explaining.
+        """
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if re.search(f'FROM "?{table}\\b', statement):
+                statements.append((statement, parameters))
+
+        with self.app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                res = self.client().get(url, headers=self.headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+                # the request shares this app context, so end its transaction here
+                db.session.remove()
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(statements)
+
+            plans = []
+            connection = db.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                # the tables are tiny, so make the planner prefer any usable index
+                cursor.execute('SET enable_seqscan = off')
+                for index in hidden_indexes:
+                    cursor.execute(f'DROP INDEX {index}')
+                for statement, parameters in statements:
+                    cursor.execute('EXPLAIN ' + statement, parameters)
+                    plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+            finally:
+                connection.rollback()
+                connection.close()
+            return plans
+
+    def assert_date_range_uses_index(self, plans, index='ix_expense_tracker_belongs_to_date_of_expense',
+                                     column='date_of_expense'):
+        for plan in plans:
+            self.assertIn(index, plan)
+            index_cond = [line for line in plan.splitlines() if 'Index Cond' in line]
+            self.assertTrue(index_cond)
+            self.assertIn(column, index_cond[0])
+
+    def test_monthly_report_uses_index(self):
+        """Test the monthly report reads a date range of the daily totals through their primary key."""
+        self.assert_date_range_uses_index(self.explain('/monthly_report?month=01-2021', table='daily_totals'),
+                                          index='daily_totals_pkey', column='day')
+
+    def test_yearly_report_uses_index(self):
+        """Test the yearly report reads a date range of the daily totals through their primary key."""
+        self.assert_date_range_uses_index(self.explain('/yearly_report?year=2021', table='daily_totals'),
+                                          index='daily_totals_pkey', column='day')
+
+    def test_date_filters_use_index(self):
+        """Test the start and end date filters of the list filter on an indexable date range."""
+        self.assert_date_range_uses_index(self.explain('/expenses/?start_date=01-01-2021&end_date=31-01-2021'))
+
+    def test_ranked_search_uses_index(self):
+        """Test the ranked name search uses the full-text index."""
+        # on a table this small the per user index is just as cheap, so take it out of the picture
+        plans = self.explain('/expenses/?q=snack', hidden_indexes=['ix_expense_tracker_belongs_to_date_of_expense'])
+        for plan in plans:
+            self.assertIn('ix_expense_tracker_name_fts', plan)
+
+    def test_name_filter_uses_index(self):
+        """Test the ILIKE substring match of the name filter uses the trigram index."""
+        with self.app.app_context():
+            if db.session.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar() is None:
+                self.skipTest('pg_trgm is not available')
+        plans = self.explain('/expenses/?name=nack', hidden_indexes=['ix_expense_tracker_belongs_to_date_of_expense'])
+        for plan in plans:
+            self.assertIn('ix_expense_tracker_name_trgm', plan)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
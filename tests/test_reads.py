@@ -0,0 +1,65 @@
+import unittest
+import json
+from app import create_app, db, reads
+
+
+class ReadsTestCase(unittest.TestCase):
+    """Test case for the Core reads of the expenses."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        result = self.client().post('/auth/login', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.headers = dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+        for day in ['01-01-2021', '15-01-2021', '10-02-2021']:
+            self.client().post('/expenses/', headers=self.headers,
+                               data={'name': 'snacks', 'amount': 10, 'date_of_expense': day})
+
+    def test_statements_are_reused(self):
+        """Test the requests differing only by their values reuse the compiled statements."""
+        urls = ['/expenses/1', '/expenses/?limit=2&page={}', '/expenses/?start_date=0{}-01-2021',
+                '/expenses/?q=snack&limit={}', '/expenses/?cursor=&limit={}&fields=id,name']
+        for url in urls:
+            self.assertEqual(self.client().get(url.format(1), headers=self.headers).status_code, 200)
+        compiled = len(reads.compiled_cache)
+        for url in urls:
+            self.assertEqual(self.client().get(url.format(2), headers=self.headers).status_code, 200)
+        self.assertEqual(len(reads.compiled_cache), compiled)
+
+    def test_reads_skip_the_identity_map(self):
+        """Test the reads return rows without loading expenses in the session."""
+        with self.app.app_context():
+            page = reads.expense_page(1, 1, 2)
+            self.assertEqual((page.total, page.pages, len(page.items)), (3, 2, 2))
+            self.assertIsNone(reads.expense_page(1, 3, 2))
+            rows = reads.expenses_after(1, None, 10, ['name'], {'name': '%sn%'})
+            self.assertEqual(reads.items(rows, ['name']), [{'name': 'snacks'}] * 3)
+            self.assertEqual(reads.get_expense(1, 1).name, 'snacks')
+            self.assertIsNone(reads.get_expense(1, 2))
+            self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_past_the_last_page(self):
+        """Test a page past the last one is a 404, like with paginate."""
+        res = self.client().get('/expenses/?limit=2&page=3', headers=self.headers)
+        self.assertEqual(res.status_code, 404)
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
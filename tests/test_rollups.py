@@ -0,0 +1,126 @@
+import unittest
+import datetime
+import json
+import threading
+import time
+from app import create_app, db
+from app.models import DailyTotal, ExpenseTracker
+
+
+class RollupTestCase(unittest.TestCase):
+    """Test case for the daily totals kept up to date on every write."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+        self.client().post('/auth/register', data={'email': 'user@test.com', 'password': 'test1234'})
+        result = self.client().post('/auth/login', data={'email': 'user@test.com', 'password': 'test1234'})
+        self.headers = dict(Authorization="Bearer " + json.loads(result.data.decode())['access_token'])
+
+    def daily_totals(self):
+        with self.app.app_context():
+            return {day.strftime('%d-%m-%Y'): (total, count)
+                    for day, total, count in DailyTotal.query.with_entities(
+                        DailyTotal.day, DailyTotal.total, DailyTotal.count)}
+
+    def test_daily_totals_follow_writes(self):
+        """Test creating, editing and deleting expenses updates the daily totals."""
+        rv = self.client().post('/expenses/', headers=self.headers,
+                                data={'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'})
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'soda', 'amount': 200, 'date_of_expense': '01-01-2021'})
+        self.assertEqual(self.daily_totals(), {'01-01-2021': (212.23, 2)})
+
+        # moving an expense to another day moves its amount along
+        expense_id = json.loads(rv.data)['id']
+        self.client().put(f'/expenses/{expense_id}', headers=self.headers,
+                          data={'name': 'snacks', 'amount': 10, 'date_of_expense': '02-01-2021'})
+        self.assertEqual(self.daily_totals(), {'01-01-2021': (200, 1), '02-01-2021': (10, 1)})
+
+        self.client().delete(f'/expenses/{expense_id}', headers=self.headers)
+        self.assertEqual(self.daily_totals(), {'01-01-2021': (200, 1)})
+
+        res = self.client().get('/monthly_report?month=01-2021', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['items'], [{'date': '01/01/2021', 'total_expenses': 200}])
+
+    def test_non_finite_amounts(self):
+        """Test a NaN or infinite amount is rejected, so the daily totals stay finite."""
+        rv = self.client().post('/expenses/', headers=self.headers,
+                                data={'name': 'snacks', 'amount': 5, 'date_of_expense': '01-10-2020'})
+        expense_id = json.loads(rv.data)['id']
+        for amount in ['nan', 'NaN', 'inf', '-Infinity']:
+            res = self.client().post('/expenses/', headers=self.headers,
+                                     data={'name': 'soda', 'amount': amount, 'date_of_expense': '01-10-2020'})
+            self.assertEqual(res.status_code, 400)
+            res = self.client().put(f'/expenses/{expense_id}', headers=self.headers,
+                                    data={'name': 'snacks', 'amount': amount})
+            self.assertEqual(res.status_code, 400)
+            res = self.client().patch('/expenses/', headers=self.headers,
+                                      data=json.dumps({'ids': [expense_id], 'values': {'amount': amount}}),
+                                      content_type='application/json')
+            self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.daily_totals(), {'01-10-2020': (5, 1)})
+
+        res = self.client().get('/monthly_report?month=10-2020', headers=self.headers)
+        self.assertEqual(json.loads(res.data)['consolidated_total'], 5)
+
+    def test_concurrent_writes(self):
+        """Test concurrent PUTs of an expense move its amount from the day the other one left it on."""
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'snacks', 'amount': 10, 'date_of_expense': '01-01-2021'})
+        with self.app.app_context():
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('SQLite runs one write at a time')
+            # holds the row until both requests wait for it
+            connection = db.engine.connect()
+            transaction = connection.begin()
+            connection.execute(ExpenseTracker.__table__.select().with_for_update())
+            threads = [threading.Thread(target=self.client().put, args=('/expenses/1',), kwargs={
+                'headers': self.headers, 'data': {'name': 'snacks', 'date_of_expense': day}})
+                for day in ['02-01-2021', '03-01-2021']]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.5)
+            transaction.rollback()
+            connection.close()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(DailyTotal.verify(), [])
+        self.assertEqual(len(self.daily_totals()), 1)
+
+    def test_rebuild_and_verify(self):
+        """Test the daily totals can be verified against the expenses and rebuilt."""
+        self.client().post('/expenses/', headers=self.headers,
+                           data={'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'})
+        with self.app.app_context():
+            self.assertEqual(DailyTotal.verify(), [])
+            db.session.execute(DailyTotal.__table__.update().values(total=1))
+            db.session.execute(DailyTotal.__table__.insert().values(
+                belongs_to=1, day=datetime.date(2021, 1, 2), total=5, count=1))
+            self.assertEqual(DailyTotal.verify(), [
+                (1, datetime.date(2021, 1, 1), (12.23, 1), (1, 1)),
+                (1, datetime.date(2021, 1, 2), None, (5, 1))
+            ])
+            DailyTotal.rebuild()
+            db.session.commit()
+            self.assertEqual(DailyTotal.verify(), [])
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
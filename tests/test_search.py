@@ -0,0 +1,30 @@
+import unittest
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+from app.models import ExpenseTracker
+from app.search import search_clauses
+
+
+class SearchTestCase(unittest.TestCase):
+    """Test case for the search clauses of the databases without a full-text index."""
+
+    def test_ilike_fallback(self):
+        """Test the search matches every term with ILIKE and ranks exact matches, then names starting
+        with the search string, then shorter names.
+        """
+        search_filter, order_by = search_clauses(['lunch', 'snacks'], 'sqlite')
+        compiled = select([ExpenseTracker.id]).where(search_filter).order_by(*order_by) \
+            .compile(dialect=sqlite.dialect())
+        name = '"Expense_Tracker".name'
+        self.assertEqual(' '.join(str(compiled).split()),
+                         f'SELECT "Expense_Tracker".id FROM "Expense_Tracker" '
+                         f'WHERE lower({name}) LIKE lower(?) AND lower({name}) LIKE lower(?) '
+                         f'ORDER BY CASE WHEN (lower({name}) = ?) THEN ? '
+                         f'WHEN (lower({name}) LIKE lower(?)) THEN ? ELSE ? END, length({name})')
+        self.assertEqual([compiled.params[key] for key in compiled.positiontup],
+                         ['%lunch%', '%snacks%', 'lunch snacks', 0, 'lunch snacks%', 1, 2])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import datetime
+import json
+import threading
+from unittest import mock
+from app import create_app, db
+from app.archive import archive_expenses
+from app.slow_query import SlowQueryLog, TokenBucket, statement_shape, init_slow_query_log, redact
+
+
+class SlowQueryTestCase(unittest.TestCase):
+    """Test case for the slow query log."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = create_app(config_name="testing")
+        # log every statement, without rate limit
+        self.app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+        self.app.config['SLOW_QUERY_LOG_RATE'] = 1000
+        self.app.config['SLOW_QUERY_LOG_BURST'] = 1000
+        init_slow_query_log(self.app)
+        self.client = self.app.test_client
+        self.expense = {'name': 'snacks', 'amount': 12.23, 'date_of_expense': '01-01-2021'}
+
+        with self.app.app_context():
+            # create all tables
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def get_access_token(self):
+        user = {'email': 'user@test.com', 'password': 'test1234'}
+        self.client().post('/auth/register', data=user)
+        res = self.client().post('/auth/login', data=user)
+        return json.loads(res.data.decode())['access_token']
+
+    def test_slow_query_is_logged_with_plan(self):
+        """Test a slow query is logged once with its route and its plan."""
+        access_token = self.get_access_token()
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client().post('/expenses/', headers=headers, data=self.expense)
+        with self.assertLogs('app.slow_query', level='WARNING') as logs:
+            res = self.client().get('/expenses/?start_date=01-12-2020', headers=headers)
+        self.assertEqual(res.status_code, 200)
+        select = [message for message in logs.output if 'FROM "Expense_Tracker"' in message][0]
+        self.assertIn('Slow query on expense took', select)
+        self.assertIn('Parameters:', select)
+        self.assertIn('actual time', select)
+        self.assertIn('Buffers', select)
+
+        # the plan of the same statement with other parameters is not captured again
+        with self.assertLogs('app.slow_query', level='WARNING') as logs:
+            self.client().get('/expenses/?start_date=01-11-2020', headers=headers)
+        select = [message for message in logs.output if 'FROM "Expense_Tracker"' in message][0]
+        self.assertNotIn('Plan:', select)
+
+    def test_writes_are_not_analyzed(self):
+        """Test the plan of a write is captured without running it again."""
+        access_token = self.get_access_token()
+        headers = dict(Authorization="Bearer " + access_token)
+        with self.assertLogs('app.slow_query', level='WARNING') as logs:
+            self.client().post('/expenses/', headers=headers, data=self.expense)
+        insert = [message for message in logs.output if 'INSERT INTO "Expense_Tracker"' in message][0]
+        self.assertIn('Plan:', insert)
+        self.assertNotIn('actual time', insert)
+        with self.app.app_context():
+            count = db.session.execute('SELECT count(*) FROM "Expense_Tracker"').scalar()
+        self.assertEqual(count, 1)
+
+    def test_writing_ctes_are_not_analyzed(self):
+        """Test the plan of a WITH ... DELETE ... INSERT is captured without running it again."""
+        access_token = self.get_access_token()
+        headers = dict(Authorization="Bearer " + access_token)
+        self.client().post('/expenses/', headers=headers, data=self.expense)
+        with self.app.app_context():
+            with self.assertLogs('app.slow_query', level='WARNING') as logs:
+                self.assertEqual(archive_expenses(datetime.date(2022, 1, 1)), 1)
+            move = [message for message in logs.output if 'WITH moved AS' in message][0]
+            self.assertIn('Plan:', move)
+            self.assertNotIn('actual time', move)
+            self.assertEqual(db.session.execute('SELECT count(*) FROM "Expense_Tracker"').scalar(), 0)
+            self.assertEqual(db.session.execute('SELECT count(*) FROM "Expense_Tracker_archive"').scalar(), 1)
+
+    def test_passwords_are_not_logged(self):
+        """Test the password hashes written to users are left out of the logged parameters."""
+        with self.assertLogs('app.slow_query', level='WARNING') as logs:
+            self.get_access_token()
+        insert = [message for message in logs.output if 'INSERT INTO users' in message][0]
+        self.assertIn("'password': '<redacted>'", insert)
+        self.assertIn("'email': 'user@test.com'", insert)
+        self.assertNotIn('$2b$', '\n'.join(logs.output))
+
+        self.assertEqual(redact([{'password': 'a', 'id': 1}]), [{'password': '<redacted>', 'id': 1}])
+        self.assertEqual(redact(('hash', b'ab', 3)), ['str(4)', 'bytes(2)', 'int'])
+
+    def test_token_bucket(self):
+        """Test the token bucket allows bursts and refills at its rate."""
+        now = [0.0]
+        bucket = TokenBucket(rate=2, burst=3, timer=lambda: now[0])
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+        now[0] = 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        now[0] = 100
+        self.assertEqual([bucket.take() for _ in range(4)], [True, True, True, False])
+
+    def test_dropped_count(self):
+        """Test the statements dropped by the threads sharing the log are all counted."""
+        slow_query_log = SlowQueryLog(0, rate=0, burst=0)
+
+        def run():
+            for _ in range(1000):
+                conn = mock.Mock(info={'slow_query_started': [0.0]})
+                slow_query_log.after_cursor_execute(conn, None, 'SELECT 1', (), None, False)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(slow_query_log.dropped, 8000)
+
+    def test_statement_shape(self):
+        """Test the statements differing by their number of parameters share a shape."""
+        self.assertEqual(
+            statement_shape('SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s, %(id_3)s)'),
+            statement_shape('SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)'))
+        self.assertEqual(
+            statement_shape('INSERT INTO t (a, b) VALUES (%(a_m0)s, %(b_m0)s), (%(a_m1)s, %(b_m1)s)'),
+            statement_shape('INSERT INTO t (a, b) VALUES (%(a_m0)s, %(b_m0)s), (%(a_m1)s, %(b_m1)s), '
+                            '(%(a_m2)s, %(b_m2)s)'))
+        self.assertNotEqual(statement_shape('SELECT a FROM t'), statement_shape('SELECT b FROM t'))
+
+    def tearDown(self):
+        """teardown all initialized variables."""
+        with self.app.app_context():
+            # drop all tables
+            db.session.remove()
+            db.drop_all()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 import unittest
 import os
 import json
+from werkzeug.exceptions import NotFound
 from app import create_app, db
 
 
@@ -221,6 +222,30 @@ class TrackerTestCase(unittest.TestCase):
         self.assertEqual(results['items'][0]['name'], self.expense['name'])
 
 
+    def test_GET_ranked_search(self):
+        """Test API returns the best matches of a search first (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        for name in ['chips', 'lunch and snacks', 'snacks']:
+            res = self.client().post('/expenses/', headers=dict(Authorization="Bearer " + access_token), data=
+            {'name': name, 'amount': 10, 'date_of_expense': '01-01-2021'})
+            self.assertEqual(res.status_code, 201)
+        res = self.client().get('/expenses/?q=snack', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)
+        self.assertEqual([item['name'] for item in results['items']], ['snacks', 'lunch and snacks'])
+
+    def test_GET_ranked_search_error(self):
+        """Test API rejects a search without any words (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        res = self.client().get('/expenses/?q=%20!', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 400)
+        results = json.loads(res.data)
+        self.assertEqual(results['message'], 'Please enter a valid search term')
+
     def test_GET_startdate(self):
         """Test API can get expenses from after start date (GET request)."""
         self.register_user()
@@ -351,6 +376,96 @@ class TrackerTestCase(unittest.TestCase):
         results = json.loads(res.data)
         self.assertEqual(results['message'], f'The date {year} does not match the format YYYY')
 
+    def test_cursor_pagination(self):
+        """Test API can page through expenses with a cursor (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        for day in ['03-01-2021', '01-01-2021', '02-01-2021']:
+            res = self.client().post('/expenses/', headers=dict(Authorization="Bearer " + access_token), data=
+            {'name': 'soda', 'amount': 10, 'date_of_expense': day})
+            self.assertEqual(res.status_code, 201)
+        res = self.client().get('/expenses/?cursor=&limit=2', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)
+        self.assertEqual([item['date_of_expense'] for item in results['items']], ['01-01-2021', '02-01-2021'])
+        self.assertNotIn('total_items', results)
+        self.assertTrue(results['next_cursor'])
+        res = self.client().get(f'/expenses/?cursor={results["next_cursor"]}&limit=2',
+                                headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)
+        self.assertEqual([item['date_of_expense'] for item in results['items']], ['03-01-2021'])
+        self.assertIsNone(results['next_cursor'])
+
+    def test_cursor_pagination_error(self):
+        """Test API rejects a cursor it did not issue (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        cursor = 'sdfg'
+        res = self.client().get(f'/expenses/?cursor={cursor}', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 400)
+        results = json.loads(res.data)
+        self.assertEqual(results['message'], f'The cursor {cursor} is not valid')
+
+    def test_page_pagination_error(self):
+        """Test API answers a page past the last one with the 404 page of abort(404) (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        for day in ['03-01-2021', '01-01-2021', '02-01-2021']:
+            res = self.client().post('/expenses/', headers=dict(Authorization="Bearer " + access_token), data=
+            {'name': 'soda', 'amount': 10, 'date_of_expense': day})
+            self.assertEqual(res.status_code, 201)
+        res = self.client().get('/expenses/?page=3&limit=2', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.mimetype, 'text/html')
+        self.assertEqual(res.data.decode(), NotFound().get_body())
+
+    def test_GET_fields(self):
+        """Test API returns only the fields asked for (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        for day in ['03-01-2021', '01-01-2021', '02-01-2021']:
+            res = self.client().post('/expenses/', headers=dict(Authorization="Bearer " + access_token), data=
+            {'name': 'soda', 'amount': 10, 'date_of_expense': day})
+            self.assertEqual(res.status_code, 201)
+        res = self.client().get('/expenses/?fields=id,name,amount,date_of_expense',
+                                headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)
+        self.assertEqual(results['total_items'], 3)
+        for item in results['items']:
+            self.assertEqual(set(item), {'id', 'name', 'amount', 'date_of_expense'})
+            self.assertEqual(item['amount'], 10)
+        self.assertEqual(sorted(item['date_of_expense'] for item in results['items']),
+                         ['01-01-2021', '02-01-2021', '03-01-2021'])
+
+        # with a cursor, without the date and the id the next cursor is made of
+        res = self.client().get('/expenses/?cursor=&limit=2&fields=name',
+                                headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 200)
+        results = json.loads(res.data)
+        self.assertEqual(results['items'], [{'name': 'soda'}, {'name': 'soda'}])
+        res = self.client().get(f'/expenses/?cursor={results["next_cursor"]}&limit=2&fields=date_of_expense',
+                                headers=dict(Authorization="Bearer " + access_token))
+        results = json.loads(res.data)
+        self.assertEqual(results['items'], [{'date_of_expense': '03-01-2021'}])
+
+    def test_GET_fields_error(self):
+        """Test API rejects unknown fields (GET request)."""
+        self.register_user()
+        result = self.login_user()
+        access_token = json.loads(result.data.decode())['access_token']
+        res = self.client().get('/expenses/?fields=id,password', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 400)
+        results = json.loads(res.data)
+        self.assertTrue(results['message'].startswith('Unknown fields: password.'))
+        res = self.client().get('/expenses/?fields=', headers=dict(Authorization="Bearer " + access_token))
+        self.assertEqual(res.status_code, 400)
+
     # Make the tests conveniently executable
     if __name__ == "__main__":
         unittest.main()